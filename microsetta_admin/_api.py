@@ -1,6 +1,18 @@
 """Heavily derived from https://github.com/biocore/microsetta-private-api/blob/minimalInterface/microsetta_private_api/example/client_impl.py"""  # noqa
 
+import asyncio
+import contextvars
+import os
+import ssl
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 import requests
+from requests.adapters import HTTPAdapter
+from microsetta_admin import profile_util
 from microsetta_admin.config_manager import SERVER_CONFIG
 from flask import redirect, session
 from urllib.parse import urljoin
@@ -8,6 +20,26 @@ from urllib.parse import urljoin
 
 TOKEN_KEY_NAME = 'token'
 
+# work performed outside of a request, such as a background job, has no
+# session and must instead provide its token explicitly
+_EXPLICIT_TOKEN = contextvars.ContextVar('explicit_token', default=None)
+
+
+@contextmanager
+def api_token(token):
+    """Authenticate requests made within the block with a specific token
+
+    Parameters
+    ----------
+    token : str
+        The token to use in place of the one held by the session
+    """
+    reset = _EXPLICIT_TOKEN.set(token)
+    try:
+        yield
+    finally:
+        _EXPLICIT_TOKEN.reset(reset)
+
 
 class BearerAuth(requests.auth.AuthBase):
     def __init__(self, token):
@@ -18,10 +50,91 @@ class BearerAuth(requests.auth.AuthBase):
         return r
 
 
+class PooledHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter which shares a single, preloaded SSL context
+
+    Loading a CA bundle is comparatively expensive, so the bundle is read
+    once when the adapter is constructed rather than for every new
+    connection the pool opens.
+    """
+    def __init__(self, cafile=None, **kwargs):
+        self.ssl_context = ssl.create_default_context(
+            cafile=cafile if cafile else requests.certs.where())
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+
+        # the CA bundle is already present in our SSL context, so prevent
+        # urllib3 from loading it again on each new connection
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
+
+
 class APIRequest:
     API_URL = SERVER_CONFIG["private_api_url"]
     DEFAULT_PARAMS = {'language_tag': 'en-US'}
     CAfile = SERVER_CONFIG["CAfile"]
+    POOL_CONNECTIONS = SERVER_CONFIG.get("api_pool_connections", 4)
+    POOL_MAXSIZE = SERVER_CONFIG.get("api_pool_maxsize", 16)
+
+    # a requests.Session is not safe to share across a fork, so the session
+    # is tracked alongside the process which created it. This ensures each
+    # gunicorn worker maintains its own connection pool.
+    _session = None
+    _session_pid = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls):
+        """Obtain the keep-alive session for the current process
+
+        Returns
+        -------
+        requests.Session
+            A session whose connections are pooled and reused across
+            requests to the private API
+        """
+        pid = os.getpid()
+        if cls._session is None or cls._session_pid != pid:
+            with cls._session_lock:
+                if cls._session is None or cls._session_pid != pid:
+                    cls._session = cls._build_session()
+                    cls._session_pid = pid
+
+        return cls._session
+
+    @classmethod
+    def _build_session(cls):
+        adapter = PooledHTTPAdapter(cafile=cls.CAfile,
+                                    pool_connections=cls.POOL_CONNECTIONS,
+                                    pool_maxsize=cls.POOL_MAXSIZE)
+
+        api_session = requests.Session()
+        api_session.mount('https://', adapter)
+        api_session.mount('http://', adapter)
+
+        # verification against CAfile is performed through the adapter's
+        # SSL context
+        api_session.verify = True
+        return api_session
+
+    @staticmethod
+    def get_token():
+        """The token to authenticate with
+
+        Returns
+        -------
+        str
+            The token provided through api_token, if any, and otherwise the
+            token held by the session
+        """
+        token = _EXPLICIT_TOKEN.get()
+        return session[TOKEN_KEY_NAME] if token is None else token
 
     @classmethod
     def build_params(cls, params):
@@ -36,6 +149,10 @@ class APIRequest:
     def _check_response(response):
         output = None
 
+        if profile_util.is_profiling():
+            profile_util.record(calls=1, bytes=len(response.content),
+                                errors=int(response.status_code >= 400))
+
         if response.status_code == 401:
             # redirect to home page for login
             output = redirect("/")
@@ -52,20 +169,18 @@ class APIRequest:
 
     @classmethod
     def get(cls, path, params=None):
-        response = requests.get(
+        response = cls.get_session().get(
             urljoin(cls.API_URL, path),
-            auth=BearerAuth(session[TOKEN_KEY_NAME]),
-            verify=cls.CAfile,
+            auth=BearerAuth(cls.get_token()),
             params=cls.build_params(params))
 
         return cls._check_response(response)
 
     @classmethod
     def put(cls, path, params=None, json=None):
-        response = requests.put(
+        response = cls.get_session().put(
             urljoin(cls.API_URL, path),
-            auth=BearerAuth(session[TOKEN_KEY_NAME]),
-            verify=cls.CAfile,
+            auth=BearerAuth(cls.get_token()),
             params=cls.build_params(params),
             json=json)
 
@@ -73,10 +188,136 @@ class APIRequest:
 
     @classmethod
     def post(cls, path, params=None, json=None):
-        response = requests.post(
+        response = cls.get_session().post(
             urljoin(cls.API_URL, path),
-            auth=BearerAuth(session[TOKEN_KEY_NAME]),
-            verify=cls.CAfile,
+            auth=BearerAuth(cls.get_token()),
             params=cls.build_params(params),
             json=json)
         return cls._check_response(response)
+
+
+class AsyncAPIRequest:
+    """An asyncio client of the private API
+
+    Routes which require several upstream requests may issue them
+    concurrently from a single worker, rather than paying for each in
+    sequence. Requests are made through the keep-alive session of
+    APIRequest, and so share its connection pool, from a pool of threads
+    shared by the process. The number of requests outstanding from an event
+    loop is bounded by MAX_CONCURRENCY.
+
+    As with APIRequest, each request returns the status code and the
+    output of APIRequest._check_response. The token to authenticate with is
+    obtained when a request is created, rather than when it is awaited, so
+    requests may be created within a Flask request and awaited elsewhere.
+
+    Examples
+    --------
+    >>> (_, sample), (_, observations) = AsyncAPIRequest.gather(
+    ...     AsyncAPIRequest.get('/api/admin/search/samples/000004216'),
+    ...     AsyncAPIRequest.get('/api/admin/scan/observations/000004216'))
+    """
+    MAX_CONCURRENCY = SERVER_CONFIG.get("api_max_concurrency",
+                                        APIRequest.POOL_MAXSIZE)
+
+    # as with the API session, threads do not survive a fork so each
+    # process maintains its own pool
+    _executor = None
+    _executor_pid = None
+    _executor_lock = threading.Lock()
+
+    # asyncio primitives are bound to a single event loop
+    _semaphores = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def _get_executor(cls):
+        pid = os.getpid()
+        with cls._executor_lock:
+            if cls._executor is None or cls._executor_pid != pid:
+                # a thread per pooled connection
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=APIRequest.POOL_MAXSIZE,
+                    thread_name_prefix='api')
+                cls._executor_pid = pid
+            return cls._executor
+
+    @classmethod
+    def _get_semaphore(cls):
+        loop = asyncio.get_running_loop()
+        semaphore = cls._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(cls.MAX_CONCURRENCY)
+            cls._semaphores[loop] = semaphore
+        return semaphore
+
+    @classmethod
+    async def _request(cls, method, path, token, params=None, json=None):
+        send = partial(getattr(APIRequest.get_session(), method),
+                       urljoin(APIRequest.API_URL, path),
+                       auth=BearerAuth(token),
+                       params=APIRequest.build_params(params))
+        if json is not None:
+            send = partial(send, json=json)
+
+        async with cls._get_semaphore():
+            response = await asyncio.get_running_loop().run_in_executor(
+                cls._get_executor(), send)
+
+        # the response is checked within the caller's context so that it is
+        # attributed to any active profile
+        return APIRequest._check_response(response)
+
+    @classmethod
+    def get(cls, path, params=None):
+        """Create a GET request
+
+        Returns
+        -------
+        coroutine
+            Resolves to the status code and output of the request
+        """
+        return cls._request('get', path, APIRequest.get_token(),
+                            params=params)
+
+    @classmethod
+    def put(cls, path, params=None, json=None):
+        """Create a PUT request
+
+        Returns
+        -------
+        coroutine
+            Resolves to the status code and output of the request
+        """
+        return cls._request('put', path, APIRequest.get_token(),
+                            params=params, json=json)
+
+    @classmethod
+    def post(cls, path, params=None, json=None):
+        """Create a POST request
+
+        Returns
+        -------
+        coroutine
+            Resolves to the status code and output of the request
+        """
+        return cls._request('post', path, APIRequest.get_token(),
+                            params=params, json=json)
+
+    @staticmethod
+    def gather(*requests):
+        """Issue requests concurrently from synchronous code
+
+        Parameters
+        ----------
+        requests : coroutine
+            The requests to issue
+
+        Returns
+        -------
+        list
+            The status code and output of each request, in the order given
+        """
+        async def gather():
+            return await asyncio.gather(*requests)
+
+        return asyncio.run(gather())
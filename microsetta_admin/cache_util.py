@@ -0,0 +1,128 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache:
+    """A thread-safe, size bounded cache whose entries expire
+
+    Entries are evicted in least-recently-used order once the cache holds
+    more than maxsize entries, and are treated as absent once older than
+    ttl seconds.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of entries to retain
+    ttl : float
+        The number of seconds an entry remains valid
+    timer : callable, optional
+        The clock to use, primarily to allow for testing
+    """
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+
+    @property
+    def version(self):
+        """The number of invalidations the cache has observed
+
+        A caller which obtains a value from an upstream source can note the
+        version prior to the request, and pass it to set. If the cache was
+        invalidated while the request was in flight, the possibly stale
+        value is discarded rather than stored.
+        """
+        return self._version
+
+    def get(self, key, default=None):
+        """Obtain a value if present and not expired
+
+        Parameters
+        ----------
+        key : hashable
+            The key to look up
+        default : object, optional
+            The value to return if the key is absent or expired
+
+        Returns
+        -------
+        object
+            The cached value, or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires <= self._timer():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, version=None):
+        """Store a value
+
+        Parameters
+        ----------
+        key : hashable
+            The key to store under
+        value : object
+            The value to store
+        version : int, optional
+            The version of the cache observed before the value was
+            obtained. If the cache has since been invalidated, the value is
+            not stored.
+
+        Returns
+        -------
+        bool
+            Whether the value was stored
+        """
+        with self._lock:
+            if version is not None and version != self._version:
+                return False
+
+            self._data[key] = (self._timer() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+            return True
+
+    def invalidate(self, predicate=None):
+        """Remove entries from the cache
+
+        Parameters
+        ----------
+        predicate : callable, optional
+            A function which accepts a key and returns True if the entry
+            should be removed. If not specified, all entries are removed.
+        """
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+            else:
+                for key in [k for k in self._data if predicate(k)]:
+                    del self._data[key]
+
+            self._version += 1
+
+    def clear(self):
+        """Remove all entries from the cache"""
+        self.invalidate()
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
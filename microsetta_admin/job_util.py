@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import secrets
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+from microsetta_admin.config_manager import SERVER_CONFIG
+
+# job state is kept on disk so that any worker process on the host can
+# report on, or serve the result of, a job regardless of which ran it
+JOB_DIR = SERVER_CONFIG.get("job_dir") or os.path.join(
+    tempfile.gettempdir(), 'microsetta_admin_jobs')
+
+# the number of jobs each process runs at a time. Additional jobs are
+# queued.
+JOB_WORKERS = SERVER_CONFIG.get("job_workers", 2)
+
+# the number of seconds a finished job, and its result, are retained
+JOB_MAX_AGE = SERVER_CONFIG.get("job_max_age", 86400)
+
+# the minimum number of seconds between writes of a job's progress
+PROGRESS_INTERVAL = 0.5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETE = 'complete'
+FAILED = 'failed'
+ACTIVE_STATES = frozenset([QUEUED, RUNNING])
+
+STATUS_FILENAME = 'status.json'
+RESULT_FILENAME = 'result'
+
+VALID_JOB_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+# fields of a job's state used to manage it, which are not reported to users
+INTERNAL_FIELDS = frozenset(['host', 'pid', 'owner'])
+
+
+class Job:
+    """The persisted state of a background job
+
+    Parameters
+    ----------
+    root : str
+        The directory holding all jobs
+    job_id : str
+        The ID of the job
+    """
+    def __init__(self, root, job_id):
+        self.job_id = job_id
+        self.path = os.path.join(root, job_id)
+        self.status_path = os.path.join(self.path, STATUS_FILENAME)
+        self.result_path = os.path.join(self.path, RESULT_FILENAME)
+        self._lock = threading.Lock()
+        self._status = None
+        self._last_write = 0
+
+    def status(self):
+        """Obtain the state of the job
+
+        Returns
+        -------
+        dict or None
+            The state of the job, or None if the job does not exist. Jobs
+            left active by a process which no longer exists are reported as
+            failed.
+        """
+        try:
+            with open(self.status_path) as fp:
+                status = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if status['state'] in ACTIVE_STATES and _is_orphaned(status):
+            status['state'] = FAILED
+            status['message'] = "The job was interrupted"
+
+        return status
+
+    def public_status(self):
+        """Obtain the state of the job which may be reported to its owner
+
+        Returns
+        -------
+        dict or None
+            The state of the job without INTERNAL_FIELDS, or None if the
+            job does not exist
+        """
+        status = self.status()
+        if status is None:
+            return None
+        return {k: v for k, v in status.items() if k not in INTERNAL_FIELDS}
+
+    @property
+    def state(self):
+        """The state of the job as last set by this process"""
+        with self._lock:
+            return self._current().get('state')
+
+    def update(self, **fields):
+        """Update and persist the state of the job
+
+        Parameters
+        ----------
+        fields : dict
+            The fields of the state to set
+        """
+        with self._lock:
+            self._current().update(fields)
+            self._write()
+
+    def increment(self, append=None, **counts):
+        """Update counters of the job's progress
+
+        The state is persisted at most every PROGRESS_INTERVAL seconds, and
+        is always persisted by a subsequent call to update.
+
+        Parameters
+        ----------
+        append : dict, optional
+            Values to append to list fields of the state
+        counts : dict
+            The amount to add to each counter
+        """
+        with self._lock:
+            status = self._current()
+            for key, count in counts.items():
+                status[key] = status.get(key, 0) + count
+            for key, value in (append or {}).items():
+                status.setdefault(key, []).append(value)
+
+            if time.monotonic() - self._last_write >= PROGRESS_INTERVAL:
+                self._write()
+
+    def _current(self):
+        if self._status is None:
+            self._status = self.status() or {}
+        return self._status
+
+    def _write(self):
+        status = self._current()
+        status['updated'] = time.time()
+
+        # write then move so that readers never observe a partial file
+        tmp = '%s.%d.%d' % (self.status_path, os.getpid(),
+                            threading.get_ident())
+        with open(tmp, 'w') as fp:
+            json.dump(status, fp, default=str)
+        os.replace(tmp, self.status_path)
+        self._last_write = time.monotonic()
+
+
+class JobRunner:
+    """Run functions in the background, persisting their state to disk
+
+    Parameters
+    ----------
+    root : str, optional
+        The directory to hold jobs. If not specified, JOB_DIR is used.
+    max_workers : int, optional
+        The number of jobs to run at a time within a process. If not
+        specified, JOB_WORKERS is used.
+    max_age : float, optional
+        The number of seconds to retain finished jobs. If not specified,
+        JOB_MAX_AGE is used.
+    """
+    def __init__(self, root=None, max_workers=None, max_age=None):
+        self.root = JOB_DIR if root is None else root
+        self.max_workers = JOB_WORKERS if max_workers is None else max_workers
+        self.max_age = JOB_MAX_AGE if max_age is None else max_age
+
+        # as with the API session, threads do not survive a fork so each
+        # process maintains its own pool
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def _get_executor(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='job')
+                self._executor_pid = pid
+                self._futures = {}
+            return self._executor
+
+    def submit(self, func, *args, owner=None, **kwargs):
+        """Queue a function to run in the background
+
+        Parameters
+        ----------
+        func : callable
+            The function to run. It is provided the Job as its first
+            argument, followed by args and kwargs. It may record progress
+            through the Job, and write its output to Job.result_path.
+            Unless the function updates the state to FAILED, the job is
+            considered COMPLETE once it returns.
+        args : list
+            Positional arguments to func
+        owner : str, optional
+            The user who submitted the job, recorded to its state so that
+            access to the job may be restricted to them
+        kwargs : dict
+            Keyword arguments to func
+
+        Returns
+        -------
+        Job
+            The queued job
+        """
+        self.purge()
+
+        job_id = secrets.token_urlsafe(16)
+        job = Job(self.root, job_id)
+
+        # results hold metadata, so are only accessible to the owner of the
+        # process
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        os.makedirs(job.path, mode=0o700)
+        job.update(job_id=job_id, state=QUEUED, created=time.time(),
+                   host=socket.gethostname(), pid=os.getpid(), owner=owner)
+
+        future = self._get_executor().submit(self._run, job, func, args,
+                                             kwargs)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda _: self._futures.pop(job_id, None))
+        return job
+
+    @staticmethod
+    def _run(job, func, args, kwargs):
+        job.update(state=RUNNING, started=time.time())
+        try:
+            func(job, *args, **kwargs)
+        except Exception as e:  # noqa
+            job.update(state=FAILED, message=str(e), finished=time.time())
+        else:
+            if job.state == RUNNING:
+                job.update(state=COMPLETE, finished=time.time())
+
+    def get(self, job_id):
+        """Obtain a job
+
+        Parameters
+        ----------
+        job_id : str
+            The ID of the job
+
+        Returns
+        -------
+        Job or None
+            The job, or None if it does not exist
+        """
+        if not VALID_JOB_ID.fullmatch(job_id or ''):
+            return None
+
+        job = Job(self.root, job_id)
+        if job.status() is None:
+            return None
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job running in this process finishes
+
+        Parameters
+        ----------
+        job_id : str
+            The ID of the job
+        timeout : float, optional
+            The maximum number of seconds to wait
+        """
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.exception(timeout=timeout)
+
+    def purge(self):
+        """Remove finished jobs older than max_age"""
+        if not os.path.isdir(self.root):
+            return
+
+        cutoff = time.time() - self.max_age
+        for job_id in os.listdir(self.root):
+            status = Job(self.root, job_id).status()
+            if status is None or status['state'] in ACTIVE_STATES:
+                continue
+            if status['updated'] < cutoff:
+                shutil.rmtree(os.path.join(self.root, job_id),
+                              ignore_errors=True)
+
+
+def _is_orphaned(status):
+    # a job is orphaned if the process which was to run it on this host has
+    # exited, such as through a restart of the web server
+    if status.get('host') != socket.gethostname():
+        return False
+
+    try:
+        os.kill(status['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
@@ -1,5 +1,9 @@
+from microsetta_admin.config_manager import SERVER_CONFIG
 from microsetta_admin.metadata_constants import MISSING_VALUE
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
+import calendar
+import re
 from operator import or_
 import pandas as pd
 import numpy as np
@@ -23,15 +27,54 @@ KILOGRAMS = 'kilograms'
 ALCOHOL_CONSUMPTION = 'alcohol_consumption'
 ALCOHOL_FREQUENCY = 'alcohol_frequency'
 
+# lowercase full month names, as accepted by a "%B" format, and their
+# corresponding month numbers
+MONTH_NUMBERS = {name.lower(): number
+                 for number, name in enumerate(calendar.month_name)
+                 if name}
+
+# the years accepted by a "%Y" format
+FOUR_DIGITS = re.compile(r'\d{4}')
+
+# the range of days representable by a pd.Timestamp
+MIN_DAY = np.datetime64(pd.Timestamp.min.date())
+MAX_DAY = np.datetime64(pd.Timestamp.max.date())
+
+# the maximum number of independent transforms to run concurrently
+TRANSFORM_WORKERS = SERVER_CONFIG.get("metadata_transform_workers", 4)
+
+# columns whose number of distinct values is at most this fraction of the
+# number of samples are represented as categorical
+CATEGORICAL_MAX_FRACTION = 0.5
+
 
 class Transformer:
     REQUIRED_COLUMNS = None
     COLUMN_NAME = None
-    EXISTING_UNITS_COL_UPDATE = None
 
     @classmethod
     def satisfies_requirements(cls, df):
-        return cls.REQUIRED_COLUMNS.issubset(set(df.columns))
+        return cls.satisfied_by(df.columns)
+
+    @classmethod
+    def satisfied_by(cls, columns):
+        """Whether the transform can run given the columns available"""
+        return cls.inputs().issubset(set(columns))
+
+    @classmethod
+    def inputs(cls):
+        """The columns read by the transform"""
+        return cls.REQUIRED_COLUMNS
+
+    @classmethod
+    def outputs(cls):
+        """The columns created or modified by the transform"""
+        return frozenset([cls.COLUMN_NAME])
+
+    @classmethod
+    def produces(cls, columns):
+        """The columns created or modified given the columns available"""
+        return cls.outputs()
 
     @classmethod
     def apply(cls, df):
@@ -68,12 +111,9 @@ class BMI(Transformer):
         height /= 100  # covert to meters
         height *= height  #
 
-        not_null_map = cls.not_null_map(weight, height)
-
-        series = cls.basis(df.index)
-        series.loc[not_null_map] = \
-            (weight.loc[not_null_map] / height.loc[not_null_map]).round(1)
-
+        # null values propagate through the arithmetic as NaN
+        series = (weight / height).round(1)
+        series.name = cls.COLUMN_NAME
         return series
 
 
@@ -84,92 +124,263 @@ class AgeYears(Transformer):
 
     @classmethod
     def _transform(cls, df):
-        def make_month_year(row):
-            # TODO: this function can probably be greatly reduced
-            # if only applied to positions which assessed to be not null
-            # prior
-            mo = row[BIRTH_MONTH]
-            yr = row[BIRTH_YEAR]
-            if pd.isnull(mo) or pd.isnull(yr):
-                return '-'
-            else:
-                return '%s-%s' % (mo, yr)
-
-        birth_month_year = df.apply(make_month_year, axis=1)
-        birth_month_year = pd.to_datetime(birth_month_year, errors='coerce',
-                                          format='%B-%Y')
-        collection_timestamp = pd.to_datetime(df[COLLECTION_TIMESTAMP],
-                                              errors='coerce')
-
-        not_null_map = cls.not_null_map(birth_month_year, collection_timestamp)
-
-        series = cls.basis(df.index)
-
-        collection_timestamp = collection_timestamp[not_null_map]
-        birth_month_year = birth_month_year[not_null_map]
+        birth_month_year = cls.birth_month_year(df[BIRTH_MONTH],
+                                                df[BIRTH_YEAR])
+        collection_timestamp = _to_datetime(df[COLLECTION_TIMESTAMP])
 
-        # compute timedelta64 types, and express as year
+        # compute timedelta64 types, and express as year. NaT in either
+        # operand propagates as NaN
         td = collection_timestamp - birth_month_year
-        td_as_year = (td / np.timedelta64(1, 'Y')).round(1)
-        series.loc[not_null_map] = td_as_year
-
+        series = (td / np.timedelta64(1, 'Y')).round(1)
+        series.name = cls.COLUMN_NAME
         return series
 
+    @classmethod
+    def birth_month_year(cls, birth_month, birth_year):
+        """Parse birth months and years into timestamps
 
-class AgeCat(Transformer):
-    REQUIRED_COLUMNS = frozenset([AGE_YEARS, ])
-    COLUMN_NAME = AGE_CAT
+        This is equivalent to parsing "<month>-<year>" with a "%B-%Y"
+        format. However, only positions where both the month and the year
+        are present are considered, and as these columns have few distinct
+        values, each distinct value is parsed only once.
+
+        Parameters
+        ----------
+        birth_month : pd.Series
+            Full month names, such as "July"
+        birth_year : pd.Series
+            Four digit years
+
+        Returns
+        -------
+        pd.Series
+            The first day of the birth month, or NaT if unparseable
+        """
+        not_null_map = cls.not_null_map(birth_month, birth_year).to_numpy()
+
+        month = _parse_distinct(birth_month[not_null_map], _parse_month)
+        year = _parse_distinct(birth_year[not_null_map], _parse_year)
+        parsed = ~(np.isnan(month) | np.isnan(year))
+
+        # express as months since the epoch, which numpy can directly
+        # interpret as the first day of each month
+        since_epoch = (year[parsed] - 1970) * 12 + (month[parsed] - 1)
+        first_day = since_epoch.astype(np.int64).astype('datetime64[M]')
+        first_day = first_day.astype('datetime64[D]')
+
+        # positions outside of what a pd.Timestamp can represent cannot be
+        # parsed
+        in_bounds = ((first_day >= MIN_DAY) & (first_day <= MAX_DAY))
+
+        stamps = np.full(len(year), np.datetime64('NaT'), 'datetime64[ns]')
+        stamps[np.flatnonzero(parsed)[in_bounds]] = first_day[in_bounds]
+
+        result = pd.Series(pd.NaT, index=birth_month.index,
+                           dtype='datetime64[ns]')
+        result[not_null_map] = stamps
+        return result
+
+
+def _parse_distinct(series, parser):
+    # apply the parser to each distinct value, and expand the result to
+    # the length of the series. Unparseable values are NaN.
+    codes, distinct = pd.factorize(series)
+    parsed = np.array([parser(str(v)) for v in distinct] + [np.nan],
+                      dtype=float)
+
+    # a code of -1, which denotes a null, selects the trailing NaN
+    return parsed[codes]
+
+
+def _to_float(series):
+    # pd.to_numeric(series, errors='coerce') as a float array. Metadata
+    # columns have few distinct values, so each is only parsed once.
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # the categories are already the distinct values
+        categories = pd.to_numeric(series.cat.categories, errors='coerce')
+        parsed = np.append(categories.to_numpy(dtype=float), np.nan)
+        return parsed[series.cat.codes.to_numpy()]
+
+    codes, distinct = pd.factorize(series)
+    parsed = pd.to_numeric(distinct, errors='coerce').to_numpy(dtype=float)
+    return np.append(parsed, np.nan)[codes]
+
+
+def _to_datetime(series):
+    # pd.to_datetime(series, errors='coerce'), parsing each distinct value
+    # once. Parsing a categorical directly would produce a categorical.
+    codes, distinct = pd.factorize(series)
+    parsed = pd.to_datetime(np.asarray(distinct, dtype=object),
+                            errors='coerce')
+    stamps = np.append(parsed.to_numpy(dtype='datetime64[ns]'),
+                       np.datetime64('NaT', 'ns'))
+    return pd.Series(stamps[codes], index=series.index, name=series.name)
+
+
+def _parse_month(value):
+    return MONTH_NUMBERS.get(value.lower(), np.nan)
+
+
+def _parse_year(value):
+    return int(value) if FOUR_DIGITS.fullmatch(value) else np.nan
+
+
+def encode_column(values, index=None, name=None, max_fraction=None):
+    """Represent the values of a metadata column compactly
+
+    Most metadata columns hold a handful of distinct values (e.g., "true",
+    "false", "not provided"), so each distinct value is expressed as str
+    once. Columns with few distinct values are represented as categorical,
+    and otherwise every position references the single instance of its
+    value.
+
+    Parameters
+    ----------
+    values : array-like
+        The values of the column. Null values, and the empty string, are
+        expressed as MISSING_VALUE.
+    index : pd.Index, optional
+        The index of the resulting series
+    name : str, optional
+        The name of the resulting series
+    max_fraction : float, optional
+        Columns whose number of distinct values is at most this fraction of
+        their length are represented as categorical. If not specified,
+        CATEGORICAL_MAX_FRACTION is used.
+
+    Returns
+    -------
+    pd.Series
+        The values as str, either as pd.CategoricalDtype or object
+    """
+    if max_fraction is None:
+        max_fraction = CATEGORICAL_MAX_FRACTION
+
+    codes, distinct = _factorize(values)
+
+    # a code of -1, which denotes a null, selects a trailing MISSING_VALUE.
+    # Distinct values may coincide once expressed as str.
+    labels = [MISSING_VALUE if v == "" else str(v) for v in distinct]
+    if (codes == -1).any():
+        labels.append(MISSING_VALUE)
+    label_codes, categories = pd.factorize(np.array(labels, dtype=object))
+    codes = label_codes[codes]
+
+    if len(categories) <= max_fraction * len(codes):
+        data = pd.Categorical.from_codes(codes, categories=categories)
+    else:
+        data = categories[codes]
+
+    return pd.Series(data, index=index, name=name)
+
+
+def _factorize(values):
+    # pd.factorize, although distinguishing 0.0 from -0.0 as they are
+    # expressed differently as str
+    codes, distinct = pd.factorize(values)
+    if not pd.api.types.is_float_dtype(distinct):
+        return codes, distinct
+
+    negative_zero = np.signbit(values) & (np.asarray(values) == 0)
+    if negative_zero.any():
+        distinct = np.append(np.where(distinct == 0, 0.0, distinct), -0.0)
+        codes = np.where(negative_zero, len(distinct) - 1, codes)
+    return codes, distinct
+
+
+def bin_values(values, bounds, name=None):
+    """Assign each value to a labeled, half-open interval
+
+    This bounds checking is consistent with that used for metadata pulldown
+    in labadmin where the lowerbound is inclusive and upperbound is
+    exclusive. Every value is binned in a single pass.
+
+    Parameters
+    ----------
+    values : pd.Series
+        Numeric values to bin
+    bounds : list of (str, float, float)
+        The label, inclusive lowerbound and exclusive upperbound of each bin.
+        The bins must be ordered and must not overlap, although there may be
+        gaps between them.
+    name : str, optional
+        The name of the resulting series
+
+    Returns
+    -------
+    pd.Series
+        A categorical series of the bin labels. The categories are the
+        labels followed by MISSING_VALUE. Values which are null, or which do
+        not fall within a bin, are null.
+
+    Raises
+    ------
+    ValueError
+        If the bins are out of order or overlap
+    """
+    labels = [label for label, _, _ in bounds]
+    lowers = np.array([lower for _, lower, _ in bounds], dtype=float)
+    uppers = np.array([upper for _, _, upper in bounds], dtype=float)
+
+    if np.any(lowers >= uppers) or np.any(lowers[1:] < uppers[:-1]):
+        raise ValueError("Bins must be ordered and must not overlap")
+
+    as_float = values.to_numpy(dtype=float, na_value=np.nan)
+
+    # the candidate bin for each value is the last whose lowerbound does not
+    # exceed it, which is valid only if the value is below its upperbound.
+    # null values never satisfy the comparisons.
+    candidate = np.searchsorted(lowers, as_float, side='right') - 1
+    within = (candidate >= 0) & (as_float < uppers[candidate.clip(0)])
+    codes = np.where(within, candidate, -1)
+
+    categories = labels + [MISSING_VALUE]
+    categorical = pd.Categorical.from_codes(codes, categories=categories)
+    return pd.Series(categorical, index=values.index, name=name)
+
+
+class _Bin(Transformer):
+    FOCUS_COL = None
+    BOUNDS = None
 
     @classmethod
     def _transform(cls, df):
-        # these bounds are based on the values previously used for metadata
-        # pulldown in labadmin
-        bounds = [('baby', 0, 3),
-                  ('child', 3, 13),
-                  ('teen', 13, 20),
-                  ('20s', 20, 30),
-                  ('30s', 30, 40),
-                  ('40s', 40, 50),
-                  ('50s', 50, 60),
-                  ('60s', 60, 70),
-                  ('70+', 70, 123)]
-
-        age_years = pd.to_numeric(df[AGE_YEARS], errors='coerce')
-        age_cat = cls.basis(df.index)
-
-        for label, lower, upper in bounds:
-            # this bounds checking is consistent with that used for metadata
-            # pulldown in labadmin where the lowerbound is inclusive and
-            # upperbound is exclusive.
-            positions = (age_years >= lower) & (age_years < upper)
-            age_cat.loc[positions] = label
-
-        return age_cat
-
-
-class BMICat(Transformer):
-    REQUIRED_COLUMNS = frozenset([BMI, ])
-    COLUMN_NAME = BMI_CAT
+        values = pd.to_numeric(df[cls.FOCUS_COL], errors='coerce')
+        return bin_values(values, cls.BOUNDS, cls.COLUMN_NAME)
 
-    @classmethod
-    def _transform(cls, df):
-        # these bounds are based on the values previously used for metadata
-        # pulldown in labadmin
-        bounds = [('Underweight', 8, 18.5),
-                  ('Normal', 18.5, 25),
-                  ('Overweight', 25, 30),
-                  ('Obese', 30, 80)]
-        bmi = pd.to_numeric(df[BMI_], errors='coerce')
-        bmi_cat = cls.basis(df.index)
 
-        for label, lower, upper in bounds:
-            # this bounds checking is consistent with that used for metadata
-            # pulldown in labadmin where the lowerbound is inclusive and
-            # upperbound is exclusive.
-            positions = (bmi >= lower) & (bmi < upper)
-            bmi_cat.loc[positions] = label
+class AgeCat(_Bin):
+    REQUIRED_COLUMNS = frozenset([AGE_YEARS, ])
+    COLUMN_NAME = AGE_CAT
+    FOCUS_COL = AGE_YEARS
+
+    # these bounds are based on the values previously used for metadata
+    # pulldown in labadmin
+    BOUNDS = [('baby', 0, 3),
+              ('child', 3, 13),
+              ('teen', 13, 20),
+              ('20s', 20, 30),
+              ('30s', 30, 40),
+              ('40s', 40, 50),
+              ('50s', 50, 60),
+              ('60s', 60, 70),
+              ('70+', 70, 123)]
+
+
+class BMICat(_Bin):
+    REQUIRED_COLUMNS = frozenset([BMI_, ])
+    COLUMN_NAME = BMI_CAT
+    FOCUS_COL = BMI_
 
-        return bmi_cat
+    # these bounds are based on the values previously used for metadata
+    # pulldown in labadmin
+    BOUNDS = [('Underweight', 8, 18.5),
+              ('Normal', 18.5, 25),
+              ('Overweight', 25, 30),
+              ('Obese', 30, 80)]
 
 
 class AlcoholConsumption(Transformer):
@@ -198,106 +409,294 @@ class AlcoholConsumption(Transformer):
         return series
 
 
-def _normalizer(df, focus_col, units_col, units_value, factor):
-    # get our columns
-    focus = pd.to_numeric(df[focus_col], errors='coerce')
-    units = df[units_col]
-
-    # operate on a copy as to retain non-unit focus values (e.g., values
-    # already expressed as centimeters
-    result = focus.copy()
+def normalize_units(df, conversions):
+    """Convert measurements to common units
+
+    Every conversion is performed at once over a two dimensional array,
+    using masks rather than index lookups.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The measurements and their units
+    conversions : list of (str, str, str, float)
+        The measurement column, its units column, the units to convert from,
+        and the factor to convert by. Measurements in other units are
+        retained as-is.
+
+    Returns
+    -------
+    pd.DataFrame
+        The converted measurements, indexed as df and named by the
+        measurement columns. Measurements which are not numeric, are
+        negative, or lack units, are NaN.
+    """
+    focus_cols = [focus_col for focus_col, _, _, _ in conversions]
+    focus = np.column_stack([_to_float(df[focus_col])
+                             for focus_col in focus_cols])
+    units = np.column_stack([df[units_col].to_numpy(dtype=object)
+                             for _, units_col, _, _ in conversions])
+    units_values = np.array([units_value
+                             for _, _, units_value, _ in conversions],
+                            dtype=object)
+    factors = np.array([factor for _, _, _, factor in conversions],
+                       dtype=float)
+
+    # anything negative is weird so kill it, as are measurements whose units
+    # are unknown. NaN does not satisfy the comparison.
+    keep = (focus >= 0) & ~pd.isnull(units)
+    scale = np.where(units == units_values, factors, 1.0)
+    result = np.where(keep, focus * scale, np.nan)
+
+    return pd.DataFrame(result, index=df.index, columns=focus_cols)
+
+
+def _set_units(units, mask, value):
+    # units may be categorical, in which case the value must be a category
+    # before it can be assigned
+    units = units.copy()
+    if isinstance(units.dtype, pd.CategoricalDtype) and \
+            value not in units.cat.categories:
+        units = units.cat.add_categories([value])
+    units.loc[mask] = value
+    return units
+
+
+class NormalizeUnits(Transformer):
+    """Convert heights to centimeters and weights to kilograms
+
+    Every measurement present is converted in a single pass of
+    normalize_units. The units of each normalized measurement are then set
+    to those converted to.
+    """
+    # the measurement column, its units column, the units to convert from,
+    # the factor to convert by, and the units converted to
+    CONVERSIONS = ((HEIGHT_CM, HEIGHT_UNITS, INCHES, 2.54, CENTIMETERS),
+                   (WEIGHT_KG, WEIGHT_UNITS, POUNDS, 1 / 2.20462, KILOGRAMS))
+    REQUIRED_COLUMNS = frozenset(column for conversion in CONVERSIONS
+                                 for column in conversion[:2])
 
-    # anything negative is weird so kill it
-    result[result < 0] = None
-
-    # figure out what positions are safe to operate on
-    not_null_map = Transformer.not_null_map(result, units)
-
-    # take entries like where either focus or units are null and kill them
-    result.loc[not_null_map[~not_null_map].index] = None
-
-    # reduce to only those safe to operate on
-    focus_not_null = result[not_null_map]
-    units_not_null = units[not_null_map]
-    focus_adj = focus_not_null.loc[units_not_null == units_value]
-
-    # adjust the indices that need adjustment
-    result.loc[focus_adj.index] = focus_adj * factor
+    @classmethod
+    def _present(cls, columns):
+        # the conversions whose measurement and units are both available
+        columns = set(columns)
+        return [conversion for conversion in cls.CONVERSIONS
+                if set(conversion[:2]) <= columns]
 
-    return result
+    @classmethod
+    def satisfied_by(cls, columns):
+        # a frame may hold only some of the measurements
+        return len(cls._present(columns)) > 0
 
+    @classmethod
+    def outputs(cls):
+        return cls.REQUIRED_COLUMNS
 
-class _Normalize(Transformer):
-    FOCUS_COL = None
-    FOCUS_UNITS = None
-    UNITS_COL = None
-    FACTOR = None
+    @classmethod
+    def produces(cls, columns):
+        return frozenset(column for conversion in cls._present(columns)
+                         for column in conversion[:2])
 
     @classmethod
     def _transform(cls, df):
-        return _normalizer(df, cls.FOCUS_COL, cls.UNITS_COL, cls.FOCUS_UNITS,
-                           cls.FACTOR)
-
-
-class NormalizeHeight(_Normalize):
-    REQUIRED_COLUMNS = frozenset([HEIGHT_UNITS, HEIGHT_CM])
-    COLUMN_NAME = HEIGHT_CM
-
-    # after normalization to centimeters, we need to also update the
-    # height_units column to reflect these values are now centimeters
-    EXISTING_UNITS_COL_UPDATE = (HEIGHT_UNITS, CENTIMETERS)
-    FOCUS_COL = HEIGHT_CM
-    UNITS_COL = HEIGHT_UNITS
-    FOCUS_UNITS = INCHES
-    FACTOR = 2.54
-
-
-class NormalizeWeight(_Normalize):
-    REQUIRED_COLUMNS = frozenset([WEIGHT_UNITS, WEIGHT_KG])
-    COLUMN_NAME = WEIGHT_KG
-
-    # after normalization to kilograms, we need to also update the
-    # weight_units column to reflect these values are now in kg
-    EXISTING_UNITS_COL_UPDATE = (WEIGHT_UNITS, KILOGRAMS)
-    FOCUS_COL = WEIGHT_KG
-    FOCUS_UNITS = POUNDS
-    UNITS_COL = WEIGHT_UNITS
-    FACTOR = (1 / 2.20462)
-
-
-# transforms are order dependent as some entries (e.g., BMICat) depend
-# on the presence of a BMI column
-HUMAN_TRANSFORMS = (AgeYears, AgeCat, NormalizeWeight, NormalizeHeight,
-                    BMI, BMICat, AlcoholConsumption)
-
-
-def apply_transforms(df, transforms):
+        conversions = cls._present(df.columns)
+        normalized = normalize_units(df, [conversion[:4]
+                                          for conversion in conversions])
+
+        # once normalized, the measurements are assured to be in the units
+        # converted to
+        result = {}
+        for focus_col, units_col, _, _, units_value in conversions:
+            result[focus_col] = normalized[focus_col]
+            result[units_col] = _set_units(df[units_col],
+                                           ~normalized[focus_col].isnull(),
+                                           units_value)
+        return pd.DataFrame(result, index=df.index)
+
+
+# the order of transforms does not matter for execution, as dependencies
+# (e.g., BMICat on BMI) are resolved by plan_transforms, although it is the
+# order in which any created columns are added
+HUMAN_TRANSFORMS = (AgeYears, AgeCat, NormalizeUnits, BMI, BMICat,
+                    AlcoholConsumption)
+
+
+def plan_transforms(transforms, columns, requested=None):
+    """Determine the order in which transforms can run
+
+    Parameters
+    ----------
+    transforms : Iterable of Transformer
+        The transforms to plan
+    columns : Iterable of str
+        The columns available prior to any transform
+    requested : Iterable of str, optional
+        The columns needed by the caller. Transforms which do not
+        contribute, directly or through a dependent, to these columns are
+        pruned. If None, every transform whose inputs can be satisfied is
+        planned.
+
+    Returns
+    -------
+    list of list of Transformer
+        The stages to execute in order. The transforms within a stage do not
+        depend on one another.
+
+    Raises
+    ------
+    ValueError
+        If more than one transform produces the same column, or if the
+        transforms depend on one another cyclically
+    """
+    transforms = list(transforms)
+
+    producers = {}
     for transform in transforms:
-        if transform.satisfies_requirements(df):
-            # note: not using df.apply here as casts are needed on a
-            # case-by-case basis, and pandas is much more efficient
-            # casting whole columns
-            subset = df[transform.REQUIRED_COLUMNS]
-            series = transform.apply(subset)
-
-            # it is almost certainly the case that the input dataframe is
-            # str already, so let's fall back. And these will be serialized
-            # anyway w/o type information.
-            series = series.astype(str)
-
-            # NOTE: this operation can either change AN EXISTING column in the
-            # DataFrame or ADD a column. Both are valid. Operations such as
-            # the creation of "age_years" will CREATE a new column, whereas
-            # the normalization of "height_cm" will MODIFY an existing one.
-            df[transform.COLUMN_NAME] = series
-
-            # update a an existing column if the transform needs to. An example
-            # is with height, where once values are normalized to centimeters
-            # within the height_cm column, we need to then also modify the
-            # height_units column for all non-null height_cm entries as they
-            # are assured to be centimeters.
-            if transform.EXISTING_UNITS_COL_UPDATE is not None:
-                column, value = transform.EXISTING_UNITS_COL_UPDATE
-                df.loc[~df[transform.COLUMN_NAME].isnull(), column] = value
+        for column in transform.outputs():
+            if producers.setdefault(column, transform) is not transform:
+                raise ValueError("Multiple transforms produce %s" % column)
+
+    # a transform may modify one of its own inputs in place (e.g.,
+    # NormalizeUnits), which is not a dependency
+    dependencies = {t: {producers[c] for c in t.inputs() if c in producers}
+                    - {t} for t in transforms}
+
+    stages = []
+    ordered = set()
+    remaining = transforms
+    while remaining:
+        stage = [t for t in remaining if dependencies[t] <= ordered]
+        if not stage:
+            raise ValueError("Transforms have cyclic dependencies: %s" %
+                             ', '.join(t.__name__ for t in remaining))
+        stages.append(stage)
+        ordered.update(stage)
+        remaining = [t for t in remaining if t not in ordered]
+
+    # drop transforms whose inputs are neither present nor produced
+    available = set(columns)
+    satisfied = []
+    for stage in stages:
+        stage = [t for t in stage if t.satisfied_by(available)]
+        produced = [t.produces(available) for t in stage]
+        for outputs in produced:
+            available.update(outputs)
+        satisfied.append(stage)
+
+    if requested is not None:
+        needed = set(requested)
+        pruned = []
+        for stage in reversed(satisfied):
+            stage = [t for t in stage if t.outputs() & needed]
+            for transform in stage:
+                needed.update(transform.inputs())
+            pruned.append(stage)
+        satisfied = pruned[::-1]
+
+    return [stage for stage in satisfied if stage]
+
+
+def required_inputs(transforms, requested):
+    """Determine the columns transforms read to produce requested columns
+
+    Parameters
+    ----------
+    transforms : Iterable of Transformer
+        The transforms available
+    requested : Iterable of str
+        The columns needed by the caller
+
+    Returns
+    -------
+    frozenset of str
+        The inputs of every transform which contributes, directly or through
+        a dependent, to the requested columns
+    """
+    transforms = list(transforms)
+
+    # assume every input is available, as a transform whose inputs are
+    # absent is simply not applied
+    available = set().union(*(t.inputs() for t in transforms))
+    return frozenset(column
+                     for stage in plan_transforms(transforms, available,
+                                                  requested)
+                     for transform in stage
+                     for column in transform.inputs())
+
+
+def apply_transforms(df, transforms, requested=None, max_workers=None):
+    """Apply transforms to a metadata frame
+
+    Transforms operate on, and produce, typed columns (e.g., float64) so that
+    a transform depending on the output of another (e.g., BMICat on BMI) does
+    not need to reparse it. Every column produced is serialized to str, with
+    missing values expressed as MISSING_VALUE, once all transforms have run,
+    and is represented as by encode_column.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The metadata to transform, which is modified in place
+    transforms : Iterable of Transformer
+        The transforms to apply
+    requested : Iterable of str, optional
+        The columns needed by the caller, see plan_transforms
+    max_workers : int, optional
+        The maximum number of independent transforms to run concurrently.
+        Defaults to TRANSFORM_WORKERS.
+
+    Returns
+    -------
+    pd.DataFrame
+        The transformed metadata
+    """
+    transforms = list(transforms)
+    if max_workers is None:
+        max_workers = TRANSFORM_WORKERS
+
+    # typed outputs are retained outside of the frame until all transforms
+    # have run, as setting or indexing multiple columns of a wide frame
+    # forces it to consolidate
+    typed = {}
+
+    def column(name):
+        return typed[name] if name in typed else df[name]
+
+    def present(name):
+        return name in typed or name in df.columns
+
+    for stage in plan_transforms(transforms, df.columns, requested):
+        # note: not using df.apply here as casts are needed on a
+        # case-by-case basis, and pandas is much more efficient
+        # casting whole columns
+        subsets = [pd.DataFrame({c: column(c) for c in sorted(t.inputs())
+                                 if present(c)})
+                   for t in stage]
+        if max_workers > 1 and len(stage) > 1:
+            with ThreadPoolExecutor(min(max_workers, len(stage))) as pool:
+                results = list(pool.map(lambda t, sub: t._transform(sub),
+                                        stage, subsets))
+        else:
+            results = [t._transform(sub) for t, sub in zip(stage, subsets)]
+
+        for transform, result in zip(stage, results):
+            # a transform producing several columns, such as
+            # NormalizeUnits, returns them as a frame
+            if isinstance(result, pd.DataFrame):
+                typed.update(result.items())
+            else:
+                typed[transform.COLUMN_NAME] = result
+
+    # NOTE: this operation can either change AN EXISTING column in the
+    # DataFrame or ADD a column. Both are valid. Operations such as the
+    # creation of "age_years" will CREATE a new column, whereas the
+    # normalization of "height_cm" will MODIFY an existing one. Created
+    # columns follow the order of the transforms, regardless of the order
+    # they ran in.
+    order = [c for t in transforms for c in sorted(t.outputs(), key=str)]
+    for name in sorted(typed, key=order.index):
+        # it is almost certainly the case that the input dataframe is str
+        # already, and these will be serialized anyway w/o type information.
+        df[name] = encode_column(typed[name], index=df.index, name=name)
 
     return df
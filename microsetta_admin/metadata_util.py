@@ -1,17 +1,60 @@
+from microsetta_admin import profile_util
 from microsetta_admin._api import APIRequest
-from microsetta_admin.metadata_constants import (
-    HUMAN_SITE_INVARIANTS,
-    MISSING_VALUE)
+from microsetta_admin.cache_util import TTLCache
+from microsetta_admin.config_manager import SERVER_CONFIG
+from microsetta_admin.store_util import PayloadStore
+from microsetta_admin.metadata_constants import HUMAN_SITE_INVARIANTS
 from microsetta_admin.metadata_transforms import (
+    CATEGORICAL_MAX_FRACTION,
     HUMAN_TRANSFORMS,
-    apply_transforms)
+    apply_transforms,
+    encode_column,
+    required_inputs)
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
 import re
+import threading
+import numpy as np
 import pandas as pd
 
 # the vioscreen survey currently cannot be fetched from the database
 TEMPLATES_TO_IGNORE = {10001, }
 
+# the maximum number of concurrent requests to issue to the private API
+# when gathering metadata
+FETCH_WORKERS = SERVER_CONFIG.get("metadata_fetch_workers", 8)
+
+# the number of rows serialized at a time when streaming a pulldown
+STREAM_CHUNKSIZE = SERVER_CONFIG.get("metadata_stream_chunksize", 1000)
+
+# the formats a pulldown may be written as, and their mimetype and file
+# extension. Parquet and Arrow require the optional pyarrow dependency.
+TSV = 'tsv'
+PARQUET = 'parquet'
+ARROW = 'arrow'
+OUTPUT_FORMATS = {TSV: ("text/tab-separated-values", 'tsv'),
+                  PARQUET: ("application/vnd.apache.parquet", 'parquet'),
+                  ARROW: ("application/vnd.apache.arrow.file", 'arrow')}
+
+# survey templates are effectively static, so they are retained across
+# pulldowns. Entries are keyed by (template_id, language_tag) and valued by
+# _CachedTemplate instances.
+TEMPLATE_LANGUAGE_TAG = 'en-US'
+SURVEY_TEMPLATE_CACHE = TTLCache(
+    maxsize=SERVER_CONFIG.get("survey_template_cache_size", 128),
+    ttl=SERVER_CONFIG.get("survey_template_cache_ttl", 3600))
+
+# per-barcode metadata may optionally be retained on disk, and shared by the
+# processes of the host, so repeated pulldowns of a cohort do not need to
+# request it again. The cache is disabled if no path is configured.
+METADATA_CACHE_PATH = SERVER_CONFIG.get("metadata_cache_path")
+METADATA_CACHE_MAX_AGE = SERVER_CONFIG.get("metadata_cache_max_age", 86400)
+_metadata_cache = None
+_metadata_cache_pid = None
+_metadata_cache_lock = threading.Lock()
+
 EBI_REMOVE = ['ABOUT_YOURSELF_TEXT', 'ANTIBIOTIC_CONDITION',
               'ANTIBIOTIC_MED', 'PM_NAME', 'PM_EMAIL',
               'BIRTH_MONTH', 'CAT_CONTACT', 'CAT_LOCATION',
@@ -39,23 +82,264 @@ def drop_private_columns(df):
     pd.DataFrame
         The filtered dataframe
     """
+    to_drop = [c for c in df.columns if is_private_column(c)]
+
+    return df.drop(columns=to_drop, inplace=False)
+
+
+def is_private_column(column):
+    """Determine whether a column should not be shared publicly
+
+    Parameters
+    ----------
+    column : str
+        The name of the column, in any case
+
+    Returns
+    -------
+    bool
+        True if the column is private
+    """
+    column = column.lower()
+
     # The personal microbiome survey contains additional fields that are
     # sensitive in nature
-    pm_remove = {c.lower() for c in df.columns if c.lower().startswith('pm_')}
+    return column.startswith('pm_') or \
+        column in {c.lower() for c in EBI_REMOVE}
 
-    remove = pm_remove | {c.lower() for c in EBI_REMOVE}
-    to_drop = [c for c in df.columns if c.lower() in remove]
 
-    return df.drop(columns=to_drop, inplace=False)
+class _Allowlist(dict):
+    """The columns to materialize, matched without regard to case
+
+    Membership of a name is evaluated once, and is obtained by indexing.
+
+    Parameters
+    ----------
+    columns : Iterable of str
+        The columns to materialize
+    """
+    def __init__(self, columns):
+        super().__init__()
+        self.columns = frozenset(c.lower() for c in columns)
+
+    def __missing__(self, column):
+        allowed = self[column] = column.lower() in self.columns
+        return allowed
+
+
+def _as_allowlist(columns):
+    if columns is None or isinstance(columns, _Allowlist):
+        return columns
+    return _Allowlist(columns)
+
+
+def iter_tsv(df, chunksize=None, encoding='utf-8'):
+    """Serialize a frame as tab-separated values in chunks of rows
+
+    The header is emitted first, followed by the rows, so that at most
+    chunksize rows are held in serialized form at any given time. This
+    removes the copies of the file otherwise made by serialization; the
+    frame itself is complete before the first chunk is produced, so the
+    memory of a pulldown remains proportional to its number of samples.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The frame to serialize, which is written with its index
+    chunksize : int, optional
+        The number of rows to serialize at a time. If not specified,
+        STREAM_CHUNKSIZE is used.
+    encoding : str, optional
+        The encoding of the yielded bytes
+
+    Returns
+    -------
+    generator of bytes
+        The serialized frame
+    """
+    if chunksize is None:
+        chunksize = STREAM_CHUNKSIZE
+
+    yield df.iloc[:0].to_csv(sep='\t', index=True,
+                             header=True).encode(encoding)
+
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        yield chunk.to_csv(sep='\t', index=True,
+                           header=False).encode(encoding)
+
+
+def check_output_format(output_format):
+    """Verify a pulldown can be written in a format
+
+    Parameters
+    ----------
+    output_format : str
+        One of OUTPUT_FORMATS
+
+    Raises
+    ------
+    ValueError
+        If the format is unknown, or its dependencies are not installed
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format: %s" % output_format)
+
+    if output_format != TSV:
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            raise ValueError("The %s output format requires pyarrow" %
+                             output_format)
+
+
+def iter_output(df, output_format=TSV):
+    """Serialize a frame in a given format
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The frame to serialize, which is written with its index
+    output_format : str, optional
+        One of OUTPUT_FORMATS
+
+    Returns
+    -------
+    generator of bytes
+        The serialized frame
+
+    Raises
+    ------
+    ValueError
+        If the format cannot be written
+    """
+    check_output_format(output_format)
+
+    if output_format == TSV:
+        return iter_tsv(df)
+    else:
+        return _iter_arrow(categorize(df), output_format)
+
+
+def _iter_arrow(df, output_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    sink = pa.BufferOutputStream()
+    if output_format == PARQUET:
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=STREAM_CHUNKSIZE)
+
+    yield sink.getvalue().to_pybytes()
+
+
+def categorize(df, max_fraction=None):
+    """Encode low cardinality columns as categorical
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The frame to encode
+    max_fraction : float, optional
+        Columns whose number of distinct values is at most this fraction of
+        the number of rows are encoded. If not specified,
+        CATEGORICAL_MAX_FRACTION is used.
+
+    Returns
+    -------
+    pd.DataFrame
+        The frame with low cardinality columns as pd.CategoricalDtype
+    """
+    if max_fraction is None:
+        max_fraction = CATEGORICAL_MAX_FRACTION
+
+    limit = max_fraction * len(df)
+    columns = {}
+    for name, column in df.items():
+        if column.dtype == object and column.nunique(dropna=False) <= limit:
+            columns[name] = column.astype('category')
+
+    if not columns:
+        return df
+    return df.assign(**columns)
+
+
+class _CachedTemplate:
+    """A survey template and its lazily computed multiselect detail"""
+    __slots__ = ('template', 'multiselect')
+
+    def __init__(self, template):
+        self.template = template
+        self.multiselect = None
+
+
+def invalidate_survey_templates(template_id=None):
+    """Remove survey templates from the process-wide cache
+
+    Parameters
+    ----------
+    template_id : int, optional
+        The template to remove. If not specified, all templates are removed.
+    """
+    if template_id is None:
+        SURVEY_TEMPLATE_CACHE.invalidate()
+    else:
+        SURVEY_TEMPLATE_CACHE.invalidate(lambda key: key[0] == template_id)
+
+
+def get_metadata_cache():
+    """Obtain the per-barcode metadata cache of the current process
+
+    Returns
+    -------
+    store_util.PayloadStore or None
+        The cache, or None if METADATA_CACHE_PATH is not configured
+    """
+    global _metadata_cache, _metadata_cache_pid
+
+    if METADATA_CACHE_PATH is None:
+        return None
+
+    # a SQLite connection is not safe to share across a fork
+    pid = os.getpid()
+    with _metadata_cache_lock:
+        if _metadata_cache is None or _metadata_cache_pid != pid:
+            _metadata_cache = PayloadStore(METADATA_CACHE_PATH)
+            _metadata_cache_pid = pid
+        return _metadata_cache
 
 
-def retrieve_metadata(sample_barcodes):
+def retrieve_metadata(sample_barcodes, max_workers=None, progress=None,
+                      checkpoint=None, refresh=False, columns=None):
     """Retrieve all sample metadata for the provided barcodes
 
     Parameters
     ----------
     sample_barcodes : Iterable
         The barcodes to request
+    max_workers : int, optional
+        The maximum number of concurrent requests to the private API. If
+        not specified, FETCH_WORKERS is used.
+    progress : callable, optional
+        Called as progress(barcode, error) once each distinct barcode has
+        been obtained, where error is None on success. It may be called
+        concurrently from multiple threads.
+    checkpoint : store_util.Checkpoint, optional
+        If provided, barcodes previously fetched into the checkpoint are
+        served from it rather than requested again, and the outcome of each
+        barcode requested is recorded to it. The barcodes served from the
+        checkpoint, and those retried following an earlier failure, are
+        noted by its restored and retried attributes.
+    refresh : bool, optional
+        If True, metadata is requested from the private API even if held by
+        the metadata cache. Either way, the cache is updated with the
+        metadata requested.
+    columns : Iterable of str, optional
+        The columns to produce, without regard to case. Private columns are
+        never produced. If not specified, every column is produced.
 
     Returns
     -------
@@ -71,9 +355,55 @@ def retrieve_metadata(sample_barcodes):
     if errors is not None:
         error_report.append(errors)
 
+    # de-duplicate while retaining the input order so the resulting frame
+    # and error report are deterministic
+    unique_barcodes = list(dict.fromkeys(sample_barcodes))
+
+    restored = {}
+    if checkpoint is not None:
+        with profile_util.stage('checkpoint'):
+            restored = checkpoint.restore(unique_barcodes)
+        if progress is not None:
+            for barcode in restored:
+                progress(barcode, None)
+
+    cache = get_metadata_cache()
+    if cache is not None and not refresh:
+        with profile_util.stage('cache'):
+            cached = cache.get_many([bc for bc in unique_barcodes
+                                     if bc not in restored],
+                                    max_age=METADATA_CACHE_MAX_AGE)
+        if progress is not None:
+            for barcode in cached:
+                progress(barcode, None)
+        restored.update(cached)
+
+        if checkpoint is not None:
+            checkpoint.retried = [bc for bc in checkpoint.retried
+                                  if bc not in cached]
+
+    def fetch(barcode):
+        bc_md, errors = _fetch_barcode_metadata(barcode)
+        if checkpoint is not None:
+            checkpoint.record(barcode, bc_md, errors)
+        if cache is not None and errors is None:
+            cache.put(barcode, bc_md)
+        if progress is not None:
+            progress(barcode, errors)
+        return bc_md, errors
+
+    to_fetch = [bc for bc in unique_barcodes if bc not in restored]
+    with profile_util.stage('fetch_barcodes'):
+        results = dict(zip(to_fetch,
+                           _map_concurrently(fetch, to_fetch, max_workers)))
+
     fetched = []
-    for sample_barcode in set(sample_barcodes):
-        bc_md, errors = _fetch_barcode_metadata(sample_barcode)
+    for barcode in unique_barcodes:
+        if barcode in restored:
+            fetched.append(restored[barcode])
+            continue
+
+        bc_md, errors = results[barcode]
         if errors is not None:
             error_report.append(errors)
             continue
@@ -84,16 +414,55 @@ def retrieve_metadata(sample_barcodes):
     if len(fetched) == 0:
         error_report.append({"error": "No metadata was obtained"})
     else:
-        survey_templates, st_errors = _fetch_observed_survey_templates(fetched)
+        with profile_util.stage('fetch_templates'):
+            survey_templates, st_errors = _fetch_observed_survey_templates(
+                fetched, max_workers)
         if st_errors is not None:
             error_report.append(st_errors)
         else:
-            df = _to_pandas_dataframe(fetched, survey_templates)
+            df = _to_pandas_dataframe(fetched, survey_templates, columns)
 
     return df, error_report
 
 
-def _fetch_observed_survey_templates(sample_metadata):
+def _map_concurrently(func, items, max_workers=None):
+    """Apply a function to each item using a bounded pool of threads
+
+    Parameters
+    ----------
+    func : callable
+        The function to apply. It must accept a single argument.
+    items : Iterable
+        The items to operate on
+    max_workers : int, optional
+        The maximum number of threads to use. If not specified,
+        FETCH_WORKERS is used.
+
+    Returns
+    -------
+    list
+        The result of func for each item, in the same order as items
+
+    Notes
+    -----
+    Each call is run within a copy of the caller's context so that the Flask
+    request context, and therefore the session token used by APIRequest, is
+    visible to the worker threads.
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = FETCH_WORKERS
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, func, item)
+                   for item in items]
+        return [future.result() for future in futures]
+
+
+def _fetch_observed_survey_templates(sample_metadata, max_workers=None):
     """Determine which templates to obtain and then fetch
 
     Parameters
@@ -101,6 +470,9 @@ def _fetch_observed_survey_templates(sample_metadata):
     sample_metadata : list of dict
         Each element corresponds to the structure obtained from
         _fetch_barcode_metadata
+    max_workers : int, optional
+        The maximum number of concurrent requests to the private API. If
+        not specified, FETCH_WORKERS is used.
 
     Returns
     -------
@@ -127,9 +499,13 @@ def _fetch_observed_survey_templates(sample_metadata):
                 templates[template_id] = {'account_id': account_id,
                                           'source_id': source_id}
 
+    def fetch(item):
+        template_id, ids = item
+        return _fetch_survey_template(template_id, ids)
+
     surveys = {}
-    for template_id, ids in templates.items():
-        survey, error = _fetch_survey_template(template_id, ids)
+    results = _map_concurrently(fetch, templates.items(), max_workers)
+    for template_id, (survey, error) in zip(templates, results):
         if error:
             errors[template_id] = error
         else:
@@ -138,15 +514,21 @@ def _fetch_observed_survey_templates(sample_metadata):
     return surveys, errors if errors else None
 
 
-def _fetch_survey_template(template_id, ids):
+def _fetch_survey_template(template_id, ids,
+                           language_tag=TEMPLATE_LANGUAGE_TAG):
     """Fetch the survey structure to get full multi-choice detail
 
+    Templates are served from SURVEY_TEMPLATE_CACHE when possible, and
+    successfully fetched templates are added to it.
+
     Parameters
     ----------
     template_id : int
         The survey template ID to fetch
     ids : dict
         An account and source ID to use
+    language_tag : str, optional
+        The language of the template to fetch
 
     Returns
     -------
@@ -156,21 +538,32 @@ def _fetch_survey_template(template_id, ids):
         Any error information associated with the retreival. If an error is
         observed, the survey responses should not be considered valid.
     """
+    key = (template_id, language_tag)
+    cached = SURVEY_TEMPLATE_CACHE.get(key)
+    if cached is not None:
+        return cached.template, None
+
     errors = None
 
-    ids['template_id'] = template_id
+    # the caller's IDs are not modified, as they may be shared
+    ids = dict(ids, template_id=template_id)
     url = ("/api/accounts/%(account_id)s/sources/%(source_id)s/"
-           "survey_templates/%(template_id)d?language_tag=en-US")
+           "survey_templates/%(template_id)d?language_tag=%(language_tag)s")
 
-    status, response = APIRequest.get(url % ids)
+    version = SURVEY_TEMPLATE_CACHE.version
+    status, response = APIRequest.get(url % dict(ids,
+                                                 language_tag=language_tag))
     if status != 200:
         errors = {"ids": ids,
                   "error": str(status) + " from api"}
+    else:
+        SURVEY_TEMPLATE_CACHE.set(key, _CachedTemplate(response),
+                                  version=version)
 
     return response, errors
 
 
-def _to_pandas_dataframe(metadatas, survey_templates):
+def _to_pandas_dataframe(metadatas, survey_templates, columns=None):
     """Convert the raw barcode metadata into a DataFrame
 
     Parameters
@@ -180,51 +573,172 @@ def _to_pandas_dataframe(metadatas, survey_templates):
     survey_templates : dict
         Raw survey template data for the surveys represented by
         the metadatas
+    columns : Iterable of str, optional
+        The columns to produce, without regard to case. Private columns are
+        not produced, although they are materialized if a transform
+        producing a requested column reads them. If not specified, every
+        column is produced.
 
     Returns
     -------
     pd.DataFrame
         The fully constructed sample metadata
     """
-    transformed = []
-
     multiselect_map = _construct_multiselect_map(survey_templates)
-    for metadata in metadatas:
-        as_series = _to_pandas_series(metadata, multiselect_map)
-        transformed.append(as_series)
+    if columns is None:
+        with profile_util.stage('build_frame'):
+            df = _build_frame(metadatas, multiselect_map)
+        with profile_util.stage('transforms'):
+            return apply_transforms(df, HUMAN_TRANSFORMS)
 
-    df = pd.DataFrame(transformed)
-    df.index.name = 'sample_name'
-    included_columns = set(df.columns)
+    requested = {c.lower() for c in columns if not is_private_column(c)}
+    materialize = requested | required_inputs(HUMAN_TRANSFORMS, requested)
 
-    all_multiselect_columns = {v for ms in multiselect_map.values()
-                               for v in ms.values()}
+    with profile_util.stage('build_frame'):
+        df = _build_frame(metadatas, multiselect_map, materialize)
+    with profile_util.stage('transforms'):
+        df = apply_transforms(df, HUMAN_TRANSFORMS, requested=requested)
+        return df.drop(columns=[c for c in df.columns
+                                if c not in requested])
 
-    # for all reported multiselect columns, remap "null" values to
-    # false
-    for column in all_multiselect_columns & included_columns:
-        df.loc[df[column].isnull(), column] = 'false'
 
-    # add an entry for all multiselect columns which were not reported
-    for column in all_multiselect_columns - set(df.columns):
-        df[column] = 'false'
+def _build_frame(metadatas, multiselect_map, columns=None):
+    """Construct the untransformed sample metadata frame
 
-    # fill in any other nulls that may be present in the frame
-    # as could happen if not all individuals took all surveys
-    df.fillna(MISSING_VALUE, inplace=True)
+    Parameters
+    ----------
+    metadatas : list of dict
+        The raw metadata obtained from the private API
+    multiselect_map : dict
+        A dict keyed by (template_id, question_id) and valued by
+        {"response": "column_name"}.
+    columns : Iterable of str, optional
+        The columns to materialize, without regard to case. If not
+        specified, every column is materialized.
 
-    # The empty string can arise from free text entries that
-    # come from the private API as [""]
-    df.replace("", MISSING_VALUE, inplace=True)
+    Returns
+    -------
+    pd.DataFrame
+        The sample metadata with missing values filled, and lowercase
+        column names
+    """
+    names, columns, ms_columns, ms_block = _to_columns(metadatas,
+                                                       multiselect_map,
+                                                       columns)
+    index = pd.Index(names, name='sample_name')
+
+    # nulls arise where not all individuals took all surveys, and the empty
+    # string from free text entries that come from the private API as [""].
+    # Both are expressed as MISSING_VALUE. Each column is encoded as it is
+    # constructed, so a column of one str object per sample never exists
+    # alongside the frame.
+    df = pd.DataFrame({column: encode_column(values, index=index)
+                       for column, values in columns.items()}, index=index)
+
+    # every multiselect column known to the templates is represented, and
+    # a choice which was not selected is "false". The selections are
+    # directly the codes of a categorical.
+    true_false = ['false', 'true']
+    selected = np.ascontiguousarray(ms_block.T).view(np.int8)
+    multiselect = pd.DataFrame(
+        {i: pd.Categorical.from_codes(codes, categories=true_false)
+         for i, codes in enumerate(selected)}, index=index)
+    multiselect.columns = ms_columns
+    df = pd.concat([df, multiselect], axis=1)
 
     # force a consistent case
     df.rename(columns={c: c.lower() for c in df.columns},
               inplace=True)
 
-    return apply_transforms(df, HUMAN_TRANSFORMS)
+    return df
+
+
+def _to_columns(metadatas, multiselect_map, columns=None):
+    """Accumulate the sample metadata column by column
+
+    Rather than forming a pd.Series per sample, which requires pandas to
+    align every sample against every other, the values of each column are
+    gathered along with the positions of the samples which reported them.
+    Each column is then materialized exactly once. Multiselect responses
+    are gathered separately into a dense boolean block.
+
+    Parameters
+    ----------
+    metadatas : list of dict
+        The raw metadata obtained from the private API
+    multiselect_map : dict
+        A dict keyed by (template_id, question_id) and valued by
+        {"response": "column_name"}.
+    columns : Iterable of str, optional
+        The columns to gather, without regard to case. If not specified,
+        every column is gathered.
+
+    Returns
+    -------
+    list of str
+        The sample names, in the order of metadatas
+    dict
+        The column names, in order of first observation, valued by a
+        np.ndarray of dtype object. Samples which did not report a value
+        for a column are None. Multiselect columns are not included.
+    list of str
+        The names of all multiselect columns described by multiselect_map,
+        and permitted by columns
+    np.ndarray of bool
+        A (samples x multiselect columns) array which is True where a
+        sample selected the choice
+    """
+    allowlist = _as_allowlist(columns)
+    ms_columns = list(dict.fromkeys(column
+                                    for choices in multiselect_map.values()
+                                    for column in choices.values()
+                                    if allowlist is None or allowlist[column]))
+    ms_positions = {column: i for i, column in enumerate(ms_columns)}
+    ms_rows = []
+    ms_cols = []
+
+    names = []
+    observed = {}
 
+    for position, metadata in enumerate(metadatas):
+        name, index, values, selections = \
+            _to_sample_fields(metadata, multiselect_map, allowlist)
+        names.append(name)
 
-def _construct_multiselect_map(survey_templates):
+        for column, value in zip(index, values):
+            positions_values = observed.get(column)
+            if positions_values is None:
+                positions_values = ([], [])
+                observed[column] = positions_values
+
+            positions_values[0].append(position)
+            positions_values[1].append(value)
+
+        for column in selections:
+            ms_rows.append(position)
+            ms_cols.append(ms_positions[column])
+
+    n_samples = len(names)
+    gathered = {}
+    for column, (positions, values) in observed.items():
+        data = np.full(n_samples, None, dtype=object)
+
+        # assign through an object array so numpy does not attempt to
+        # coerce the values to a fixed-width string type
+        as_array = np.empty(len(values), dtype=object)
+        as_array[:] = values
+        data[positions] = as_array
+
+        gathered[column] = data
+
+    ms_block = np.zeros((n_samples, len(ms_columns)), dtype=bool)
+    ms_block[ms_rows, ms_cols] = True
+
+    return names, gathered, ms_columns, ms_block
+
+
+def _construct_multiselect_map(survey_templates,
+                               language_tag=TEMPLATE_LANGUAGE_TAG):
     """Identify multi-select questions, and construct stable names
 
     Parameters
@@ -232,6 +746,9 @@ def _construct_multiselect_map(survey_templates):
     survey_templates : dict
         Raw survey template data for the surveys represented by
         the metadatas
+    language_tag : str, optional
+        The language of the templates, used to locate memoized detail in
+        SURVEY_TEMPLATE_CACHE
 
     Returns
     -------
@@ -240,28 +757,58 @@ def _construct_multiselect_map(survey_templates):
     """
     result = {}
     for template_id, template in survey_templates.items():
-        template_text = template['survey_template_text']
+        # reuse the multiselect detail computed when the template was
+        # cached, provided the cache is holding this exact template
+        cached = SURVEY_TEMPLATE_CACHE.get((template_id, language_tag))
+        if cached is not None and cached.template is template:
+            if cached.multiselect is None:
+                cached.multiselect = _template_multiselect_map(template)
+            multiselect = cached.multiselect
+        else:
+            multiselect = _template_multiselect_map(template)
+
+        for qid, multi_values in multiselect.items():
+            result[(template_id, qid)] = multi_values
+
+    return result
+
+
+def _template_multiselect_map(template):
+    """Construct stable names for the multi-select questions of a template
+
+    Parameters
+    ----------
+    template : dict
+        Raw survey template data for a single survey
+
+    Returns
+    -------
+    dict
+        A dict keyed by question_id and valued by {"response": "column_name"}
+    """
+    result = {}
+    template_text = template['survey_template_text']
 
-        for group in template_text['groups']:
-            for field in group['fields']:
-                if not field['multi']:
-                    continue
+    for group in template_text['groups']:
+        for field in group['fields']:
+            if not field['multi']:
+                continue
 
-                base = field['shortname']
-                choices = field['values']
-                qid = field['id']
+            base = field['shortname']
+            choices = field['values']
+            qid = field['id']
 
-                multi_values = {}
-                for choice in choices:
-                    new_shortname = _build_col_name(base, choice)
-                    multi_values[choice] = new_shortname
+            multi_values = {}
+            for choice in choices:
+                new_shortname = _build_col_name(base, choice)
+                multi_values[choice] = new_shortname
 
-                result[(template_id, qid)] = multi_values
+            result[qid] = multi_values
 
     return result
 
 
-def _to_pandas_series(metadata, multiselect_map):
+def _to_pandas_series(metadata, multiselect_map, columns=None):
     """Convert the sample metadata object from the private API to a pd.Series
 
     Parameters
@@ -273,13 +820,48 @@ def _to_pandas_series(metadata, multiselect_map):
         A dict keyed by (template_id, question_id) and valued by
         {"response": "column_name"}. This is used to remap multiselect values
         to stable fields.
+    columns : Iterable of str, optional
+        The variables to include, without regard to case. If not specified,
+        every variable is included.
 
     Returns
     -------
     pd.Series
         The transformed responses
-    set
-        Observed multi-selection responses
+    """
+    name, index, values, selections = _to_sample_fields(
+        metadata, multiselect_map, _as_allowlist(columns))
+    index.extend(selections)
+    values.extend(['true'] * len(selections))
+    return pd.Series(values, index=index, name=name)
+
+
+def _to_sample_fields(metadata, multiselect_map, allowlist=None):
+    """Extract the variables and values of a sample
+
+    Parameters
+    ----------
+    metadata : dict
+        The response object from a query to fetch all sample metadata for a
+        barcode.
+    multiselect_map : dict
+        A dict keyed by (template_id, question_id) and valued by
+        {"response": "column_name"}. This is used to remap multiselect values
+        to stable fields.
+    allowlist : _Allowlist, optional
+        The variables to extract. If not specified, every variable is
+        extracted.
+
+    Returns
+    -------
+    str
+        The sample name
+    list of str
+        The variable names, excluding multiselect responses
+    list
+        The value of each variable
+    list of str
+        The multiselect column names which were selected
     """
     name = metadata['sample_barcode']
     hsi = metadata['host_subject_id']
@@ -298,13 +880,23 @@ def _to_pandas_series(metadata, multiselect_map):
         if 'source' not in sample_detail:
             # HACK: this can occur if a source does not have collection
             # information?
-            return pd.Series([], index=[], name=name)
+            return name, [], [], []
 
         sample_type = sample_detail['source']['description']
         sample_invariants = {}
 
-    values = [hsi, collection_timestamp]
-    index = ['HOST_SUBJECT_ID', 'COLLECTION_TIMESTAMP']
+    values = []
+    index = []
+    selections = []
+
+    def wanted(column):
+        return allowlist is None or allowlist[column]
+
+    for variable, value in (('HOST_SUBJECT_ID', hsi),
+                            ('COLLECTION_TIMESTAMP', collection_timestamp)):
+        if wanted(variable):
+            index.append(variable)
+            values.append(value)
 
     # HACK: there exist some samples that have duplicate surveys. This is
     # unusual and unexpected state in the database, and has so far only been
@@ -330,20 +922,20 @@ def _to_pandas_series(metadata, multiselect_map):
                 specific_shortnames = multiselect_map[(template, qid)]
                 for selection in answer:
                     # determine the column name
-                    specific_shortname = specific_shortnames[selection]
-
-                    values.append('true')
-                    index.append(specific_shortname)
-            else:
+                    column = specific_shortnames[selection]
+                    if wanted(column):
+                        selections.append(column)
+            elif wanted(shortname):
                 # free text fields from the API come down as ["foo"]
                 values.append(answer.strip('[]"'))
                 index.append(shortname)
 
     for variable, value in sample_invariants.items():
-        index.append(variable)
-        values.append(value)
+        if wanted(variable):
+            index.append(variable)
+            values.append(value)
 
-    return pd.Series(values, index=index, name=name)
+    return name, index, values, selections
 
 
 def _fetch_barcode_metadata(sample_barcode):
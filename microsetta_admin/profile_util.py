@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# the counters recorded for every stage
+COUNTERS = ('calls', 'bytes', 'errors')
+
+# the profile, and stage within it, which work is attributed to. As the
+# metadata pulldown runs each request within a copy of the caller's context,
+# requests made from worker threads are attributed to the stage which
+# issued them.
+_ACTIVE_PROFILE = contextvars.ContextVar('active_profile', default=None)
+_ACTIVE_STAGE = contextvars.ContextVar('active_stage', default=None)
+
+
+class Profile:
+    """Timers and counters of the stages of a unit of work
+
+    Each stage records the wall time spent within it, along with the
+    number of calls made to the private API, the bytes received from it and
+    the number of errors observed.
+
+    Parameters
+    ----------
+    name : str
+        A description of the work profiled
+    timer : callable, optional
+        The clock to use, primarily to allow for testing
+    """
+    def __init__(self, name, timer=time.perf_counter):
+        self.name = name
+        self._timer = timer
+        self._started = timer()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds=0.0, **counts):
+        """Accumulate time and counts to a stage
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        seconds : float, optional
+            The time to add
+        counts : dict
+            The amount to add to each of COUNTERS
+        """
+        with self._lock:
+            detail = self._stages.get(stage)
+            if detail is None:
+                detail = dict.fromkeys(COUNTERS, 0)
+                detail['seconds'] = 0.0
+                self._stages[stage] = detail
+
+            detail['seconds'] += seconds
+            for counter, count in counts.items():
+                detail[counter] += count
+
+    @contextmanager
+    def stage(self, stage):
+        """Time a block of work as a stage
+
+        Exceptions raised from the block are counted as errors of the stage.
+
+        Parameters
+        ----------
+        stage : str
+            The name of the stage
+        """
+        reset = _ACTIVE_STAGE.set(stage)
+        start = self._timer()
+        errors = 0
+        try:
+            yield
+        except Exception:
+            errors = 1
+            raise
+        finally:
+            _ACTIVE_STAGE.reset(reset)
+            self.add(stage, self._timer() - start, errors=errors)
+
+    def to_dict(self):
+        """Summarize the profile
+
+        Returns
+        -------
+        dict
+            The name of the profile, the seconds since it started, and the
+            detail of each stage in the order they were first observed
+        """
+        with self._lock:
+            stages = {stage: dict(detail)
+                      for stage, detail in self._stages.items()}
+        return {'name': self.name,
+                'seconds': self._timer() - self._started,
+                'stages': stages}
+
+    def server_timing(self):
+        """Express the profile as a Server-Timing header value
+
+        Returns
+        -------
+        str
+            A metric per stage with its duration in milliseconds, and a
+            description of its counters
+        """
+        summary = self.to_dict()
+        metrics = ['%s;dur=%.1f;desc="%s"' % (
+                       stage, detail['seconds'] * 1000,
+                       ' '.join('%s=%d' % (counter, detail[counter])
+                                for counter in COUNTERS))
+                   for stage, detail in summary['stages'].items()]
+        metrics.append('total;dur=%.1f' % (summary['seconds'] * 1000))
+        return ', '.join(metrics)
+
+    def log(self, **fields):
+        """Emit the profile as a single structured log line
+
+        Parameters
+        ----------
+        fields : dict
+            Additional JSON serializable detail to include
+        """
+        summary = self.to_dict()
+        summary.update(fields)
+        LOGGER.info("profile %s", json.dumps(summary, sort_keys=True))
+
+
+@contextmanager
+def profiling(profile):
+    """Attribute work performed within the block to a profile
+
+    Parameters
+    ----------
+    profile : Profile
+        The profile to record to
+    """
+    reset = _ACTIVE_PROFILE.set(profile)
+    try:
+        yield profile
+    finally:
+        _ACTIVE_PROFILE.reset(reset)
+
+
+@contextmanager
+def stage(name):
+    """Time a block of work as a stage of the active profile, if any
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage
+    """
+    profile = _ACTIVE_PROFILE.get()
+    if profile is None:
+        yield
+    else:
+        with profile.stage(name):
+            yield
+
+
+def record(**counts):
+    """Count work toward the active stage of the active profile, if any
+
+    Parameters
+    ----------
+    counts : dict
+        The amount to add to each of COUNTERS
+    """
+    profile = _ACTIVE_PROFILE.get()
+    stage_name = _ACTIVE_STAGE.get()
+    if profile is not None and stage_name is not None:
+        profile.add(stage_name, **counts)
+
+
+def is_profiling():
+    """Determine whether work is being attributed to a profile"""
+    return _ACTIVE_PROFILE.get() is not None
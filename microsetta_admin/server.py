@@ -1,22 +1,42 @@
+import asyncio
 import csv
 import jwt
-from flask import render_template, Flask, request, session, send_file, url_for
+from flask import (render_template, Flask, request, session, send_file,
+                   url_for, Response, jsonify)
+from flask.logging import default_handler
 import secrets
 from datetime import datetime
 import io
+import json
+import logging
+import os
+import re
+import time
+import zipfile
 
 from jwt import PyJWTError
-from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import BadRequest, NotFound
 from werkzeug.utils import redirect
 import pandas as pd
 
-from microsetta_admin import metadata_util, upload_util
+from microsetta_admin import (job_util, metadata_util, profile_util,
+                              upload_util)
+from microsetta_admin.cache_util import TTLCache
+from microsetta_admin.store_util import Checkpoint
 from microsetta_admin.config_manager import SERVER_CONFIG
-from microsetta_admin._api import APIRequest
+from microsetta_admin._api import APIRequest, AsyncAPIRequest, api_token
 import importlib.resources as pkg_resources
 
 TOKEN_KEY_NAME = 'token'
 SEND_EMAIL_CHECKBOX_DEFAULT_NAME = 'send_email'
+SCAN_UPDATE_ERROR = 'scan_update_error'
+
+# the session is held in a cookie, which browsers limit to about 4KB, so
+# errors from the private API (which may be whole HTML pages) are truncated
+# before they are kept in it
+SCAN_UPDATE_ERROR_MAX_LENGTH = 500
+
+SESSION_EXPIRED = "Your session has expired, please log in again"
 
 PUB_KEY = pkg_resources.read_text(
     'microsetta_admin',
@@ -41,6 +61,37 @@ STATUS_OPTIONS = [DUMMY_SELECT_TEXT, VALID_STATUS, NO_SOURCE_STATUS,
 
 API_PROJECTS_URL = '/api/admin/projects'
 
+# large metadata pulldowns are run in the background rather than holding a
+# web worker for the duration of the request
+PULLDOWN_JOBS = job_util.JobRunner()
+
+# the timing profile of a pulldown, if requested, is saved alongside the
+# result of a job, or archived with the metadata of a synchronous pulldown
+PULLDOWN_PROFILE_FILENAME = 'profile.json'
+
+# the wells of a plate, in the order samples are placed on it
+PLATE_ROWS = 'ABCDEFGH'
+PLATE_COLUMNS = 12
+PLATE_WELLS = ['%s%d' % (row, column) for row in PLATE_ROWS
+               for column in range(1, PLATE_COLUMNS + 1)]
+VALID_WELL = re.compile(r'([A-H])0*([1-9]|1[0-2])')
+
+# what the scan page shows of a sample is retained briefly, so that a scan's
+# POST/redirect cycle does not request it again. Entries are keyed by
+# (token, kind, identifier). Loading a plate caches up to three entries per
+# well, its sample, events and observations, so the cache is sized to hold a
+# full plate alongside the scans of single samples.
+SCAN_CONTEXT_CACHE = TTLCache(
+    maxsize=SERVER_CONFIG.get("scan_context_cache_size", 512),
+    ttl=SERVER_CONFIG.get("scan_context_cache_ttl", 30))
+
+# projects change rarely, yet most pages list them. The private API's output
+# is retained, keyed by (token, include_stats, is_active), and discarded
+# whenever a project is created or updated through manage_projects.
+PROJECTS_CACHE = TTLCache(
+    maxsize=SERVER_CONFIG.get("projects_cache_size", 32),
+    ttl=SERVER_CONFIG.get("projects_cache_ttl", 300))
+
 
 def handle_pyjwt(pyjwt_error):
     # PyJWTError (Aka, anything wrong with token) will force user to log out
@@ -80,6 +131,15 @@ def build_login_variables():
 
 
 def build_app():
+    # the package logs, such as the profile of each metadata pulldown, are
+    # emitted at INFO, which is otherwise dropped as nothing configures the
+    # root logger. Flask does not add a handler of its own to app.logger
+    # once one is present here.
+    logger = logging.getLogger('microsetta_admin')
+    if default_handler not in logger.handlers:
+        logger.addHandler(default_handler)
+    logger.setLevel(SERVER_CONFIG.get("log_level", "INFO"))
+
     # Create the application instance
     app = Flask(__name__)
 
@@ -174,7 +234,18 @@ def _get_projects(include_stats, is_active):
     projects_uri = API_PROJECTS_URL + f"?include_stats={include_stats}"
     if is_active is not None:
         projects_uri += f"&is_active={is_active}"
-    status, projects_output = APIRequest.get(projects_uri)
+
+    # the private API authorizes each user separately, so what one user
+    # obtained is not served to another
+    key = (APIRequest.get_token(), include_stats, is_active)
+    projects_output = PROJECTS_CACHE.get(key)
+    if projects_output is not None:
+        status = 200
+    else:
+        version = PROJECTS_CACHE.version
+        status, projects_output = APIRequest.get(projects_uri)
+        if status == 200:
+            PROJECTS_CACHE.set(key, projects_output, version=version)
 
     if status >= 400:
         result = {'error_message': f"Unable to load project list: "
@@ -215,6 +286,10 @@ def manage_projects():
             status, api_output = APIRequest.post(
                 API_PROJECTS_URL, json=model)
 
+        # even a failed request may have altered the project, so the cached
+        # lists of every user are discarded
+        PROJECTS_CACHE.clear()
+
         # if api post or put failed
         if status >= 400:
             result = {'error_message': f'Unable to {action} project.'}
@@ -609,15 +684,108 @@ def _check_sample_status(extended_barcode_info):
 #   GET to view the page,
 #   POST to update info for a barcode -AND (possibly)-
 #        email end user about the change in sample status,
-def _scan_get(sample_barcode, update_error, observations):
+def _scan_context_key(kind, identifier):
+    # the private API authorizes each user separately, so what one user
+    # obtained is not served to another
+    return (APIRequest.get_token(), kind, identifier)
+
+
+async def _cached_get(kind, identifier, path):
+    """Obtain part of the scan page from SCAN_CONTEXT_CACHE or the API
+
+    Parameters
+    ----------
+    kind : str
+        What is obtained, such as 'sample'
+    identifier : str
+        The barcode or account the request concerns
+    path : str
+        The private API path to request if the value is not cached
+
+    Returns
+    -------
+    int
+        The status of the request
+    object
+        The output of the request
+    """
+    key = _scan_context_key(kind, identifier)
+    cached = SCAN_CONTEXT_CACHE.get(key)
+    if cached is not None:
+        return 200, cached
+
+    version = SCAN_CONTEXT_CACHE.version
+    status, result = await AsyncAPIRequest.get(path)
+    if status == 200:
+        SCAN_CONTEXT_CACHE.set(key, result, version=version)
+    return status, result
+
+
+def _invalidate_scan_context(kind, identifier):
+    SCAN_CONTEXT_CACHE.invalidate(lambda key: key[1:] == (kind, identifier))
+
+
+def _get_sample(sample_barcode):
+    return _cached_get('sample', sample_barcode,
+                       '/api/admin/search/samples/%s' % sample_barcode)
+
+
+async def _scan_context(sample_barcode):
+    """Concurrently obtain what the scan page shows of a sample
+
+    The event history of the sample's account depends on the sample, so it
+    is requested as soon as the sample is, while the observations are
+    requested alongside both. Each is served from SCAN_CONTEXT_CACHE when
+    possible.
+
+    Parameters
+    ----------
+    sample_barcode : str
+        The barcode of the sample
+
+    Returns
+    -------
+    tuple of (int, object)
+        The status and output of the sample search
+    tuple of (int, object) or None
+        The status and output of the account's events, or None if the
+        sample has no account or could not be found
+    object
+        The observations available for the sample
+    """
+    async def sample_and_events():
+        status, result = await _get_sample(sample_barcode)
+
+        events = None
+        if status == 200 and result.get('account'):
+            account_id = result['account']['id']
+            events = await _cached_get(
+                'events', account_id,
+                '/api/admin/events/accounts/%s' % account_id)
+        return (status, result), events
+
+    (sample, events), (_, observations) = await asyncio.gather(
+        sample_and_events(),
+        _cached_get('observations', sample_barcode,
+                    '/api/admin/scan/observations/%s' % sample_barcode))
+    return sample, events, observations
+
+
+def _fetch_scan_context(sample_barcode):
+    """Obtain the scan context of a single sample, see _scan_context"""
+    context, = AsyncAPIRequest.gather(_scan_context(sample_barcode))
+    return context
+
+
+def _scan_get(sample_barcode, update_error):
     # If there is no sample_barcode in the GET
     # they still need to enter one in the box, so show empty page
-    if sample_barcode is None and observations is None:
+    if sample_barcode is None:
         return render_template('scan.html', **build_login_variables())
 
     # Assuming there is a sample barcode, grab that sample's information
-    status, result = APIRequest.get(
-        '/api/admin/search/samples/%s' % sample_barcode)
+    (status, result), events_response, observations = _fetch_scan_context(
+        sample_barcode)
 
     # If we successfully grab it, show the page to the user
     if status == 200:
@@ -629,12 +797,9 @@ def _scan_get(sample_barcode, update_error, observations):
         if result['latest_scan']:
             latest_status = result['latest_scan']['sample_status']
 
-        account = result.get('account')
         events = []
-        if account:
-            event_status, event_result = APIRequest.get(
-                '/api/admin/events/accounts/%s' % account['id']
-            )
+        if events_response is not None:
+            event_status, event_result = events_response
             if event_status != 200:
                 raise Exception("Couldn't pull event history")
 
@@ -676,6 +841,186 @@ def _scan_get(sample_barcode, update_error, observations):
         raise BadRequest()
 
 
+def _record_scan(sample_barcode, sample_status, technician_notes,
+                 observations):
+    status, response = APIRequest.post(
+        '/api/admin/scan/%s' % sample_barcode,
+        json={
+            "sample_status": sample_status,
+            "technician_notes": technician_notes,
+            "observations": observations
+        }
+    )
+
+    # the sample's scans have changed, or may have
+    _invalidate_scan_context('sample', sample_barcode)
+    return status, response
+
+
+def _parse_plate_manifest():
+    """Obtain the wells of a plate from the submitted manifest
+
+    The manifest is either a csv file with a sample_name column and,
+    optionally, a well column, or barcodes entered one per line, such as
+    from a scanner. Without wells, samples are placed in PLATE_WELLS order.
+    Rows without a sample are empty wells.
+
+    Returns
+    -------
+    list of dict or None
+        The well and barcode of each sample
+    str or None
+        A description of why the manifest could not be used
+    """
+    scanned = request.form.get('barcodes', '').split()
+    if scanned:
+        barcodes, wells = scanned, None
+    else:
+        cols, error = upload_util.parse_request_csv_cols(
+            request, 'file', ['sample_name'], optional=['well'])
+        if error is not None:
+            return None, error
+        barcodes, wells = cols['sample_name'], cols.get('well')
+
+    if wells is None:
+        if len(barcodes) > len(PLATE_WELLS):
+            return None, "A plate holds at most %d samples" % len(PLATE_WELLS)
+        wells = PLATE_WELLS[:len(barcodes)]
+
+    plate = []
+    seen = set()
+    for well, barcode in zip(wells, barcodes):
+        barcode = barcode.strip()
+        if not barcode:
+            continue
+
+        match = VALID_WELL.fullmatch(well.strip().upper())
+        if match is None:
+            return None, "Unknown well: %s" % well
+        well = '%s%s' % match.groups()
+        if well in seen:
+            return None, "Well %s holds more than one sample" % well
+        seen.add(well)
+
+        plate.append({'well': well, 'barcode': barcode})
+
+    if not plate:
+        return None, "The manifest does not list any samples"
+
+    plate.sort(key=lambda w: PLATE_WELLS.index(w['well']))
+    return plate, None
+
+
+def _plate_well(well, context):
+    """Describe a well of the plate from its sample's scan context
+
+    Parameters
+    ----------
+    well : dict
+        The well and barcode of the sample
+    context : tuple
+        The scan context of the sample, as returned by _scan_context
+
+    Returns
+    -------
+    dict
+        The detail of the well shown by the plate scanning page. If the
+        sample could not be loaded, the detail instead includes an error.
+    """
+    (status, result), events_response, observations = context
+    well = dict(well)
+
+    if status == 404:
+        well['error'] = "Barcode %s Not Found" % well['barcode']
+        return well
+    elif status != 200:
+        well['error'] = "Unable to load the sample (%s)" % status
+        return well
+
+    events = []
+    if events_response is not None:
+        event_status, events = events_response
+        if event_status != 200:
+            well['error'] = "Couldn't pull event history"
+            return well
+
+    sample = result['sample'] or {}
+    source = result['source'] or {}
+    latest_status = DUMMY_SELECT_TEXT
+    if result['latest_scan']:
+        latest_status = result['latest_scan']['sample_status']
+
+    well.update(status_warning=_check_sample_status(result),
+                latest_status=latest_status,
+                projects=[p['project'] for p in result['projects_info']],
+                source_type=source.get('source_type'),
+                site=sample.get('site'),
+                collected=sample.get('datetime_collected'),
+                scan_count=len(result['scans_info']),
+                event_count=len(events),
+                observations=observations or [])
+    return well
+
+
+@app.route('/scan/plate', methods=['GET', 'POST'])
+def scan_plate():
+    # a plate's samples are prefetched together, so the technician can move
+    # between wells without waiting on the private API
+    if request.method == 'GET':
+        return render_template('scan_plate.html', **build_login_variables())
+
+    plate, error = _parse_plate_manifest()
+    if error is not None:
+        return render_template('scan_plate.html', **build_login_variables(),
+                               manifest_error=error)
+
+    contexts = AsyncAPIRequest.gather(
+        *[_scan_context(well['barcode']) for well in plate])
+    if any(sample[0] == 401 for sample, _, _ in contexts):
+        return redirect('/logout')
+
+    return render_template('scan_plate.html', **build_login_variables(),
+                           wells=[_plate_well(well, context)
+                                  for well, context in zip(plate, contexts)],
+                           plate_rows=PLATE_ROWS,
+                           plate_columns=PLATE_COLUMNS,
+                           dummy_status=DUMMY_SELECT_TEXT,
+                           status_options=STATUS_OPTIONS)
+
+
+@app.route('/scan/plate/update', methods=['POST'])
+def scan_plate_update():
+    # records the scan of a single well. The outcome is reported as JSON so
+    # that the plate scanning page can show any failure against its well.
+    body = request.get_json(silent=True) or {}
+    sample_barcode = body.get('sample_barcode')
+    sample_status = body.get('sample_status')
+    if not sample_barcode:
+        return jsonify(sample_barcode=sample_barcode,
+                       error="No sample barcode provided"), 400
+    if sample_status not in STATUS_OPTIONS or \
+            sample_status == DUMMY_SELECT_TEXT:
+        return jsonify(sample_barcode=sample_barcode,
+                       error="A scan cannot be saved without a valid "
+                             "sample_status"), 400
+
+    status, response = _record_scan(sample_barcode, sample_status,
+                                    body.get('technician_notes', ''),
+                                    body.get('observations', []))
+    if status == 401:
+        return jsonify(sample_barcode=sample_barcode,
+                       error=SESSION_EXPIRED), 401
+    elif status != 201:
+        # a rejection by the private API is passed on, while any other
+        # failure of it is reported as a bad gateway
+        code = status if 400 <= status < 500 else 502
+        return jsonify(sample_barcode=sample_barcode,
+                       error=str(response)), code
+
+    return jsonify(sample_barcode=sample_barcode, sample_status=sample_status,
+                   error=None), 201
+
+
 def _scan_post_update_info(sample_barcode,
                            technician_notes,
                            sample_status,
@@ -685,6 +1030,17 @@ def _scan_post_update_info(sample_barcode,
                            received_type,
                            recorded_type,
                            observations):
+    """Record a scan, and possibly email the end user about it
+
+    The caller redirects to the scan page once the update is made, so
+    nothing is rendered here.
+
+    Returns
+    -------
+    str or None
+        A description of any error observed, to display on the scan page.
+        SESSION_EXPIRED is returned if the user must log in again.
+    """
 
     ###
     # Bugfix Part 1 for duplicate emails being sent.  Theory is that client is
@@ -696,50 +1052,48 @@ def _scan_post_update_info(sample_barcode,
     # but that is unlikely at the moment.)
     latest_status = None
     # TODO:  Replace this with ETags!
+    # the status is compared against the database, so SCAN_CONTEXT_CACHE is
+    # not consulted: what it holds may predate a change made from another
+    # tab or by another worker
     status, result = APIRequest.get(
         '/api/admin/search/samples/%s' % sample_barcode)
 
-    if result['latest_scan']:
-        latest_status = result['latest_scan']['sample_status']
+    account = None
+    if status == 200:
+        account = result.get('account')
+        if result['latest_scan']:
+            latest_status = result['latest_scan']['sample_status']
     ###
     # Do the actual update
-    status, response = APIRequest.post(
-        '/api/admin/scan/%s' % sample_barcode,
-        json={
-            "sample_status": sample_status,
-            "technician_notes": technician_notes,
-            "observations": observations
-        }
-    )
+    status, response = _record_scan(sample_barcode, sample_status,
+                                    technician_notes, observations)
 
-    # if the update failed, keep track of the error so it can be displayed
-    if status != 201:
-        update_error = response
-        return _scan_get(sample_barcode, update_error, observations)
-    else:
-        update_error = None
+    # if the update failed, keep track of the error so it can be displayed.
+    # On a 401 the response is a redirect rather than a description.
+    if status == 401:
+        return SESSION_EXPIRED
+    elif status != 201:
+        return response
 
     # If we're not supposed to send an email, go back to GET
     if action != "send_email":
-        return _scan_get(sample_barcode, update_error, observations)
+        return None
 
     ###
     # Bugfix Part 2 for duplicate emails being sent.
     if sample_status == latest_status:
         # This is what we'll hit if javascript thinks it's updating status
         # but is out of sync with the database.
-        update_error = "Ignoring Send Email, sample_status would " \
-                       "not have been updated (Displayed page was out of " \
-                       "sync)"
-        return _scan_get(sample_barcode, update_error, observations)
+        return "Ignoring Send Email, sample_status would " \
+               "not have been updated (Displayed page was out of " \
+               "sync)"
     ###
 
     # This is what we'll hit if there are no email templates to send for
     # the new sample status (or if we screw up javascript side :D )
     if template is None:
-        update_error = "Cannot Send Email: No Issue Type Specified " \
-                       "(or no issue types available)"
-        return _scan_get(sample_barcode, update_error, observations)
+        return "Cannot Send Email: No Issue Type Specified " \
+               "(or no issue types available)"
 
     # Otherwise, send out an email to the end user
     status, response = APIRequest.post(
@@ -755,20 +1109,17 @@ def _scan_post_update_info(sample_barcode,
         }
     )
 
+    # the email is recorded as an event of the account
+    if account:
+        _invalidate_scan_context('events', account['id'])
+
     # if the email failed to send, keep track of the error
     # so it can be displayed
-    if status != 200:
-        update_error = response
-    else:
-        update_error = None
-
-    return _scan_get(sample_barcode, update_error, observations)
-
-
-def get_observations(sample_barcode):
-    status, result = APIRequest.get('/api/admin/scan/observations/%s'
-                                    % sample_barcode)
-    return result
+    if status == 401:
+        return SESSION_EXPIRED
+    elif status != 200:
+        return response
+    return None
 
 
 @app.route('/scan', methods=['GET', 'POST'])
@@ -780,14 +1131,11 @@ def scan():
     # form parameters
     if request.method == 'GET':
         sample_barcode = request.args.get('sample_barcode')
-        update_error = None
 
-        if sample_barcode is not None:
-            observations = get_observations(sample_barcode)
-        else:
-            observations = None
+        # an error from a preceding update is shown once
+        update_error = session.pop(SCAN_UPDATE_ERROR, None)
 
-        return _scan_get(sample_barcode, update_error, observations)
+        return _scan_get(sample_barcode, update_error)
 
     # If its a post, make the changes, then refresh the page
     if request.method == 'POST':
@@ -807,21 +1155,42 @@ def scan():
         recorded_type = request.form.get('recorded_type')
         observations = request.form.getlist('observation_id')
 
-        _scan_post_update_info(sample_barcode,
-                               technician_notes,
-                               sample_status,
-                               action,
-                               issue_type,
-                               template,
-                               received_type,
-                               recorded_type,
-                               observations)
+        update_error = _scan_post_update_info(sample_barcode,
+                                              technician_notes,
+                                              sample_status,
+                                              action,
+                                              issue_type,
+                                              template,
+                                              received_type,
+                                              recorded_type,
+                                              observations)
+        if update_error == SESSION_EXPIRED:
+            return redirect('/logout')
+        elif update_error is not None:
+            session[SCAN_UPDATE_ERROR] = \
+                str(update_error)[:SCAN_UPDATE_ERROR_MAX_LENGTH]
         return redirect(url_for('scan', sample_barcode=sample_barcode))
 
 
 @app.route('/metadata_pulldown', methods=['GET', 'POST'])
 def metadata_pulldown():
     allow_missing = request.form.get('allow_missing_samples', False)
+    checkpoint = None
+
+    # whether to bypass the metadata cache
+    refresh = bool(request.values.get('refresh', False))
+
+    output_format = request.values.get('output_format', metadata_util.TSV)
+    columns = _requested_columns()
+
+    # whether to provide the timing profile alongside the metadata
+    save_profile = bool(request.values.get('profile', False))
+    try:
+        metadata_util.check_output_format(output_format)
+    except ValueError as e:
+        return render_template('metadata_pulldown.html',
+                               **build_login_variables(),
+                               search_error=[{'error': str(e)}])
 
     if request.method == 'GET':
         sample_barcode = request.args.get('sample_barcode')
@@ -832,53 +1201,385 @@ def metadata_pulldown():
                                    **build_login_variables())
         sample_barcodes = [sample_barcode]
     elif request.method == 'POST':
-        sample_barcodes, upload_err = upload_util.parse_request_csv_col(
-                                                            request,
-                                                            'file',
-                                                            'sample_name'
-        )
-        if upload_err is not None:
-            return render_template('metadata_pulldown.html',
-                                   **build_login_variables(),
-                                   search_error=[{'error': upload_err}])
+        # pulldowns, and their checkpoints, are only available to the user
+        # who requested them
+        owner = build_login_variables().get('email')
+        checkpoint_id = request.form.get('checkpoint')
+        if checkpoint_id:
+            # a retry of a pulldown which previously failed
+            checkpoint = Checkpoint.load(checkpoint_id, owner=owner)
+            if checkpoint is None:
+                return render_template(
+                    'metadata_pulldown.html',
+                    **build_login_variables(),
+                    search_error=[{'error': 'The previous attempt is no '
+                                            'longer available, please '
+                                            'upload the file again'}])
+            sample_barcodes = checkpoint.sample_barcodes
+        else:
+            sample_barcodes, upload_err = upload_util.parse_request_csv_col(
+                                                                request,
+                                                                'file',
+                                                                'sample_name'
+            )
+            if upload_err is not None:
+                return render_template('metadata_pulldown.html',
+                                       **build_login_variables(),
+                                       search_error=[{'error': upload_err}])
+
+        if request.form.get('run_in_background', False):
+            if checkpoint is not None:
+                checkpoint.close()
+
+            job = PULLDOWN_JOBS.submit(_metadata_pulldown_job,
+                                       APIRequest.get_token(),
+                                       sample_barcodes, bool(allow_missing),
+                                       owner=owner,
+                                       checkpoint_id=checkpoint_id,
+                                       refresh=refresh,
+                                       output_format=output_format,
+                                       columns=columns,
+                                       save_profile=save_profile)
+            return redirect(url_for('metadata_pulldown_job',
+                                    job_id=job.job_id), code=303)
+
+        if checkpoint is None:
+            checkpoint = Checkpoint.create(sample_barcodes, owner=owner)
     else:
         raise BadRequest()
 
-    df, errors = metadata_util.retrieve_metadata(sample_barcodes)
+    profile = profile_util.Profile('metadata_pulldown')
+    try:
+        with profile_util.profiling(profile):
+            df, errors = metadata_util.retrieve_metadata(
+                sample_barcodes, checkpoint=checkpoint, refresh=refresh,
+                columns=columns)
+    finally:
+        # the checkpoint is retained, or discarded, below. It is closed
+        # here in case the pulldown raised.
+        if checkpoint is not None:
+            checkpoint.close()
+    log_fields = {'samples': len(sample_barcodes), 'failed': len(errors),
+                  'output_format': output_format, 'background': False}
 
     # Strangely, these api requests are returning an html error page rather
     # than a machine parseable json error response object with message.
     # This is almost certainly due to error handling for the cohosted minimal
     # client.  In future, we should just pass down whatever the api says here.
     if len(errors) == 0 or allow_missing:
-        df = metadata_util.drop_private_columns(df)
-
-        # TODO:  Streaming direct from pandas is a pain.  Need to search for
-        #  better ways to iterate and chunk this file as we generate it
-        strstream = io.StringIO()
-        df.to_csv(strstream, sep='\t', index=True, header=True)
-
-        # TODO: utf-8 or utf-16 encoding??
-        bytestream = io.BytesIO()
-        bytestream.write(strstream.getvalue().encode('utf-8'))
-        bytestream.seek(0)
-
-        strstream.close()
-        return send_file(bytestream,
-                         mimetype="text/tab-separated-values",
-                         as_attachment=True,
-                         download_name="metadata_pulldown.tsv",
-                         etag=False,
-                         max_age=None,
-                         conditional=False,
-                         last_modified=None,
-                         )
+        if checkpoint is not None:
+            checkpoint.discard()
+
+        with profile.stage('drop_private'):
+            df = metadata_util.drop_private_columns(df)
+
+        mimetype, extension = metadata_util.OUTPUT_FORMATS[output_format]
+        if save_profile:
+            # the profile is only complete once the metadata is serialized,
+            # so the two are returned together as an archive rather than
+            # streamed
+            archive = _profiled_archive(profile, df, output_format,
+                                        'metadata_pulldown.%s' % extension,
+                                        log_fields)
+            response = send_file(archive, mimetype="application/zip",
+                                 as_attachment=True,
+                                 download_name="metadata_pulldown.zip")
+            response.headers["Server-Timing"] = profile.server_timing()
+            return response
+
+        # the response is written as it is serialized, so only a chunk of
+        # rows is held as text at any one time rather than whole copies of
+        # the file. The frame is still built in full beforehand, so memory
+        # remains proportional to the number of samples. Serialization is
+        # only reflected in the log, as the headers are sent beforehand.
+        output = _profiled_output(profile, df, output_format, log_fields)
+        return Response(output,
+                        mimetype=mimetype,
+                        headers={"Content-Disposition":
+                                 "attachment; "
+                                 "filename=metadata_pulldown.%s" %
+                                 extension,
+                                 "Server-Timing": profile.server_timing()})
     else:
-
-        return render_template('metadata_pulldown.html',
+        checkpoint_id = None
+        restored, retried = [], []
+        if checkpoint is not None:
+            checkpoint_id = checkpoint.checkpoint_id
+            restored, retried = checkpoint.restored, checkpoint.retried
+
+        profile.log(**log_fields)
+        page = render_template('metadata_pulldown.html',
                                **build_login_variables(),
                                info={'barcodes': sample_barcodes},
-                               search_error=errors)
+                               search_error=errors,
+                               checkpoint_id=checkpoint_id,
+                               restored=restored,
+                               retried=retried,
+                               output_format=output_format,
+                               columns=columns,
+                               save_profile=save_profile)
+        return page, {"Server-Timing": profile.server_timing()}
+
+
+def _profiled_output(profile, df, output_format, log_fields):
+    """Serialize a pulldown, recording the serialization to a profile
+
+    The profile is logged once the output is exhausted or abandoned.
+
+    Parameters
+    ----------
+    profile : profile_util.Profile
+        The profile of the pulldown
+    df : pd.DataFrame
+        The metadata to serialize
+    output_format : str
+        One of metadata_util.OUTPUT_FORMATS
+    log_fields : dict
+        Additional detail to log with the profile
+
+    Returns
+    -------
+    generator of bytes
+        The serialized metadata
+    """
+    try:
+        chunks = metadata_util.iter_output(df, output_format)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            profile.add('serialize', time.perf_counter() - start,
+                        bytes=0 if chunk is None else len(chunk))
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        profile.log(**log_fields)
+
+
+def _profiled_archive(profile, df, output_format, filename, log_fields):
+    """Serialize a pulldown to a zip archive along with its profile
+
+    Parameters
+    ----------
+    profile : profile_util.Profile
+        The profile of the pulldown
+    df : pd.DataFrame
+        The metadata to serialize
+    output_format : str
+        One of metadata_util.OUTPUT_FORMATS
+    filename : str
+        The name of the metadata within the archive
+    log_fields : dict
+        Additional detail to log with the profile
+
+    Returns
+    -------
+    io.BytesIO
+        The archive, holding the metadata and PULLDOWN_PROFILE_FILENAME
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(filename, 'w') as fp:
+            for chunk in _profiled_output(profile, df, output_format,
+                                          log_fields):
+                fp.write(chunk)
+        archive.writestr(PULLDOWN_PROFILE_FILENAME,
+                         json.dumps(profile.to_dict()))
+    buffer.seek(0)
+    return buffer
+
+
+def _requested_columns():
+    """Obtain the column allowlist of a pulldown request
+
+    Columns may be provided as repeated "columns" values, each of which may
+    list several separated by commas or whitespace.
+
+    Returns
+    -------
+    list of str or None
+        The requested columns, or None if every column is requested
+    """
+    columns = [column
+               for value in request.values.getlist('columns')
+               for column in value.replace(',', ' ').split()]
+    return columns or None
+
+
+def _metadata_pulldown_job(job, token, sample_barcodes, allow_missing,
+                           checkpoint_id=None, refresh=False,
+                           output_format=metadata_util.TSV, columns=None,
+                           save_profile=False):
+    """Retrieve metadata in the background, writing the result to the job
+
+    Parameters
+    ----------
+    job : job_util.Job
+        The job to report progress through
+    token : str
+        The token of the user who submitted the job
+    sample_barcodes : list of str
+        The barcodes to request
+    allow_missing : bool
+        Whether to produce metadata if any barcodes could not be obtained
+    checkpoint_id : str, optional
+        The checkpoint of an earlier attempt to resume from
+    refresh : bool, optional
+        Whether to bypass the metadata cache
+    output_format : str, optional
+        One of metadata_util.OUTPUT_FORMATS
+    columns : list of str, optional
+        The columns to produce. If not specified, every column is produced.
+    save_profile : bool, optional
+        Whether to save the timing profile of the job alongside its result
+    """
+    # the checkpoint is that of the user who submitted the job
+    owner = job.status().get('owner')
+    checkpoint = None
+    if checkpoint_id is not None:
+        checkpoint = Checkpoint.load(checkpoint_id, owner=owner)
+    if checkpoint is None:
+        checkpoint = Checkpoint.create(sample_barcodes, owner=owner)
+
+    # checkpoints may be disabled, in which case a retry starts afresh
+    checkpoint_id = None if checkpoint is None else checkpoint.checkpoint_id
+
+    job.update(total=len(set(sample_barcodes)), fetched=0, failed=0,
+               errors=[], checkpoint_id=checkpoint_id,
+               output_format=output_format, columns=columns)
+
+    def progress(barcode, error):
+        if error is None:
+            job.increment(fetched=1)
+        else:
+            job.increment(failed=1, append={'errors': error})
+
+    profile = profile_util.Profile('metadata_pulldown')
+    try:
+        with profile_util.profiling(profile):
+            _run_pulldown_job(job, token, sample_barcodes, allow_missing,
+                              checkpoint, progress, refresh=refresh,
+                              output_format=output_format, columns=columns)
+    finally:
+        profile.log(job_id=job.job_id, samples=len(sample_barcodes),
+                    failed=job.status().get('failed', 0),
+                    output_format=output_format, background=True)
+        if save_profile:
+            with open(os.path.join(job.path, PULLDOWN_PROFILE_FILENAME),
+                      'w') as fp:
+                json.dump(profile.to_dict(), fp)
+            job.update(profile=True)
+
+
+def _run_pulldown_job(job, token, sample_barcodes, allow_missing, checkpoint,
+                      progress, refresh, output_format, columns):
+    # obtain and write the metadata of _metadata_pulldown_job, within its
+    # profile
+    try:
+        with api_token(token):
+            df, errors = metadata_util.retrieve_metadata(
+                sample_barcodes, progress=progress, checkpoint=checkpoint,
+                refresh=refresh, columns=columns)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    if checkpoint is not None:
+        job.update(restored=len(checkpoint.restored),
+                   retried=len(checkpoint.retried))
+
+    if len(errors) == 0 or allow_missing:
+        if checkpoint is not None:
+            checkpoint.discard()
+        with profile_util.stage('drop_private'):
+            df = metadata_util.drop_private_columns(df)
+
+        # write then move so that a partial file is never served
+        partial = job.result_path + '.partial'
+        with profile_util.stage('serialize'), open(partial, 'wb') as fp:
+            for chunk in metadata_util.iter_output(df, output_format):
+                fp.write(chunk)
+                profile_util.record(bytes=len(chunk))
+        os.replace(partial, job.result_path)
+        job.update(errors=errors)
+    else:
+        job.update(state=job_util.FAILED, errors=errors,
+                   message="Metadata could not be obtained for all samples")
+
+
+def _get_pulldown_job(job_id):
+    # jobs are only visible to the user who submitted them. The token is
+    # otherwise verified by the private API on each request.
+    if TOKEN_KEY_NAME not in session:
+        return None
+    email = parse_jwt(session[TOKEN_KEY_NAME])['email']
+
+    # the jobs of other users are indistinguishable from those which do not
+    # exist
+    job = PULLDOWN_JOBS.get(job_id)
+    if job is None or job.status().get('owner') != email:
+        raise NotFound()
+    return job
+
+
+@app.route('/metadata_pulldown/jobs/<job_id>', methods=['GET'])
+def metadata_pulldown_job(job_id):
+    job = _get_pulldown_job(job_id)
+    if job is None:
+        return redirect('/')
+
+    return render_template('metadata_pulldown_job.html',
+                           **build_login_variables(),
+                           job=job.public_status())
+
+
+@app.route('/metadata_pulldown/jobs/<job_id>/status', methods=['GET'])
+def metadata_pulldown_job_status(job_id):
+    job = _get_pulldown_job(job_id)
+    if job is None:
+        return jsonify(message="Not logged in"), 401
+
+    status = job.public_status()
+    if status['state'] == job_util.COMPLETE:
+        status['download_url'] = url_for('metadata_pulldown_job_download',
+                                         job_id=job_id)
+    if status.get('profile'):
+        status['profile_url'] = url_for('metadata_pulldown_job_profile',
+                                        job_id=job_id)
+    return jsonify(status)
+
+
+@app.route('/metadata_pulldown/jobs/<job_id>/profile', methods=['GET'])
+def metadata_pulldown_job_profile(job_id):
+    job = _get_pulldown_job(job_id)
+    if job is None:
+        return redirect('/')
+
+    path = os.path.join(job.path, PULLDOWN_PROFILE_FILENAME)
+    if not job.status().get('profile') or not os.path.exists(path):
+        raise NotFound()
+
+    return send_file(path, mimetype="application/json", as_attachment=True,
+                     download_name="metadata_pulldown_profile.json")
+
+
+@app.route('/metadata_pulldown/jobs/<job_id>/download', methods=['GET'])
+def metadata_pulldown_job_download(job_id):
+    job = _get_pulldown_job(job_id)
+    if job is None:
+        return redirect('/')
+
+    status = job.status()
+    if status['state'] != job_util.COMPLETE:
+        raise NotFound()
+
+    # jobs which predate the choice of format were written as TSV
+    output_format = status.get('output_format', metadata_util.TSV)
+    mimetype, extension = metadata_util.OUTPUT_FORMATS[output_format]
+    return send_file(job.result_path,
+                     mimetype=mimetype,
+                     as_attachment=True,
+                     download_name="metadata_pulldown.%s" % extension)
 
 
 @app.route('/submit_daklapack_order', methods=['GET'])
@@ -0,0 +1,123 @@
+"use strict";
+//Supports scanning the samples of a plate without waiting on the server.
+//The page moves to the next well as soon as a scan is submitted, while the
+//scans are sent in the background.
+
+//The index of the well step positions away, wrapping around the plate
+function nextWellIndex(count, index, step){
+    return ((index + step) % count + count) % count;
+}
+
+//The index of the first well holding barcode, or -1
+function findWell(wells, barcode){
+    barcode = barcode.trim();
+    for (var i = 0; i < wells.length; i++){
+        if (wells[i].barcode === barcode)
+            return i;
+    }
+    return -1;
+}
+
+//Sends updates with a bounded number outstanding at a time.
+//
+//send is a function taking an update and returning a Promise which resolves
+//to {ok: bool, error: string}. Updates are keyed, such as by well. Should a
+//key be updated again before its previous update is sent, only the latest
+//is sent, and updates of a single key are never outstanding concurrently,
+//so they are applied in the order made.
+//
+//onChange is called with the key, state and any error whenever the state of
+//a key changes. The states are "queued", "saving", "saved" and "failed".
+class UpdateQueue {
+    constructor(send, maxInFlight, onChange){
+        this.send = send;
+        this.maxInFlight = maxInFlight;
+        this.onChange = onChange || function(){};
+        this.pending = new Map();
+        this.inFlight = new Set();
+        this.states = {};
+        this.errors = {};
+        this.failed = {};
+    }
+
+    enqueue(key, update){
+        this.pending.set(key, update);
+        delete this.failed[key];
+        this._setState(key, "queued", null);
+        this._pump();
+    }
+
+    //Send the last failed update of key again
+    retry(key){
+        if (key in this.failed)
+            this.enqueue(key, this.failed[key]);
+    }
+
+    state(key){
+        return this.states[key];
+    }
+
+    //Whether every update has been sent
+    isIdle(){
+        return this.pending.size === 0 && this.inFlight.size === 0;
+    }
+
+    _setState(key, state, error){
+        this.states[key] = state;
+        this.errors[key] = error;
+        this.onChange(key, state, error);
+    }
+
+    _pump(){
+        for (const [key, update] of this.pending){
+            if (this.inFlight.size >= this.maxInFlight)
+                break;
+            if (this.inFlight.has(key))
+                continue;
+
+            this.pending.delete(key);
+            this.inFlight.add(key);
+            this._setState(key, "saving", null);
+            this._send(key, update);
+        }
+    }
+
+    _send(key, update){
+        var self = this;
+        var finish = function(result){
+            self.inFlight.delete(key);
+
+            //a newer update supersedes the outcome of this one
+            if (!self.pending.has(key)){
+                if (result.ok){
+                    self._setState(key, "saved", null);
+                } else {
+                    self.failed[key] = update;
+                    self._setState(key, "failed", result.error);
+                }
+            }
+            self._pump();
+        };
+
+        var sent;
+        try {
+            sent = Promise.resolve(this.send(update));
+        } catch (e) {
+            sent = Promise.reject(e);
+        }
+        sent.then(finish, function(e){
+            finish({ok: false, error: String(e)});
+        });
+    }
+}
+
+// Expose any unit-testable functionality to node's module.exports
+// This will enable these functions to be called by our test suite.
+// "if" statement prevents dereferencing null when script is included in browser.
+if (typeof module !== 'undefined' && typeof module.exports !== 'undefined'){
+  module.exports = {
+    "nextWellIndex": nextWellIndex,
+    "findWell": findWell,
+    "UpdateQueue": UpdateQueue
+  }
+}
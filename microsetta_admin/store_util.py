@@ -0,0 +1,350 @@
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from microsetta_admin.config_manager import SERVER_CONFIG
+
+# checkpoints of partially completed pulldowns may optionally be retained on
+# local disk so that a retry only needs to request what previously failed.
+# They hold metadata from before private columns are removed, so they are
+# disabled if no directory is configured.
+CHECKPOINT_DIR = SERVER_CONFIG.get("checkpoint_dir")
+
+# the number of seconds an unused checkpoint is retained
+CHECKPOINT_MAX_AGE = SERVER_CONFIG.get("checkpoint_max_age", 86400)
+
+CHECKPOINT_SUFFIX = '.sqlite'
+
+VALID_CHECKPOINT_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+
+class PayloadStore:
+    """JSON payloads keyed by a string, persisted with SQLite
+
+    The store may be shared by threads, and by processes through the
+    underlying file.
+
+    Parameters
+    ----------
+    path : str
+        The database file to use, which is created if it does not exist
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        # payloads may include private metadata, so the database is only
+        # accessible to its owner. SQLite gives its write-ahead log and
+        # shared memory files the same permissions.
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        with self._lock, self._conn:
+            # write-ahead logging permits readers concurrent with a writer
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS payloads ("
+                               "key TEXT PRIMARY KEY, "
+                               "payload TEXT, "
+                               "error TEXT, "
+                               "stored REAL NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS attributes ("
+                               "name TEXT PRIMARY KEY, "
+                               "value TEXT NOT NULL)")
+
+    def get_many(self, keys, max_age=None):
+        """Obtain stored payloads
+
+        Parameters
+        ----------
+        keys : Iterable of str
+            The keys to look up
+        max_age : float, optional
+            If specified, payloads stored more than max_age seconds ago are
+            treated as absent
+
+        Returns
+        -------
+        dict
+            The payloads of the keys present, keyed by key
+        """
+        keys = list(keys)
+        oldest = -1 if max_age is None else time.time() - max_age
+
+        found = {}
+        with self._lock:
+            # bound the number of parameters per statement, as SQLite limits
+            # them
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, payload FROM payloads "
+                    "WHERE payload IS NOT NULL AND stored >= ? "
+                    "AND key IN (%s)" % ','.join('?' * len(batch)),
+                    [oldest] + batch)
+                found.update((key, json.loads(payload))
+                             for key, payload in rows)
+        return found
+
+    def errors(self):
+        """Obtain the keys whose most recent outcome was an error
+
+        Returns
+        -------
+        dict
+            The errors keyed by key
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT key, error FROM payloads "
+                                      "WHERE payload IS NULL").fetchall()
+        return {key: json.loads(error) for key, error in rows}
+
+    def put(self, key, payload):
+        """Store a payload
+
+        Parameters
+        ----------
+        key : str
+            The key of the payload
+        payload : object
+            The JSON serializable payload
+        """
+        self._put(key, json.dumps(payload), None)
+
+    def put_error(self, key, error):
+        """Record that a payload could not be obtained
+
+        Any payload previously stored for the key is removed.
+
+        Parameters
+        ----------
+        key : str
+            The key of the payload
+        error : object
+            The JSON serializable error detail
+        """
+        self._put(key, None, json.dumps(error, default=str))
+
+    def _put(self, key, payload, error):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO payloads "
+                               "(key, payload, error, stored) "
+                               "VALUES (?, ?, ?, ?)",
+                               (key, payload, error, time.time()))
+
+    def delete(self, keys=None):
+        """Remove payloads
+
+        Parameters
+        ----------
+        keys : Iterable of str, optional
+            The keys to remove. If not specified, all payloads are removed.
+        """
+        with self._lock, self._conn:
+            if keys is None:
+                self._conn.execute("DELETE FROM payloads")
+            else:
+                self._conn.executemany("DELETE FROM payloads WHERE key = ?",
+                                       [(key, ) for key in keys])
+
+    def get_attribute(self, name, default=None):
+        """Obtain a JSON serializable value associated with the store"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM attributes "
+                                     "WHERE name = ?", (name, )).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_attribute(self, name, value):
+        """Associate a JSON serializable value with the store"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO attributes "
+                               "(name, value) VALUES (?, ?)",
+                               (name, json.dumps(value)))
+
+    def close(self):
+        """Release the connection to the database"""
+        with self._lock:
+            self._conn.close()
+
+
+class Checkpoint:
+    """The per-barcode progress of a metadata pulldown
+
+    Metadata is retained for each barcode successfully fetched, so that a
+    subsequent attempt of the same pulldown only requests the barcodes which
+    were not.
+
+    Parameters
+    ----------
+    checkpoint_id : str
+        The ID of the checkpoint
+    store : PayloadStore
+        The store holding the checkpoint
+
+    Attributes
+    ----------
+    restored : list of str
+        The barcodes served from the checkpoint by the latest attempt
+    retried : list of str
+        The barcodes requested again by the latest attempt, as they had
+        failed previously
+    """
+    BARCODES = 'barcodes'
+    OWNER = 'owner'
+
+    def __init__(self, checkpoint_id, store):
+        self.checkpoint_id = checkpoint_id
+        self.store = store
+        self.restored = []
+        self.retried = []
+
+    @classmethod
+    def create(cls, sample_barcodes, owner=None, root=None):
+        """Start a checkpoint for a pulldown
+
+        Parameters
+        ----------
+        sample_barcodes : list of str
+            The barcodes of the pulldown
+        owner : str, optional
+            The user who requested the pulldown, who alone may resume it
+        root : str, optional
+            The directory to hold checkpoints. If not specified,
+            CHECKPOINT_DIR is used.
+
+        Returns
+        -------
+        Checkpoint or None
+            The new checkpoint, or None if checkpoints are disabled
+        """
+        root = CHECKPOINT_DIR if root is None else root
+        if root is None:
+            return None
+
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        _purge_checkpoints(root)
+
+        checkpoint_id = secrets.token_urlsafe(16)
+        store = PayloadStore(_checkpoint_path(root, checkpoint_id))
+        store.set_attribute(cls.BARCODES, list(sample_barcodes))
+        store.set_attribute(cls.OWNER, owner)
+        return cls(checkpoint_id, store)
+
+    @classmethod
+    def load(cls, checkpoint_id, owner=None, root=None):
+        """Resume a checkpoint
+
+        Parameters
+        ----------
+        checkpoint_id : str
+            The ID of the checkpoint
+        owner : str, optional
+            The user resuming the checkpoint
+        root : str, optional
+            The directory holding checkpoints. If not specified,
+            CHECKPOINT_DIR is used.
+
+        Returns
+        -------
+        Checkpoint or None
+            The checkpoint, or None if it does not exist, belongs to another
+            user or checkpoints are disabled
+        """
+        root = CHECKPOINT_DIR if root is None else root
+        if root is None or \
+                not VALID_CHECKPOINT_ID.fullmatch(checkpoint_id or ''):
+            return None
+
+        path = _checkpoint_path(root, checkpoint_id)
+        if not os.path.exists(path):
+            return None
+
+        # checkpoints hold metadata from before private columns are
+        # removed, so those of other users are indistinguishable from those
+        # which do not exist
+        store = PayloadStore(path)
+        if store.get_attribute(cls.OWNER) != owner:
+            store.close()
+            return None
+
+        # note the use so the checkpoint is not purged
+        os.utime(path)
+        return cls(checkpoint_id, store)
+
+    @property
+    def sample_barcodes(self):
+        """The barcodes of the pulldown"""
+        return self.store.get_attribute(self.BARCODES, [])
+
+    def restore(self, sample_barcodes):
+        """Obtain previously fetched metadata
+
+        Parameters
+        ----------
+        sample_barcodes : list of str
+            The barcodes of interest
+
+        Returns
+        -------
+        dict
+            The metadata of each barcode which had been fetched, keyed by
+            barcode
+        """
+        restored = self.store.get_many(sample_barcodes)
+        failed = self.store.errors()
+
+        self.restored = [bc for bc in sample_barcodes if bc in restored]
+        self.retried = [bc for bc in sample_barcodes if bc in failed]
+        return restored
+
+    def record(self, sample_barcode, metadata, error):
+        """Note the outcome of fetching a barcode
+
+        Parameters
+        ----------
+        sample_barcode : str
+            The barcode fetched
+        metadata : dict
+            The metadata obtained
+        error : dict or None
+            The error observed, if any
+        """
+        if error is None:
+            self.store.put(sample_barcode, metadata)
+        else:
+            self.store.put_error(sample_barcode, error)
+
+    def close(self):
+        """Release the checkpoint, retaining it for a later attempt"""
+        self.store.close()
+
+    def discard(self):
+        """Remove the checkpoint as it is no longer needed"""
+        self.store.close()
+        _remove_database(self.store.path)
+
+
+def _checkpoint_path(root, checkpoint_id):
+    return os.path.join(root, checkpoint_id + CHECKPOINT_SUFFIX)
+
+
+def _purge_checkpoints(root):
+    cutoff = time.time() - CHECKPOINT_MAX_AGE
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.endswith(CHECKPOINT_SUFFIX) and \
+                os.path.getmtime(path) < cutoff:
+            _remove_database(path)
+
+
+def _remove_database(path):
+    # SQLite may hold a write-ahead log and shared memory alongside the
+    # database
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
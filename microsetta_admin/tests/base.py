@@ -1,7 +1,9 @@
 from unittest import TestCase
 from unittest.mock import patch
 import pkg_resources
-from microsetta_admin.server import app
+from microsetta_admin.server import (PROJECTS_CACHE, SCAN_CONTEXT_CACHE,
+                                     app)
+from microsetta_admin.metadata_util import SURVEY_TEMPLATE_CACHE
 
 
 class TestBase(TestCase):
@@ -10,13 +12,21 @@ class TestBase(TestCase):
     def setUp(self):
         # mocking derived from
         # https://realpython.com/testing-third-party-apis-with-mocks/
-        self.mock_get_patcher = patch('microsetta_admin._api.requests.get')
+        self.mock_get_patcher = patch(
+            'microsetta_admin._api.requests.Session.get')
         self.mock_get = self.mock_get_patcher.start()
-        self.mock_put_patcher = patch('microsetta_admin._api.requests.put')
+        self.mock_put_patcher = patch(
+            'microsetta_admin._api.requests.Session.put')
         self.mock_put = self.mock_put_patcher.start()
-        self.mock_post_patcher = patch('microsetta_admin._api.requests.post')
+        self.mock_post_patcher = patch(
+            'microsetta_admin._api.requests.Session.post')
         self.mock_post = self.mock_post_patcher.start()
 
+        # process-wide caches must not leak state between tests
+        SURVEY_TEMPLATE_CACHE.clear()
+        SCAN_CONTEXT_CACHE.clear()
+        PROJECTS_CACHE.clear()
+
         app.testing = True
         self.app = app.test_client()
 
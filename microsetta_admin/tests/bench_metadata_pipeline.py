@@ -0,0 +1,210 @@
+"""Benchmarks for the stages of a metadata pulldown
+
+These are not collected by the test runner. To execute:
+
+    python -m microsetta_admin.tests.bench_metadata_pipeline
+
+Each stage is timed, and the peak memory it allocates recorded, over
+synthetic private API payloads which include multiselect and free text
+questions, duplicate surveys, and a mix of human, animal and environmental
+sources. Results may be saved with --output, and compared against a prior
+run with --baseline, so that regressions are visible.
+"""
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+from microsetta_admin.metadata_transforms import (HUMAN_TRANSFORMS,
+                                                  apply_transforms)
+from microsetta_admin.metadata_util import (_build_frame,
+                                            _construct_multiselect_map,
+                                            _to_pandas_dataframe,
+                                            drop_private_columns)
+from microsetta_admin.tests.synthetic import (make_sample_metadata,
+                                              make_survey_templates)
+
+SOURCE_TYPES = {'human': 0.9, 'animal': 0.06, 'environmental': 0.04}
+DUPLICATE_FRACTION = 0.02
+
+# a change in time or memory beyond this ratio of the baseline is flagged
+REGRESSION_RATIO = 1.2
+
+
+def make_payloads(n, seed=0):
+    """Construct survey templates and sample metadata for a pulldown"""
+    templates = make_survey_templates(n_multiselect=40, n_choices=12,
+                                      n_free_text=8, n_secondary=10)
+    metadatas = make_sample_metadata(n, templates, seed=seed,
+                                     source_types=SOURCE_TYPES,
+                                     duplicate_fraction=DUPLICATE_FRACTION)
+    return templates, metadatas
+
+
+def measure(func, repeat, setup=None):
+    """Time a function and observe its peak memory
+
+    Memory is observed through a separate call, as tracing allocations
+    slows the function.
+
+    Parameters
+    ----------
+    func : callable
+        The function to measure
+    repeat : int
+        The number of times to execute func for timing
+    setup : callable, optional
+        Constructs the argument to each call of func, outside of the
+        measurement. If not specified, func takes no arguments.
+
+    Returns
+    -------
+    dict
+        The fastest wall time in seconds, and the peak bytes allocated
+        by a single call
+    object
+        The result of func
+    """
+    def call():
+        args = () if setup is None else (setup(), )
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+
+    args = () if setup is None else (setup(), )
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del args, result
+
+    best = float('inf')
+    for _ in range(repeat):
+        seconds, result = call()
+        best = min(best, seconds)
+    return {'seconds': best, 'peak_bytes': peak}, result
+
+
+def bench_size(n, repeat):
+    """Measure each stage of the pipeline over n samples
+
+    Returns
+    -------
+    dict
+        The measurements of each stage, keyed by stage
+    """
+    templates, metadatas = make_payloads(n)
+    multiselect_map = _construct_multiselect_map(templates)
+    built = _build_frame(metadatas, multiselect_map)
+
+    results = {}
+    results['_to_pandas_dataframe'], _ = measure(
+        lambda: _to_pandas_dataframe(metadatas, templates), repeat)
+
+    # apply_transforms alters its input, so each call is given a copy
+    results['apply_transforms'], df = measure(
+        lambda frame: apply_transforms(frame, HUMAN_TRANSFORMS), repeat,
+        setup=built.copy)
+    results['drop_private_columns'], _ = measure(
+        lambda: drop_private_columns(df), repeat)
+    return results
+
+
+def bench_pipeline(sizes, repeat):
+    """Time the frame construction, transforms and private column removal
+
+    Returns
+    -------
+    dict
+        The measurements of each stage, keyed by the number of samples
+    """
+    results = {}
+
+    print("metadata pipeline")
+    print("%10s %-22s %10s %10s" % ('samples', 'stage', 'time (s)',
+                                    'peak (MB)'))
+    for n in sizes:
+        results[n] = bench_size(n, repeat)
+        gc.collect()
+
+        for stage, detail in results[n].items():
+            print("%10d %-22s %10.3f %10.1f" % (
+                n, stage, detail['seconds'], detail['peak_bytes'] / 2 ** 20))
+
+    return results
+
+
+def compare(results, baseline):
+    """Report the change of each measurement relative to a baseline
+
+    Parameters
+    ----------
+    results : dict
+        The measurements, as returned by bench_pipeline
+    baseline : dict
+        Prior measurements of the same form
+
+    Returns
+    -------
+    list of str
+        A description of each measurement beyond REGRESSION_RATIO of its
+        baseline
+    """
+    regressions = []
+
+    print("relative to baseline")
+    print("%10s %-22s %10s %10s" % ('samples', 'stage', 'time', 'peak'))
+    for n, stages in results.items():
+        for stage, detail in stages.items():
+            prior = baseline.get(str(n), {}).get(stage)
+            if prior is None:
+                continue
+
+            ratios = {}
+            for key in ('seconds', 'peak_bytes'):
+                if detail[key] and prior[key]:
+                    ratios[key] = detail[key] / prior[key]
+                    if ratios[key] > REGRESSION_RATIO:
+                        regressions.append("%s at %d samples: %s %.2fx" % (
+                            stage, n, key, ratios[key]))
+
+            print("%10d %-22s %10s %10s" % (
+                n, stage,
+                *('%.2fx' % ratios[k] if k in ratios else 'n/a'
+                  for k in ('seconds', 'peak_bytes'))))
+
+    for regression in regressions:
+        print("REGRESSION: %s" % regression)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="Save the results as JSON")
+    parser.add_argument('--baseline',
+                        help="Compare against results saved by --output")
+    args = parser.parse_args()
+
+    results = bench_pipeline(args.sizes, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Benchmarks for microsetta_admin.metadata_transforms
+
+These are not collected by the test runner. To execute:
+
+    python -m microsetta_admin.tests.bench_metadata_transforms
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from microsetta_admin.metadata_constants import MISSING_VALUE
+from microsetta_admin.metadata_transforms import (AgeYears, BIRTH_MONTH,
+                                                  BIRTH_YEAR,
+                                                  COLLECTION_TIMESTAMP,
+                                                  HUMAN_TRANSFORMS,
+                                                  NormalizeUnits,
+                                                  Transformer,
+                                                  apply_transforms,
+                                                  normalize_units)
+from microsetta_admin.metadata_util import (_build_frame,
+                                            _construct_multiselect_map)
+from microsetta_admin.tests.bench_metadata_util import (
+    _str_apply_transforms, best_of)
+from microsetta_admin.tests.synthetic import (MONTHS, make_sample_metadata,
+                                              make_survey_templates)
+
+
+def make_age_frame(n, seed=0):
+    """Construct birth and collection detail, including missing values"""
+    rng = np.random.default_rng(seed)
+    months = rng.choice(MONTHS + [MISSING_VALUE], n)
+    years = rng.integers(1930, 2015, n).astype(str).astype(object)
+    years[rng.random(n) < 0.1] = MISSING_VALUE
+    collected = ['20%02d-%02d-15T09:30:00' % (y, m)
+                 for y, m in zip(rng.integers(15, 22, n),
+                                 rng.integers(1, 13, n))]
+    return pd.DataFrame({BIRTH_MONTH: months, BIRTH_YEAR: years,
+                         COLLECTION_TIMESTAMP: collected},
+                        index=['%09d' % i for i in range(n)])
+
+
+class _LegacyAgeYears(AgeYears):
+    # the row-wise construction previously used by AgeYears
+    @classmethod
+    def birth_month_year(cls, birth_month, birth_year):
+        def make_month_year(row):
+            mo = row[BIRTH_MONTH]
+            yr = row[BIRTH_YEAR]
+            if pd.isnull(mo) or pd.isnull(yr):
+                return '-'
+            else:
+                return '%s-%s' % (mo, yr)
+
+        df = pd.DataFrame({BIRTH_MONTH: birth_month, BIRTH_YEAR: birth_year})
+        return pd.to_datetime(df.apply(make_month_year, axis=1),
+                              errors='coerce', format='%B-%Y')
+
+
+def bench_age_years(sizes, repeat):
+    """Compare row-wise and vectorized birth month/year parsing"""
+    print("AgeYears")
+    print("%10s %-16s %12s %12s %8s" % ('rows', 'stage', 'row-wise (s)',
+                                        'vector (s)', 'speedup'))
+    for n in sizes:
+        df = make_age_frame(n)
+        stages = [('birth_month_year',
+                   lambda t: t.birth_month_year(df[BIRTH_MONTH],
+                                                df[BIRTH_YEAR]),
+                   pdt.assert_series_equal),
+                  ('apply', lambda t: t.apply(df), pdt.assert_series_equal)]
+
+        for stage, func, check in stages:
+            legacy_time, exp = best_of(lambda: func(_LegacyAgeYears),
+                                       repeat)
+            vector_time, obs = best_of(lambda: func(AgeYears), repeat)
+            check(obs, exp, check_names=False)
+
+            print("%10d %-16s %12.3f %12.3f %7.1fx" % (
+                n, stage, legacy_time, vector_time,
+                legacy_time / vector_time))
+
+
+def make_measurement_frame(n, seed=0):
+    """Construct heights and weights in mixed units, with invalid values"""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for focus_col, units_col, focus_units, _, normalized_units in \
+            NormalizeUnits.CONVERSIONS:
+        values = rng.integers(-5, 200, n).astype(str).astype(object)
+        values[rng.random(n) < 0.1] = MISSING_VALUE
+        units = rng.choice([focus_units, normalized_units, MISSING_VALUE],
+                           n).astype(object)
+        units[rng.random(n) < 0.05] = None
+        columns[focus_col] = values
+        columns[units_col] = units
+    return pd.DataFrame(columns, index=['%09d' % i for i in range(n)])
+
+
+def _label_normalizer(df, focus_col, units_col, units_value, factor):
+    # the implementation previously used per column, which relied on
+    # index label lookups
+    focus = pd.to_numeric(df[focus_col], errors='coerce')
+    units = df[units_col]
+    result = focus.copy()
+    result[result < 0] = None
+    not_null_map = Transformer.not_null_map(result, units)
+    result.loc[not_null_map[~not_null_map].index] = None
+    focus_not_null = result[not_null_map]
+    units_not_null = units[not_null_map]
+    focus_adj = focus_not_null.loc[units_not_null == units_value]
+    result.loc[focus_adj.index] = focus_adj * factor
+    return result
+
+
+def bench_normalize_units(sizes, repeat):
+    """Compare label lookups per column against a single masked pass"""
+    conversions = [c[:4] for c in NormalizeUnits.CONVERSIONS]
+
+    print("normalize_units")
+    print("%10s %12s %12s %8s" % ('rows', 'labels (s)', 'masked (s)',
+                                  'speedup'))
+    for n in sizes:
+        df = make_measurement_frame(n)
+        label_time, exp = best_of(
+            lambda: pd.concat([_label_normalizer(df, *c)
+                               for c in conversions], axis=1), repeat)
+        masked_time, obs = best_of(lambda: normalize_units(df, conversions),
+                                   repeat)
+        pdt.assert_frame_equal(obs, exp.astype(float))
+
+        print("%10d %12.3f %12.3f %7.1fx" % (n, label_time, masked_time,
+                                             label_time / masked_time))
+
+
+def bench_apply_transforms(sizes, repeat):
+    """Compare a str round trip per transform against typed intermediates"""
+    templates = make_survey_templates()
+    multiselect_map = _construct_multiselect_map(templates)
+
+    print("apply_transforms")
+    print("%10s %12s %12s %8s" % ('rows', 'str (s)', 'typed (s)',
+                                  'speedup'))
+    for n in sizes:
+        df = _build_frame(make_sample_metadata(n, templates),
+                          multiselect_map)
+        as_object = df.astype(object)
+
+        str_time, exp = best_of(
+            lambda: _str_apply_transforms(as_object.copy(),
+                                          HUMAN_TRANSFORMS),
+            repeat)
+        typed_time, obs = best_of(
+            lambda: apply_transforms(df.copy(), HUMAN_TRANSFORMS), repeat)
+        pdt.assert_frame_equal(obs.astype(object), exp)
+
+        print("%10d %12.3f %12.3f %7.1fx" % (n, str_time, typed_time,
+                                             str_time / typed_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bench_age_years(args.sizes, args.repeat)
+    bench_normalize_units(args.sizes, args.repeat)
+    bench_apply_transforms(args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Benchmarks for microsetta_admin.metadata_util
+
+These are not collected by the test runner. To execute:
+
+    python -m microsetta_admin.tests.bench_metadata_util
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from microsetta_admin.metadata_constants import MISSING_VALUE
+from microsetta_admin.metadata_transforms import HUMAN_TRANSFORMS
+from microsetta_admin.metadata_util import (_build_frame,
+                                            _construct_multiselect_map,
+                                            _to_columns,
+                                            _to_pandas_dataframe,
+                                            _to_pandas_series)
+from microsetta_admin.tests.synthetic import (make_sample_metadata,
+                                              make_survey_templates)
+
+
+def best_of(func, repeat):
+    """Time a function
+
+    Parameters
+    ----------
+    func : callable
+        The function to time, which takes no arguments
+    repeat : int
+        The number of times to execute func
+
+    Returns
+    -------
+    float
+        The fastest observed wall time in seconds
+    object
+        The result of the final call to func
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _series_frame(metadatas, multiselect_map):
+    # the construction previously used by _to_pandas_dataframe, which
+    # formed a pd.Series per sample and then filled multiselect columns one
+    # at a time
+    df = pd.DataFrame([_to_pandas_series(md, multiselect_map)
+                       for md in metadatas])
+    df.index.name = 'sample_name'
+    included_columns = set(df.columns)
+
+    all_multiselect_columns = {v for ms in multiselect_map.values()
+                               for v in ms.values()}
+    for column in all_multiselect_columns & included_columns:
+        df.loc[df[column].isnull(), column] = 'false'
+    for column in all_multiselect_columns - set(df.columns):
+        df[column] = 'false'
+
+    df.fillna(MISSING_VALUE, inplace=True)
+    df.replace("", MISSING_VALUE, inplace=True)
+    df.rename(columns={c: c.lower() for c in df.columns}, inplace=True)
+    return df
+
+
+def bench_frame_construction(sizes, repeat):
+    """Compare per-sample pd.Series construction against _build_frame"""
+    # a survey-scale set of multiselect questions
+    templates = make_survey_templates(n_multiselect=40, n_choices=12)
+    multiselect_map = _construct_multiselect_map(templates)
+
+    print("frame construction")
+    print("%10s %12s %12s %8s" % ('samples', 'series (s)', 'columnar (s)',
+                                  'speedup'))
+    for n in sizes:
+        metadatas = make_sample_metadata(n, templates)
+        series_time, exp = best_of(
+            lambda: _series_frame(metadatas, multiselect_map), repeat)
+        columnar_time, obs = best_of(
+            lambda: _build_frame(metadatas, multiselect_map), repeat)
+
+        pdt.assert_frame_equal(obs.astype(object), exp, check_like=True)
+
+        print("%10d %12.3f %12.3f %7.1fx" % (n, series_time, columnar_time,
+                                             series_time / columnar_time))
+
+
+def _object_frame(metadatas, multiselect_map):
+    # the construction previously used by _build_frame, which held every
+    # value as a separate str object
+    names, columns, ms_columns, ms_block = _to_columns(metadatas,
+                                                       multiselect_map)
+    index = pd.Index(names, name='sample_name')
+    df = pd.DataFrame(columns, index=index)
+    df.fillna(MISSING_VALUE, inplace=True)
+    df.replace("", MISSING_VALUE, inplace=True)
+    true_false = np.array(['false', 'true'], dtype=object)
+    multiselect = pd.DataFrame(true_false[ms_block.view(np.uint8)],
+                               index=index, columns=ms_columns)
+    df = pd.concat([df, multiselect], axis=1)
+    df.rename(columns={c: c.lower() for c in df.columns}, inplace=True)
+    return df
+
+
+def _str_apply_transforms(df, transforms):
+    # the chain previously used by apply_transforms, which serialized the
+    # output of every transform to str before the next parsed it again
+    for transform in transforms:
+        if transform.satisfies_requirements(df):
+            subset = df[[c for c in sorted(transform.inputs())
+                         if c in df.columns]]
+            result = transform.apply(subset)
+            if isinstance(result, pd.Series):
+                result = result.to_frame(transform.COLUMN_NAME)
+            for column, series in result.items():
+                df[column] = series.astype(str)
+    return df
+
+
+def _object_dataframe(metadatas, survey_templates):
+    # the pulldown frame as previously constructed and transformed
+    multiselect_map = _construct_multiselect_map(survey_templates)
+    return _str_apply_transforms(_object_frame(metadatas, multiselect_map),
+                                 HUMAN_TRANSFORMS)
+
+
+def frame_nbytes(df):
+    """The memory held by a frame
+
+    Unlike df.memory_usage(deep=True), an object referenced from many
+    positions (e.g., a category, or a str shared by an object column) is
+    counted once.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The frame to measure
+
+    Returns
+    -------
+    int
+        The bytes held by the arrays of the frame, and the objects they
+        reference
+    """
+    total = 0
+    objects = {}
+    for _, column in df.items():
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            total += column.cat.codes.nbytes
+            values = column.cat.categories.to_numpy()
+        else:
+            values = column.to_numpy()
+            total += values.nbytes
+
+        if values.dtype == object:
+            objects.update((id(v), v) for v in values)
+
+    return total + sum(sys.getsizeof(v) for v in objects.values())
+
+
+def _decode_and_build(build, payloads, survey_templates):
+    # as with responses from the private API, every sample holds its own
+    # str objects
+    metadatas = [json.loads(payload) for payload in payloads]
+    return build(metadatas, survey_templates)
+
+
+def bench_frame_memory(sizes):
+    """Compare the memory of str object and categorical frames"""
+    templates = make_survey_templates(n_multiselect=40, n_choices=12)
+
+    print("frame memory")
+    print("%10s %14s %14s %8s" % ('samples', 'object (MB)', 'encoded (MB)',
+                                  'ratio'))
+    for n in sizes:
+        payloads = [json.dumps(md)
+                    for md in make_sample_metadata(n, templates)]
+
+        exp = _decode_and_build(_object_dataframe, payloads, templates)
+        legacy = frame_nbytes(exp)
+        del exp
+        gc.collect()
+
+        obs = _decode_and_build(_to_pandas_dataframe, payloads, templates)
+        encoded = frame_nbytes(obs)
+        del obs
+        gc.collect()
+
+        print("%10d %14.1f %14.1f %7.1fx" % (n, legacy / 2 ** 20,
+                                             encoded / 2 ** 20,
+                                             legacy / encoded))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bench_frame_construction(args.sizes, args.repeat)
+    bench_frame_memory(args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+"""A local stand-in for the private API
+
+The stand-in serves synthetic samples, survey templates, projects, scans
+and account summaries in the structures the admin server expects, with
+configurable latency, error rate and payload size. It allows the admin
+server to be load tested end-to-end on a single machine.
+
+To serve on the port the admin server is configured for by default:
+
+    python -m microsetta_admin.tests.fake_api --port 8082 --latency 0.05
+"""
+import argparse
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from flask import Flask, abort, jsonify, request
+from werkzeug.serving import make_server
+
+from microsetta_admin.tests.synthetic import (make_sample_metadata,
+                                              make_survey_templates)
+
+SOURCE_TYPES = {'human': 0.9, 'animal': 0.06, 'environmental': 0.04}
+
+SAMPLE_STATUSES = ['sample-is-valid', 'no-associated-source',
+                   'no-collection-info', 'received-unknown-validity']
+
+# barcodes with this prefix are reported as not found
+MISSING_PREFIX = 'missing'
+
+
+class FakeAPIConfig:
+    """The behaviour of the stand-in private API
+
+    Parameters
+    ----------
+    latency : float, optional
+        The mean number of seconds to delay each response
+    jitter : float, optional
+        The maximum number of seconds, drawn uniformly, to add to or remove
+        from latency
+    error_rate : float, optional
+        The fraction of requests answered with a 503
+    payload_size : int, optional
+        The number of single-choice questions in the primary survey, which
+        governs the size of sample metadata and survey templates
+    n_projects : int, optional
+        The number of projects to serve
+    seed : int, optional
+        The random seed governing latency and errors
+    """
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 payload_size=50, n_projects=20, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.payload_size = payload_size
+        self.n_projects = n_projects
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Determine the delay and outcome of a request
+
+        Returns
+        -------
+        float
+            The number of seconds to delay the response
+        bool
+            Whether the request should fail
+        """
+        with self._lock:
+            delay = self.latency + self._rng.uniform(-self.jitter,
+                                                     self.jitter)
+            failed = self._rng.random() < self.error_rate
+        return max(delay, 0.0), failed
+
+
+def build_fake_api(config=None):
+    """Construct the stand-in private API
+
+    Parameters
+    ----------
+    config : FakeAPIConfig, optional
+        The behaviour of the API. If not specified, responses are immediate
+        and never fail.
+
+    Returns
+    -------
+    flask.Flask
+        The WSGI application
+    """
+    config = FakeAPIConfig() if config is None else config
+    templates = make_survey_templates(n_questions=config.payload_size,
+                                      n_multiselect=40, n_choices=12,
+                                      n_free_text=8, n_secondary=10)
+    projects = [_project(i) for i in range(1, config.n_projects + 1)]
+
+    # scans recorded through the API, keyed by barcode
+    scans = {}
+    scans_lock = threading.Lock()
+
+    app = Flask(__name__)
+    app.config['FAKE_API'] = config
+
+    @app.before_request
+    def simulate():
+        delay, failed = config.draw()
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return jsonify(message="Injected failure"), 503
+        if not request.headers.get('Authorization', '').startswith('Bearer'):
+            return jsonify(message="Missing token"), 401
+
+    @app.route('/api/admin/metadata/samples/<barcode>/surveys/')
+    def sample_surveys(barcode):
+        return jsonify(_sample_metadata(barcode, templates))
+
+    @app.route('/api/accounts/<account_id>/sources/<source_id>/'
+               'survey_templates/<int:template_id>')
+    def survey_template(account_id, source_id, template_id):
+        if template_id not in templates:
+            abort(404)
+        return jsonify(templates[template_id])
+
+    @app.route('/api/admin/projects', methods=['GET'])
+    def get_projects():
+        is_active = request.args.get('is_active')
+        found = projects
+        if is_active is not None:
+            active = is_active.lower() == 'true'
+            found = [p for p in projects if p['is_active'] == active]
+        return jsonify(found)
+
+    @app.route('/api/admin/projects', methods=['POST'])
+    def create_project():
+        return jsonify(project_id=len(projects) + 1), 201
+
+    @app.route('/api/admin/projects/<int:project_id>', methods=['PUT'])
+    def update_project(project_id):
+        return jsonify(project_id=project_id), 200
+
+    @app.route('/api/admin/search/samples/<barcode>')
+    def search_sample(barcode):
+        with scans_lock:
+            recorded = list(scans.get(barcode, []))
+        return jsonify(_sample_info(barcode, recorded))
+
+    @app.route('/api/admin/scan/observations/<barcode>')
+    def scan_observations(barcode):
+        _check_barcode(barcode)
+        return jsonify([{'observation_id': i, 'category': 'tube',
+                         'observation': 'Observation %d' % i}
+                        for i in range(1, 6)])
+
+    @app.route('/api/admin/scan/<barcode>', methods=['POST'])
+    def scan(barcode):
+        _check_barcode(barcode)
+        body = request.get_json()
+        scan = {'barcode_scan_id': '%s-%d' % (barcode, time.time_ns()),
+                'barcode': barcode,
+                'scan_timestamp': datetime.now().isoformat(),
+                'sample_status': body['sample_status'],
+                'technician_notes': body['technician_notes']}
+        with scans_lock:
+            scans.setdefault(barcode, []).append(scan)
+        return jsonify(scan['barcode_scan_id']), 201
+
+    @app.route('/api/admin/events/accounts/<account_id>')
+    def account_events(account_id):
+        return jsonify([{'event_type': 'email',
+                         'event_subtype': 'sample_is_valid',
+                         'event_state': {'email': '%s@example.com' %
+                                                  account_id},
+                         'creation_time': '2021-01-0%dT09:30:00' % i}
+                        for i in range(1, 4)])
+
+    @app.route('/api/admin/email', methods=['POST'])
+    def email():
+        return jsonify(''), 200
+
+    @app.route('/api/admin/account_barcode_summary', methods=['POST'])
+    def account_barcode_summary():
+        body = request.get_json()
+        if 'project_id' in body:
+            barcodes = ['%09d' % i for i in range(100 * config.payload_size)]
+        else:
+            barcodes = body.get('sample_barcodes', [])
+        return jsonify({'partial_result': False, 'unprocessed_barcodes': [],
+                        'samples': [_summary(bc) for bc in barcodes]})
+
+    @app.route('/api/admin/account_email_summary', methods=['POST'])
+    def account_email_summary():
+        body = request.get_json()
+        return jsonify([{'email': email, 'project': body.get('project'),
+                         'account_id': 'account-%s' % email,
+                         'sample_count': 2}
+                        for email in body.get('emails', [])])
+
+    @app.route('/api/admin/search/<resource>/<query>')
+    def search(resource, query):
+        if resource not in ('kit', 'account'):
+            abort(404)
+        return jsonify({resource: {'id': query}, 'samples': [],
+                        'kits': []})
+
+    return app
+
+
+def _check_barcode(barcode):
+    if barcode.startswith(MISSING_PREFIX):
+        abort(404)
+
+
+def _seed(barcode):
+    # each barcode is described consistently regardless of request order
+    return zlib.crc32(barcode.encode('utf-8'))
+
+
+def _sample_metadata(barcode, templates):
+    _check_barcode(barcode)
+    metadata, = make_sample_metadata(1, templates, seed=_seed(barcode),
+                                     source_types=SOURCE_TYPES,
+                                     duplicate_fraction=0.02)
+    metadata['sample_barcode'] = barcode
+    return metadata
+
+
+def _sample_info(barcode, scans):
+    _check_barcode(barcode)
+    rng = random.Random(_seed(barcode))
+    account_id = 'account%d' % rng.randint(0, 10000)
+    collected = datetime(2021, 1, 1) + timedelta(days=rng.randint(0, 365))
+    return {
+        'barcode_info': {'barcode': barcode, 'status': None},
+        'projects_info': [{'project': 'American Gut Project',
+                           'is_microsetta': True}],
+        'scans_info': scans,
+        'latest_scan': scans[-1] if scans else None,
+        'sample': {'site': 'Stool',
+                   'datetime_collected': collected.isoformat()},
+        'source': {'name': 'source of %s' % barcode,
+                   'source_type': 'human',
+                   'source_data': {'description': None}},
+        'account': {'id': account_id, 'email': '%s@example.com' % account_id,
+                    'first_name': 'First', 'last_name': 'Last'}}
+
+
+def _summary(barcode):
+    rng = random.Random(_seed(barcode))
+    return {'sampleid': barcode, 'project': 'American Gut Project',
+            'account-email': 'account%d@example.com' % rng.randint(0, 10000),
+            'source-type': 'human', 'site-sampled': 'Stool',
+            'sample-date': '2021-01-01', 'sample-time': '09:30:00',
+            'sample-status': rng.choice(SAMPLE_STATUSES),
+            'sample-received': True, 'ffq-taken': False,
+            'ffq-complete': False, 'kit-id': 'kit%d' % rng.randint(0, 10000)}
+
+
+def _project(project_id):
+    return {'project_id': project_id, 'project_name': 'Project %d' %
+                                                      project_id,
+            'is_microsetta': project_id % 2 == 0, 'bank_samples': False,
+            'plating_start_date': None, 'is_active': project_id % 5 != 0,
+            'subproject_name': None, 'alias': None, 'sponsor': None,
+            'coordination': None, 'contact_name': 'Jane Doe',
+            'contact_email': 'jd@example.com',
+            'computed_stats': {'num_samples': 100 * project_id,
+                               'num_fully_returned_kits': 10 * project_id}}
+
+
+class FakeAPIServer:
+    """Serve the stand-in private API from a background thread
+
+    Parameters
+    ----------
+    config : FakeAPIConfig, optional
+        The behaviour of the API
+    host : str, optional
+        The interface to bind
+    port : int, optional
+        The port to bind. If zero, an available port is chosen.
+    """
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self._server = make_server(host, port, build_fake_api(config),
+                                   threaded=True)
+        self._thread = None
+
+    @property
+    def url(self):
+        """The base URL of the API"""
+        return 'http://%s:%d' % (self._server.host, self._server.port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def add_config_arguments(parser):
+    """Add the options of FakeAPIConfig to an argument parser"""
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Mean seconds to delay each response")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="Maximum seconds to vary the latency by")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Fraction of requests answered with a 503")
+    parser.add_argument('--payload-size', type=int, default=50,
+                        help="Number of questions in the primary survey")
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_arguments(args):
+    """Construct a FakeAPIConfig from parsed arguments"""
+    return FakeAPIConfig(latency=args.latency, jitter=args.jitter,
+                         error_rate=args.error_rate,
+                         payload_size=args.payload_size, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    with FakeAPIServer(config_from_arguments(args), args.host,
+                       args.port) as server:
+        print("Serving the stand-in private API at %s" % server.url)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
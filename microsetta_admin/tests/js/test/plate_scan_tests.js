@@ -0,0 +1,103 @@
+const plate_scan = require("../../../static/js/plate_scan");
+
+//A send function whose requests are resolved by the test
+function controlledSend(){
+  var calls = [];
+  var send = function(update){
+    return new Promise(function(resolve){
+      calls.push({update: update, resolve: resolve});
+    });
+  };
+  return {send: send, calls: calls};
+}
+
+//Allow promise callbacks to run
+function settle(){
+  return new Promise(function(resolve){ setTimeout(resolve, 0); });
+}
+
+QUnit.module('PlateScan', function() {
+  QUnit.test('Test Well Navigation', function(assert){
+    assert.equal(plate_scan.nextWellIndex(96, 0, 1), 1);
+    assert.equal(plate_scan.nextWellIndex(96, 95, 1), 0);
+    assert.equal(plate_scan.nextWellIndex(96, 0, -1), 95);
+
+    var wells = [{barcode: "000000001"}, {barcode: "000000002"}];
+    assert.equal(plate_scan.findWell(wells, " 000000002\n"), 1);
+    assert.equal(plate_scan.findWell(wells, "000000003"), -1);
+  });
+
+  QUnit.test('Test Bounded In Flight', async function(assert){
+    var ctl = controlledSend();
+    var queue = new plate_scan.UpdateQueue(ctl.send, 2);
+
+    queue.enqueue("A1", 1);
+    queue.enqueue("A2", 2);
+    queue.enqueue("A3", 3);
+    assert.equal(ctl.calls.length, 2, "Only two outstanding");
+    assert.equal(queue.state("A3"), "queued");
+
+    ctl.calls[0].resolve({ok: true});
+    await settle();
+    assert.equal(queue.state("A1"), "saved");
+    assert.equal(ctl.calls.length, 3, "Next update sent once one finishes");
+    assert.equal(ctl.calls[2].update, 3);
+
+    ctl.calls[1].resolve({ok: true});
+    ctl.calls[2].resolve({ok: true});
+    await settle();
+    assert.ok(queue.isIdle());
+  });
+
+  QUnit.test('Test Failure And Retry', async function(assert){
+    var ctl = controlledSend();
+    var changes = [];
+    var queue = new plate_scan.UpdateQueue(ctl.send, 4, function(key, state, error){
+      changes.push([key, state, error]);
+    });
+
+    queue.enqueue("B1", "update");
+    ctl.calls[0].resolve({ok: false, error: "Barcode not found"});
+    await settle();
+    assert.equal(queue.state("B1"), "failed");
+    assert.deepEqual(changes[changes.length - 1], ["B1", "failed", "Barcode not found"]);
+
+    queue.retry("B1");
+    assert.equal(ctl.calls.length, 2);
+    assert.equal(ctl.calls[1].update, "update");
+    ctl.calls[1].resolve({ok: true});
+    await settle();
+    assert.equal(queue.state("B1"), "saved");
+  });
+
+  QUnit.test('Test Rejected Send', async function(assert){
+    var queue = new plate_scan.UpdateQueue(function(){
+      return Promise.reject(new Error("network down"));
+    }, 1);
+
+    queue.enqueue("C1", "update");
+    await settle();
+    assert.equal(queue.state("C1"), "failed");
+    assert.equal(queue.errors["C1"], "Error: network down");
+  });
+
+  QUnit.test('Test Updates Of A Well Are Ordered', async function(assert){
+    var ctl = controlledSend();
+    var queue = new plate_scan.UpdateQueue(ctl.send, 4);
+
+    queue.enqueue("D1", "first");
+    queue.enqueue("D1", "second");
+    queue.enqueue("D1", "third");
+    assert.equal(ctl.calls.length, 1, "A well has one update outstanding");
+
+    ctl.calls[0].resolve({ok: true});
+    await settle();
+    assert.equal(queue.state("D1"), "saving");
+    assert.equal(ctl.calls.length, 2);
+    assert.equal(ctl.calls[1].update, "third", "Only the latest is sent");
+
+    ctl.calls[1].resolve({ok: true});
+    await settle();
+    assert.equal(queue.state("D1"), "saved");
+  });
+});
@@ -0,0 +1,228 @@
+"""Load test the admin server against the stand-in private API
+
+These are not collected by the test runner. By default the admin server and
+the stand-in private API are both served from this process:
+
+    python -m microsetta_admin.tests.load_test --scenario scan \\
+        --concurrency 8 --requests 500 --latency 0.05
+
+To instead load an admin server run separately, such as under gunicorn with
+its private_api_url directed at microsetta_admin.tests.fake_api, provide
+its URL and the value of a logged in session cookie:
+
+    python -m microsetta_admin.tests.load_test \\
+        --admin-url http://localhost:5000 --cookie <session>
+"""
+import argparse
+import io
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+import numpy as np
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from werkzeug.serving import make_server
+
+from microsetta_admin.tests.fake_api import (FakeAPIServer,
+                                             add_config_arguments,
+                                             config_from_arguments)
+
+SESSION_COOKIE = 'session-microsetta-admin'
+PERCENTILES = (50, 90, 99)
+
+
+def _scan(http, url, rng, args):
+    return http.get(url + '/scan', params={
+        'sample_barcode': '%09d' % rng.randrange(args.barcodes)})
+
+
+def _scan_update(http, url, rng, args):
+    return http.post(url + '/scan', data={
+        'sample_barcode': '%09d' % rng.randrange(args.barcodes),
+        'technician_notes': 'load test',
+        'sample_status': 'sample-is-valid',
+        'action': 'update'})
+
+
+def _pulldown(http, url, rng, args):
+    barcodes = rng.sample(range(args.barcodes), args.pulldown_size)
+    upload = 'sample_name\n' + ''.join('%09d\n' % bc for bc in barcodes)
+    return http.post(url + '/metadata_pulldown',
+                     files={'file': ('samples.csv', io.BytesIO(
+                         upload.encode('utf-8')))})
+
+
+def _projects(http, url, rng, args):
+    return http.get(url + '/manage_projects')
+
+
+SCENARIOS = {'scan': _scan, 'scan_update': _scan_update,
+             'pulldown': _pulldown, 'projects': _projects}
+
+
+class InProcessAdmin:
+    """Serve the admin server from this process against the stand-in API
+
+    The admin server is given a freshly generated signing key, so that the
+    driver can log in with a token of its own.
+
+    Parameters
+    ----------
+    api_url : str
+        The base URL of the stand-in private API
+    """
+    def __init__(self, api_url):
+        from microsetta_admin import server
+        from microsetta_admin._api import APIRequest
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.token = jwt.encode({'email': 'load-test@example.com'}, key,
+                                algorithm='RS256')
+
+        server.PUB_KEY = key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo)
+        APIRequest.API_URL = api_url
+
+        self._server = make_server('127.0.0.1', 0, server.app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def url(self):
+        """The base URL of the admin server"""
+        return 'http://127.0.0.1:%d' % self._server.port
+
+    def login(self):
+        """Obtain the session cookie of a logged in user"""
+        http = requests.Session()
+        http.get(self.url + '/authrocket_callback',
+                 params={'token': self.token}, allow_redirects=False)
+        return http.cookies[SESSION_COOKIE]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._thread.join()
+        return False
+
+
+def run_load(url, cookie, scenario, concurrency, n_requests, args, seed=0):
+    """Issue requests against the admin server concurrently
+
+    Parameters
+    ----------
+    url : str
+        The base URL of the admin server
+    cookie : str
+        The value of a logged in session cookie
+    scenario : callable
+        Issues a single request, given a requests.Session, the URL, a random
+        number generator and args
+    concurrency : int
+        The number of requests to have outstanding at a time
+    n_requests : int
+        The total number of requests to issue
+    args : argparse.Namespace
+        Options of the scenario
+    seed : int, optional
+        The random seed to use
+
+    Returns
+    -------
+    np.ndarray
+        The latency of each request in seconds
+    Counter
+        The number of responses observed of each status code
+    float
+        The wall time of the run in seconds
+    """
+    local = threading.local()
+    rngs_lock = threading.Lock()
+    rng = random.Random(seed)
+
+    def issue(_):
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+            local.http.cookies.set(SESSION_COOKIE, cookie)
+            with rngs_lock:
+                local.rng = random.Random(rng.random())
+
+        start = time.perf_counter()
+        try:
+            response = scenario(local.http, url, local.rng, args)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(issue, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in outcomes])
+    statuses = Counter(status for _, status in outcomes)
+    return latencies, statuses, elapsed
+
+
+def report(latencies, statuses, elapsed):
+    """Print the throughput, latency distribution and outcomes of a run"""
+    print("requests:   %d in %.2fs" % (len(latencies), elapsed))
+    print("throughput: %.1f req/s" % (len(latencies) / elapsed))
+    print("latency:    mean %.1fms, %s, max %.1fms" % (
+        latencies.mean() * 1000,
+        ', '.join('p%d %.1fms' % (p, np.percentile(latencies, p) * 1000)
+                  for p in PERCENTILES),
+        latencies.max() * 1000))
+    print("statuses:   %s" % ', '.join('%s: %d' % (status, count)
+                                       for status, count in
+                                       sorted(statuses.items(), key=str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS),
+                        default='scan')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--barcodes', type=int, default=10000,
+                        help="Number of distinct barcodes to draw from")
+    parser.add_argument('--pulldown-size', type=int, default=100,
+                        help="Number of barcodes per metadata pulldown")
+    parser.add_argument('--admin-url',
+                        help="An admin server to load, in place of one "
+                             "served from this process")
+    parser.add_argument('--cookie',
+                        help="A logged in session cookie of --admin-url")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    scenario = SCENARIOS[args.scenario]
+    if args.admin_url:
+        if not args.cookie:
+            parser.error("--cookie is required with --admin-url")
+        result = run_load(args.admin_url, args.cookie, scenario,
+                          args.concurrency, args.requests, args)
+    else:
+        # the request log of either server would obscure the report
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        with FakeAPIServer(config_from_arguments(args)) as api, \
+                InProcessAdmin(api.url) as admin:
+            result = run_load(admin.url, admin.login(), scenario,
+                              args.concurrency, args.requests, args)
+
+    report(*result)
+
+
+if __name__ == '__main__':
+    main()
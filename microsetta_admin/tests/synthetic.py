@@ -0,0 +1,204 @@
+"""Synthetic private API payloads for exercising the metadata pipeline
+
+The structures produced mirror those returned by the private API for
+/api/admin/metadata/samples/<barcode>/surveys/ and
+/api/accounts/<id>/sources/<id>/survey_templates/<id>.
+"""
+import random
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+
+ALCOHOL_FREQUENCIES = ['Rarely (a few times/month)',
+                       'Occasionally (1-2 times/week)',
+                       'Regularly (3-5 times/week)', 'Daily', 'Never',
+                       'Unspecified']
+
+FREQUENCIES = ['Never', 'Rarely (a few times/month)',
+               'Occasionally (1-2 times/week)', 'Regularly (3-5 times/week)',
+               'Daily', 'Unspecified']
+
+# free text questions, several of which are not shared publicly
+FREE_TEXT = ['ABOUT_YOURSELF_TEXT', 'HUMANS_FREE_TEXT', 'PM_NAME',
+             'PM_EMAIL', 'MEDICATION_LIST', 'TRAVEL_LOCATIONS_LIST',
+             'pets_other_freetext', 'FAVORITE_FOOD']
+
+WORDS = ['apple', 'banana', 'coffee', 'daily', 'every', 'garden', 'hiking',
+         'morning', 'ocean', 'running', 'tea', 'vitamin', 'weekend']
+
+HUMAN_SITES = ['Stool', 'Saliva', 'Forehead', 'Nares', 'Left hand']
+ANIMAL_SITES = ['Stool', 'Mouth', 'Fur']
+ENVIRONMENTS = ['Soil', 'Kitchen counter', 'Sea water', 'Door handle']
+
+HUMAN_TEMPLATE_ID = 1
+
+# a second survey answered by each human source, so that the responses of
+# more than one template are merged. It must not be one of
+# metadata_util.TEMPLATES_TO_IGNORE, as those are never fetched.
+SECONDARY_TEMPLATE_ID = 4
+
+
+def make_survey_templates(n_questions=50, n_multiselect=10, n_choices=8,
+                          n_free_text=0, n_secondary=0):
+    """Construct survey templates
+
+    Parameters
+    ----------
+    n_questions : int, optional
+        The number of generic single-choice questions
+    n_multiselect : int, optional
+        The number of multiselect questions
+    n_choices : int, optional
+        The number of choices for each multiselect question
+    n_free_text : int, optional
+        The number of free text questions, drawn first from FREE_TEXT
+    n_secondary : int, optional
+        The number of single-choice questions of a secondary template. If
+        zero, no secondary template is constructed.
+
+    Returns
+    -------
+    dict
+        The survey templates keyed by template ID
+    """
+    fields = [_field('1', 'BIRTH_YEAR', False, []),
+              _field('2', 'BIRTH_MONTH', False, MONTHS),
+              _field('3', 'HEIGHT_CM', False, []),
+              _field('4', 'HEIGHT_UNITS', False, ['inches', 'centimeters']),
+              _field('5', 'WEIGHT_KG', False, []),
+              _field('6', 'WEIGHT_UNITS', False, ['pounds', 'kilograms']),
+              _field('7', 'ALCOHOL_FREQUENCY', False, ALCOHOL_FREQUENCIES)]
+
+    for i in range(n_questions):
+        fields.append(_field(str(100 + i), 'QUESTION_%d' % i, False,
+                             FREQUENCIES))
+
+    for i in range(n_multiselect):
+        choices = ['choice %d-%d' % (i, j) for j in range(n_choices)]
+        fields.append(_field(str(500 + i), 'MULTI_%d' % i, True, choices))
+
+    for i in range(n_free_text):
+        shortname = FREE_TEXT[i] if i < len(FREE_TEXT) else 'FREE_TEXT_%d' % i
+        fields.append(_field(str(900 + i), shortname, False, []))
+
+    templates = {HUMAN_TEMPLATE_ID: _template(HUMAN_TEMPLATE_ID, fields)}
+    if n_secondary:
+        fields = [_field(str(2000 + i), 'SECONDARY_%d' % i, False,
+                         FREQUENCIES)
+                  for i in range(n_secondary)]
+        templates[SECONDARY_TEMPLATE_ID] = _template(SECONDARY_TEMPLATE_ID,
+                                                     fields)
+    return templates
+
+
+def make_sample_metadata(n_samples, survey_templates, seed=0,
+                         source_types=None, duplicate_fraction=0.0):
+    """Construct per-sample metadata as obtained from the private API
+
+    Parameters
+    ----------
+    n_samples : int
+        The number of samples to construct
+    survey_templates : dict
+        The survey templates, as returned by make_survey_templates, which
+        samples will respond to
+    seed : int, optional
+        The random seed to use
+    source_types : dict, optional
+        The relative frequency of each of 'human', 'animal' and
+        'environmental' sources. Only human sources respond to surveys. If
+        not specified, every source is human.
+    duplicate_fraction : float, optional
+        The fraction of human samples which hold a second, differing,
+        response to one of their surveys
+
+    Returns
+    -------
+    list of dict
+        The sample metadata
+    """
+    rng = random.Random(seed)
+    if source_types is not None:
+        kinds = list(source_types)
+        weights = [source_types[k] for k in kinds]
+
+    samples = []
+    for i in range(n_samples):
+        if source_types is None:
+            source_type = 'human'
+        else:
+            source_type = rng.choices(kinds, weights)[0]
+
+        sample = {'sample_projects': ['American Gut Project']}
+        answers = []
+        if source_type == 'human':
+            sample['site'] = 'Stool' if source_types is None else \
+                rng.choice(HUMAN_SITES)
+            for template_id, template in survey_templates.items():
+                answers.append(_response(rng, template_id, template))
+
+            if duplicate_fraction and rng.random() < duplicate_fraction:
+                template_id = rng.choice(list(survey_templates))
+                answers.append(_response(rng, template_id,
+                                         survey_templates[template_id]))
+        elif source_type == 'animal':
+            sample['site'] = rng.choice(ANIMAL_SITES)
+        else:
+            sample['site'] = None
+            # some environmental sources lack collection information
+            if rng.random() < 0.9:
+                sample['source'] = {'description': rng.choice(ENVIRONMENTS)}
+
+        sample['datetime_collected'] = '20%02d-%02d-15T09:30:00' % (
+            rng.randint(15, 22), rng.randint(1, 12))
+
+        samples.append({
+            'sample_barcode': '%09d' % i,
+            'host_subject_id': 'hsi%d' % (i // 2),
+            'account': {'id': 'account%d' % (i // 4)},
+            'source': {'id': 'source%d' % (i // 2),
+                       'source_type': source_type},
+            'sample': sample,
+            'survey_answers': answers})
+
+    return samples
+
+
+def _template(template_id, fields):
+    return {'survey_template_id': template_id,
+            'survey_template_text': {'groups': [{'fields': fields}]}}
+
+
+def _response(rng, template_id, template):
+    response = {}
+    for field in _fields(template):
+        response[field['id']] = [field['shortname'], _answer(rng, field)]
+    return {'template': template_id, 'response': response}
+
+
+def _field(qid, shortname, multi, values):
+    return {'id': qid, 'shortname': shortname, 'multi': multi,
+            'values': values}
+
+
+def _fields(template):
+    for group in template['survey_template_text']['groups']:
+        for field in group['fields']:
+            yield field
+
+
+def _answer(rng, field):
+    shortname = field['shortname']
+    if field['multi']:
+        return rng.sample(field['values'], rng.randint(0, 3))
+    elif shortname == 'BIRTH_YEAR':
+        return str(rng.randint(1930, 2015))
+    elif shortname == 'HEIGHT_CM':
+        return str(rng.randint(50, 200))
+    elif shortname == 'WEIGHT_KG':
+        return str(rng.randint(10, 150))
+    elif not field['values']:
+        # free text comes down from the private API as ["foo"]
+        return '["%s"]' % ' '.join(rng.sample(WORDS, rng.randint(1, 6)))
+    else:
+        return rng.choice(field['values'])
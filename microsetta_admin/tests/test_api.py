@@ -0,0 +1,122 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from microsetta_admin._api import (APIRequest, AsyncAPIRequest,
+                                   PooledHTTPAdapter, api_token)
+from microsetta_admin.tests.base import TestBase
+
+
+def _response(status_code, output):
+    response = MagicMock(status_code=status_code, text=str(output))
+    response.json.return_value = output
+    return response
+
+
+class APIRequestTests(TestBase):
+    def test_get_session_reused(self):
+        first = APIRequest.get_session()
+        second = APIRequest.get_session()
+        self.assertIs(first, second)
+
+    def test_get_session_rebuilt_after_fork(self):
+        first = APIRequest.get_session()
+        with patch('microsetta_admin._api.os.getpid',
+                   return_value=APIRequest._session_pid + 1):
+            second = APIRequest.get_session()
+        self.assertIsNot(first, second)
+
+    def test_get_session_pooled(self):
+        api_session = APIRequest._build_session()
+        for prefix in ('http://', 'https://'):
+            adapter = api_session.get_adapter(prefix + 'localhost')
+            self.assertIsInstance(adapter, PooledHTTPAdapter)
+            self.assertEqual(adapter._pool_maxsize, APIRequest.POOL_MAXSIZE)
+            self.assertEqual(adapter._pool_connections,
+                             APIRequest.POOL_CONNECTIONS)
+
+    def test_get_uses_session(self):
+        self.mock_get.return_value.status_code = 200
+        self.mock_get.return_value.text = '{"a": 1}'
+        self.mock_get.return_value.json = lambda: {'a': 1}
+
+        status, output = APIRequest.get('/foo', params={'bar': 'baz'})
+        self.assertEqual(status, 200)
+        self.assertEqual(output, {'a': 1})
+
+        _, kwargs = self.mock_get.call_args
+        self.assertEqual(kwargs['params'], {'language_tag': 'en-US',
+                                            'bar': 'baz'})
+
+
+class AsyncAPIRequestTests(TestBase):
+    def test_gather(self):
+        self.mock_get.side_effect = lambda url, **kwargs: _response(
+            200, {'url': url})
+
+        results = AsyncAPIRequest.gather(
+            AsyncAPIRequest.get('/foo', params={'bar': 'baz'}),
+            AsyncAPIRequest.get('/bar'))
+
+        # results are in the order requested
+        self.assertEqual(results,
+                         [(200, {'url': APIRequest.API_URL + '/foo'}),
+                          (200, {'url': APIRequest.API_URL + '/bar'})])
+
+        params = [call[1]['params'] for call in self.mock_get.call_args_list]
+        self.assertIn({'language_tag': 'en-US', 'bar': 'baz'}, params)
+        self.assertIn({'language_tag': 'en-US'}, params)
+        for call in self.mock_get.call_args_list:
+            self.assertEqual(call[1]['auth'].token, '42')
+
+    def test_post(self):
+        self.mock_post.return_value = _response(201, 'created')
+
+        (status, output), = AsyncAPIRequest.gather(
+            AsyncAPIRequest.post('/foo', json={'a': 1}))
+        self.assertEqual(status, 201)
+        self.assertEqual(output, 'created')
+        self.assertEqual(self.mock_post.call_args[1]['json'], {'a': 1})
+
+    def test_error(self):
+        self.mock_put.return_value = _response(500, 'broken')
+
+        (status, output), = AsyncAPIRequest.gather(
+            AsyncAPIRequest.put('/foo', json={'a': 1}))
+        self.assertEqual(status, 500)
+        self.assertEqual(output, 'broken')
+
+    def test_token_obtained_when_created(self):
+        self.mock_get.return_value = _response(200, {})
+
+        with api_token('abc'):
+            request = AsyncAPIRequest.get('/foo')
+        AsyncAPIRequest.gather(request)
+
+        self.assertEqual(self.mock_get.call_args[1]['auth'].token, 'abc')
+
+    def test_concurrency_bounded(self):
+        lock = threading.Lock()
+        active = [0]
+        observed = []
+
+        def get(url, **kwargs):
+            with lock:
+                active[0] += 1
+                observed.append(active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return _response(200, {})
+
+        self.mock_get.side_effect = get
+        with patch.object(AsyncAPIRequest, 'MAX_CONCURRENCY', 2):
+            results = AsyncAPIRequest.gather(
+                *[AsyncAPIRequest.get('/foo') for _ in range(6)])
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(max(observed), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
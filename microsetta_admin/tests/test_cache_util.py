@@ -0,0 +1,67 @@
+import unittest
+from microsetta_admin.cache_util import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('a', 'default'), 'default')
+        self.assertTrue(self.cache.set('a', 1))
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+
+    def test_expiry(self):
+        self.cache.set('a', 1)
+        self.timer.now = 9.9
+        self.assertEqual(self.cache.get('a'), 1)
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+
+        # touch "a" so that "b" is the least recently used
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_invalidate(self):
+        self.cache.set(('x', 1), 1)
+        self.cache.set(('y', 1), 2)
+        self.cache.invalidate(lambda key: key[0] == 'x')
+        self.assertIsNone(self.cache.get(('x', 1)))
+        self.assertEqual(self.cache.get(('y', 1)), 2)
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_set_stale_version(self):
+        version = self.cache.version
+        self.cache.invalidate()
+        self.assertFalse(self.cache.set('a', 1, version=version))
+        self.assertIsNone(self.cache.get('a'))
+
+        self.assertTrue(self.cache.set('a', 1, version=self.cache.version))
+        self.assertEqual(self.cache.get('a'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from microsetta_admin._api import APIRequest, api_token
+from microsetta_admin.metadata_util import (SURVEY_TEMPLATE_CACHE,
+                                            retrieve_metadata)
+from microsetta_admin.tests.fake_api import (FakeAPIConfig, FakeAPIServer,
+                                             build_fake_api)
+
+
+class FakeAPITests(TestCase):
+    def setUp(self):
+        SURVEY_TEMPLATE_CACHE.clear()
+
+    def test_retrieve_metadata(self):
+        # the admin server's own client is able to consume the stand-in
+        with FakeAPIServer() as server, \
+                patch.object(APIRequest, 'API_URL', server.url), \
+                api_token('42'):
+            df, errors = retrieve_metadata(['000000001', 'missing1',
+                                            '000000002'])
+
+        self.assertEqual(list(df.index), ['000000001', '000000002'])
+        self.assertIn('host_subject_id', df.columns)
+        self.assertEqual(errors, [{'barcode': 'missing1',
+                                   'error': "404 from api"}])
+
+    def test_consistent_samples(self):
+        client = build_fake_api().test_client()
+        headers = {'Authorization': 'Bearer 42'}
+        url = '/api/admin/metadata/samples/000000001/surveys/'
+
+        first = client.get(url, headers=headers).get_json()
+        second = client.get(url, headers=headers).get_json()
+        self.assertEqual(first, second)
+        self.assertEqual(first['sample_barcode'], '000000001')
+
+    def test_requires_token(self):
+        client = build_fake_api().test_client()
+        response = client.get('/api/admin/projects')
+        self.assertEqual(response.status_code, 401)
+
+    def test_error_rate(self):
+        client = build_fake_api(FakeAPIConfig(error_rate=1.0)).test_client()
+        response = client.get('/api/admin/projects',
+                              headers={'Authorization': 'Bearer 42'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_latency(self):
+        config = FakeAPIConfig(latency=0.5, jitter=0.1, seed=0)
+        delays = [config.draw()[0] for _ in range(100)]
+        self.assertTrue(all(0.4 <= d <= 0.6 for d in delays))
+        self.assertFalse(any(config.draw()[1] for _ in range(100)))
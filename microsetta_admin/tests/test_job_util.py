@@ -0,0 +1,131 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from microsetta_admin.job_util import (Job, JobRunner, COMPLETE, FAILED,
+                                       QUEUED, RUNNING)
+
+
+class JobTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.runner = JobRunner(root=self.tmp.name, max_workers=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_submit_complete(self):
+        def func(job, value, other=None):
+            with open(job.result_path, 'w') as fp:
+                fp.write('%s %s' % (value, other))
+
+        job = self.runner.submit(func, 'foo', other='bar')
+        self.runner.wait(job.job_id, timeout=5)
+
+        status = self.runner.get(job.job_id).status()
+        self.assertEqual(status['state'], COMPLETE)
+        with open(job.result_path) as fp:
+            self.assertEqual(fp.read(), 'foo bar')
+
+    def test_submit_owner(self):
+        job = self.runner.submit(lambda job: None, owner='jd@example.com')
+        self.runner.wait(job.job_id, timeout=5)
+
+        self.assertEqual(job.status()['owner'], 'jd@example.com')
+        self.assertEqual(os.stat(job.path).st_mode & 0o777, 0o700)
+
+        status = job.public_status()
+        self.assertEqual(status['state'], COMPLETE)
+        for field in ('host', 'pid', 'owner'):
+            self.assertNotIn(field, status)
+
+    def test_submit_creates_root(self):
+        root = os.path.join(self.tmp.name, 'jobs')
+        runner = JobRunner(root=root, max_workers=1)
+        job = runner.submit(lambda job: None)
+        runner.wait(job.job_id, timeout=5)
+        self.assertEqual(os.stat(root).st_mode & 0o777, 0o700)
+
+    def test_submit_raises(self):
+        def func(job):
+            raise ValueError("bad things")
+
+        job = self.runner.submit(func)
+        self.runner.wait(job.job_id, timeout=5)
+
+        status = job.status()
+        self.assertEqual(status['state'], FAILED)
+        self.assertEqual(status['message'], 'bad things')
+
+    def test_submit_reports_failure(self):
+        def func(job):
+            job.update(state=FAILED, message='not today')
+
+        job = self.runner.submit(func)
+        self.runner.wait(job.job_id, timeout=5)
+        self.assertEqual(job.status()['message'], 'not today')
+        self.assertEqual(job.status()['state'], FAILED)
+
+    def test_increment(self):
+        job = Job(self.tmp.name, 'foo')
+        os.makedirs(job.path)
+        job.update(state=RUNNING, fetched=0)
+        job.increment(fetched=1, append={'errors': 'a'})
+        job.increment(fetched=1, failed=1, append={'errors': 'b'})
+
+        # progress is persisted by the next update, if not before
+        job.update(state=COMPLETE)
+        status = Job(self.tmp.name, 'foo').status()
+        self.assertEqual(status['fetched'], 2)
+        self.assertEqual(status['failed'], 1)
+        self.assertEqual(status['errors'], ['a', 'b'])
+
+    def test_status_orphaned(self):
+        job = Job(self.tmp.name, 'foo')
+        os.makedirs(job.path)
+        job.update(state=RUNNING, host='bar', pid=os.getpid())
+
+        with patch('microsetta_admin.job_util.socket.gethostname',
+                   return_value='bar'):
+            self.assertEqual(job.status()['state'], RUNNING)
+
+            with patch('microsetta_admin.job_util.os.kill',
+                       side_effect=ProcessLookupError):
+                self.assertEqual(job.status()['state'], FAILED)
+
+            # jobs of other hosts cannot be verified
+            job.update(host='baz')
+            with patch('microsetta_admin.job_util.os.kill',
+                       side_effect=ProcessLookupError):
+                self.assertEqual(job.status()['state'], RUNNING)
+
+    def test_get(self):
+        self.assertIsNone(self.runner.get('missing'))
+        self.assertIsNone(self.runner.get('../etc'))
+
+        job = Job(self.tmp.name, 'foo')
+        os.makedirs(job.path)
+        job.update(state=QUEUED)
+        self.assertEqual(self.runner.get('foo').job_id, 'foo')
+
+    def test_purge(self):
+        for job_id, state in [('old', COMPLETE), ('new', COMPLETE),
+                              ('active', RUNNING)]:
+            job = Job(self.tmp.name, job_id)
+            os.makedirs(job.path)
+            job.update(state=state, host='elsewhere', pid=1)
+
+        future = time.time() + self.runner.max_age + 1
+        with patch('microsetta_admin.job_util.time.time',
+                   return_value=future):
+            Job(self.tmp.name, 'new').update(state=COMPLETE)
+            self.runner.purge()
+
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['active', 'new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,13 @@
 import unittest
+import numpy as np
 import pandas as pd
 import pandas.testing as pdt
 from microsetta_admin.metadata_transforms import (
-    apply_transforms,
-    AgeYears, AgeCat, BMI, BMICat, AlcoholConsumption,
-    NormalizeHeight, NormalizeWeight)
+    apply_transforms, bin_values, encode_column, normalize_units,
+    plan_transforms, required_inputs,
+    Transformer,
+    HUMAN_TRANSFORMS, AgeYears, AgeCat, BMI, BMICat, AlcoholConsumption,
+    NormalizeUnits)
 from microsetta_admin.metadata_constants import MISSING_VALUE
 
 
@@ -32,6 +35,8 @@ class TransformTests(unittest.TestCase):
                            columns=['birth_year', 'birth_month',
                                     'collection_timestamp', 'age_years',
                                     'age_cat'])
+        # the created columns have few distinct values
+        exp = exp.astype({'age_years': 'category', 'age_cat': 'category'})
         obs = apply_transforms(df, transforms)
         pdt.assert_frame_equal(obs, exp, check_less_precise=True)
 
@@ -43,6 +48,86 @@ class TransformTests(unittest.TestCase):
     def test_apply_transforms(self):
         self._apply_transforms_helper((AgeYears, AgeCat))
 
+    def test_apply_transforms_sequential(self):
+        df = pd.DataFrame([['1990', 'July', '2020-01-01T12:00:00', '180',
+                            'centimeters', '60', 'kilograms', 'Never']],
+                          index=['a'],
+                          columns=['birth_year', 'birth_month',
+                                   'collection_timestamp', 'height_cm',
+                                   'height_units', 'weight_kg',
+                                   'weight_units', 'alcohol_frequency'])
+        exp = apply_transforms(df.copy(), HUMAN_TRANSFORMS, max_workers=1)
+        obs = apply_transforms(df.copy(), reversed(HUMAN_TRANSFORMS))
+        self.assertEqual(list(exp.columns[-5:]),
+                         ['age_years', 'age_cat', 'bmi', 'bmi_cat',
+                          'alcohol_consumption'])
+        pdt.assert_frame_equal(obs, exp.loc[:, obs.columns])
+
+    def test_apply_transforms_requested(self):
+        df = pd.DataFrame([['1990', 'July', '2020-01-01T12:00:00']],
+                          index=['a'],
+                          columns=['birth_year', 'birth_month',
+                                   'collection_timestamp'])
+        obs = apply_transforms(df, (AgeYears, AgeCat), requested=['age_years'])
+        self.assertEqual(list(obs.columns),
+                         ['birth_year', 'birth_month',
+                          'collection_timestamp', 'age_years'])
+
+    def test_plan_transforms(self):
+        columns = ['birth_year', 'birth_month', 'collection_timestamp',
+                   'height_cm', 'height_units', 'weight_kg', 'weight_units',
+                   'alcohol_frequency']
+        obs = plan_transforms(HUMAN_TRANSFORMS, columns)
+        exp = [[AgeYears, NormalizeUnits, AlcoholConsumption],
+               [AgeCat, BMI],
+               [BMICat]]
+        self.assertEqual(obs, exp)
+
+    def test_plan_transforms_unsatisfied(self):
+        # BMI can run on the height and weight present, although they cannot
+        # be normalized without units
+        columns = ['height_cm', 'weight_kg', 'birth_year']
+        obs = plan_transforms(HUMAN_TRANSFORMS, columns)
+        self.assertEqual(obs, [[BMI], [BMICat]])
+
+    def test_plan_transforms_requested(self):
+        columns = ['birth_year', 'birth_month', 'collection_timestamp',
+                   'height_cm', 'height_units', 'weight_kg', 'weight_units',
+                   'alcohol_frequency']
+        obs = plan_transforms(HUMAN_TRANSFORMS, columns, requested=['bmi'])
+        self.assertEqual(obs, [[NormalizeUnits], [BMI]])
+
+        obs = plan_transforms(HUMAN_TRANSFORMS, columns, requested=[])
+        self.assertEqual(obs, [])
+
+    def test_required_inputs(self):
+        self.assertEqual(required_inputs(HUMAN_TRANSFORMS, ['bmi_cat']),
+                         {'bmi', 'height_cm', 'height_units', 'weight_kg',
+                          'weight_units'})
+        self.assertEqual(required_inputs(HUMAN_TRANSFORMS, ['age_years']),
+                         {'birth_year', 'birth_month',
+                          'collection_timestamp'})
+        self.assertEqual(required_inputs(HUMAN_TRANSFORMS, ['foo']), set())
+
+    def test_plan_transforms_invalid(self):
+        class Foo(Transformer):
+            REQUIRED_COLUMNS = frozenset(['bar'])
+            COLUMN_NAME = 'foo'
+
+        class Bar(Transformer):
+            REQUIRED_COLUMNS = frozenset(['foo'])
+            COLUMN_NAME = 'bar'
+
+        class OtherBar(Transformer):
+            REQUIRED_COLUMNS = frozenset(['baz'])
+            COLUMN_NAME = 'bar'
+
+        with self.assertRaisesRegex(ValueError, "cyclic"):
+            plan_transforms((Foo, Bar), ['foo', 'bar'])
+
+        with self.assertRaisesRegex(ValueError, "Multiple"):
+            plan_transforms((Bar, OtherBar), ['foo', 'baz'])
+
     def _test_transformer(self, transformer, df, exp):
         obs = transformer.apply(df)
         pdt.assert_series_equal(obs, exp)
@@ -60,6 +145,21 @@ class TransformTests(unittest.TestCase):
                         MISSING_VALUE], index=list('abcd'), name='age_years')
         self._test_transformer(AgeYears, df, exp)
 
+    def test_AgeYears_birth_month_year(self):
+        # parsing is consistent with a "%B-%Y" format
+        months = pd.Series(['July', 'july', 'Jul', 'September', 'May',
+                            MISSING_VALUE, None, 'October'],
+                           index=list('abcdefgh'))
+        years = pd.Series(['1990', '1990', '1990', '90', '1990.0', '1990',
+                           '1990', '1500'],
+                          index=list('abcdefgh'))
+        exp = pd.Series([pd.Timestamp('1990-07-01'),
+                         pd.Timestamp('1990-07-01'),
+                         pd.NaT, pd.NaT, pd.NaT, pd.NaT, pd.NaT, pd.NaT],
+                        index=list('abcdefgh'))
+        obs = AgeYears.birth_month_year(months, years)
+        pdt.assert_series_equal(obs, exp)
+
     def test_AgeCat(self):
         df = pd.DataFrame([[-2],
                            [0],
@@ -85,10 +185,14 @@ class TransformTests(unittest.TestCase):
                            [MISSING_VALUE]],
                           columns=['age_years'],
                           index=list('abcdefghijklmnopqrstuv'))
-        exp = pd.Series([MISSING_VALUE, 'baby', 'baby', 'child', 'child',
-                         'teen', 'teen', '20s', '20s', '30s', '30s', '40s',
-                         '40s', '50s', '50s', '60s', '60s', '70+', '70+',
-                         MISSING_VALUE, MISSING_VALUE, MISSING_VALUE],
+        categories = ['baby', 'child', 'teen', '20s', '30s', '40s', '50s',
+                      '60s', '70+', MISSING_VALUE]
+        exp = pd.Series(pd.Categorical(
+                            [MISSING_VALUE, 'baby', 'baby', 'child', 'child',
+                             'teen', 'teen', '20s', '20s', '30s', '30s', '40s',
+                             '40s', '50s', '50s', '60s', '60s', '70+', '70+',
+                             MISSING_VALUE, MISSING_VALUE, MISSING_VALUE],
+                            categories=categories),
                         index=list('abcdefghijklmnopqrstuv'),
                         name='age_cat')
         self._test_transformer(AgeCat, df, exp)
@@ -122,36 +226,169 @@ class TransformTests(unittest.TestCase):
                            [MISSING_VALUE]],
                           index=list('abcdefghijklm'),
                           columns=['bmi'])
-        exp = pd.Series([MISSING_VALUE, MISSING_VALUE, 'Underweight',
-                         'Underweight', 'Normal',
-                         'Normal', 'Overweight', 'Overweight', 'Obese',
-                         'Obese', MISSING_VALUE, MISSING_VALUE, MISSING_VALUE],
+        categories = ['Underweight', 'Normal', 'Overweight', 'Obese',
+                      MISSING_VALUE]
+        exp = pd.Series(pd.Categorical(
+                            [MISSING_VALUE, MISSING_VALUE, 'Underweight',
+                             'Underweight', 'Normal',
+                             'Normal', 'Overweight', 'Overweight', 'Obese',
+                             'Obese', MISSING_VALUE, MISSING_VALUE,
+                             MISSING_VALUE],
+                            categories=categories),
                         index=list('abcdefghijklm'), name='bmi_cat')
         self._test_transformer(BMICat, df, exp)
 
-    def test_NormalizeWeight(self):
-        df = pd.DataFrame([[180, 'pounds'],
-                           [180, 'kilograms'],
-                           [-1, 'pounds'],
-                           [None, 'pounds'],
-                           [180, None]], index=list('abcde'),
-                          columns=['weight_kg', 'weight_units'])
-        exp = pd.Series([180 / 2.20462, 180, MISSING_VALUE, MISSING_VALUE,
-                        MISSING_VALUE],
-                        index=list('abcde'), name='weight_kg')
-        self._test_transformer(NormalizeWeight, df, exp)
-
-    def test_NormalizeHeight(self):
+    def test_BMICat_applied(self):
+        df = pd.DataFrame([['180', '60'],
+                           ['170', '90']],
+                          index=list('ab'),
+                          columns=['height_cm', 'weight_kg'])
+        obs = apply_transforms(df, (BMI, BMICat))
+        self.assertEqual(list(obs['bmi_cat']), ['Normal', 'Obese'])
+
+    def test_apply_transforms_typed_chain(self):
+        df = pd.DataFrame([['70', 'inches', '150', 'pounds'],
+                           ['180', 'centimeters', '-1', 'pounds'],
+                           [MISSING_VALUE, 'inches', '60', 'kilograms']],
+                          index=list('abc'),
+                          columns=['height_cm', 'height_units', 'weight_kg',
+                                   'weight_units'])
+        exp = pd.DataFrame([['177.8', 'centimeters', str(150 / 2.20462),
+                             'kilograms', '21.5', 'Normal'],
+                            ['180.0', 'centimeters', MISSING_VALUE,
+                             'pounds', MISSING_VALUE, MISSING_VALUE],
+                            [MISSING_VALUE, 'inches', '60.0', 'kilograms',
+                             MISSING_VALUE, MISSING_VALUE]],
+                           index=list('abc'),
+                           columns=['height_cm', 'height_units', 'weight_kg',
+                                    'weight_units', 'bmi', 'bmi_cat'])
+        obs = apply_transforms(df, (NormalizeUnits, BMI, BMICat))
+        pdt.assert_frame_equal(obs, exp)
+
+    def test_encode_column(self):
+        values = np.array(['a', None, '', 'a', MISSING_VALUE, 'a'],
+                          dtype=object)
+        obs = encode_column(values, index=list('uvwxyz'), name='foo')
+        exp = pd.Series(pd.Categorical(['a', MISSING_VALUE, MISSING_VALUE,
+                                        'a', MISSING_VALUE, 'a'],
+                                       categories=['a', MISSING_VALUE]),
+                        index=list('uvwxyz'), name='foo')
+        pdt.assert_series_equal(obs, exp)
+
+    def test_encode_column_high_cardinality(self):
+        values = pd.Series([1.5, np.nan, 2.0, 1.5])
+        obs = encode_column(values, max_fraction=0.5)
+        pdt.assert_series_equal(obs, pd.Series(['1.5', MISSING_VALUE, '2.0',
+                                                '1.5'], dtype=object))
+
+        # each distinct value is a single object
+        self.assertIs(obs[0], obs[3])
+
+    def test_encode_column_signed_zero(self):
+        values = pd.Series([-0.0, 0.0, np.nan, -0.0])
+        obs = encode_column(values, max_fraction=1)
+        self.assertEqual(list(obs), ['-0.0', '0.0', MISSING_VALUE, '-0.0'])
+
+    def test_encode_column_categorical(self):
+        values = pd.Series(pd.Categorical(['x', 'y', None, 'x', 'x', 'y']))
+        obs = encode_column(values)
+        self.assertEqual(list(obs.cat.categories), ['x', 'y', MISSING_VALUE])
+        self.assertEqual(list(obs), ['x', 'y', MISSING_VALUE, 'x', 'x', 'y'])
+
+    def test_apply_transforms_categorical_units(self):
+        df = pd.DataFrame({'height_cm': ['70', '180', MISSING_VALUE, '160'],
+                           'height_units': pd.Categorical(
+                               ['inches', 'centimeters', 'inches',
+                                'inches'])}, index=list('abcd'))
+        obs = apply_transforms(df, (NormalizeUnits, ))
+        self.assertEqual(list(obs['height_units']),
+                         ['centimeters', 'centimeters', 'inches',
+                          'centimeters'])
+        self.assertEqual(list(obs['height_cm']),
+                         ['177.8', '180.0', MISSING_VALUE, '406.4'])
+
+    def test_bin_values(self):
+        # gaps between bins are permitted
+        bounds = [('low', 0, 1), ('mid', 1, 2), ('high', 5, 10)]
+        values = pd.Series([-1, 0, 0.5, 1, 2, 4.9, 5, 9.9, 10, None],
+                           index=list('abcdefghij'))
+        exp = pd.Series(pd.Categorical([None, 'low', 'low', 'mid', None,
+                                        None, 'high', 'high', None, None],
+                                       categories=['low', 'mid', 'high',
+                                                   MISSING_VALUE]),
+                        index=list('abcdefghij'), name='foo')
+        obs = bin_values(values, bounds, 'foo')
+        pdt.assert_series_equal(obs, exp)
+
+    def test_bin_values_invalid_bounds(self):
+        values = pd.Series([1, 2])
+        with self.assertRaisesRegex(ValueError, "overlap"):
+            bin_values(values, [('a', 0, 2), ('b', 1, 3)])
+
+        with self.assertRaisesRegex(ValueError, "ordered"):
+            bin_values(values, [('a', 1, 2), ('b', 0, 1)])
+
+        with self.assertRaisesRegex(ValueError, "ordered"):
+            bin_values(values, [('a', 2, 1)])
+
+    def test_NormalizeUnits(self):
+        df = pd.DataFrame([[180, 'inches', 180, 'pounds'],
+                           [180, 'centimeters', 180, 'kilograms'],
+                           [-1, 'inches', -1, 'pounds'],
+                           [None, 'inches', None, 'pounds'],
+                           [180, None, 180, None]], index=list('abcde'),
+                          columns=['height_cm', 'height_units', 'weight_kg',
+                                   'weight_units'])
+        exp = pd.DataFrame([[180 * 2.54, 'centimeters', 180 / 2.20462,
+                             'kilograms'],
+                            [180, 'centimeters', 180, 'kilograms'],
+                            [MISSING_VALUE, 'inches', MISSING_VALUE,
+                             'pounds'],
+                            [MISSING_VALUE, 'inches', MISSING_VALUE,
+                             'pounds'],
+                            [MISSING_VALUE, MISSING_VALUE, MISSING_VALUE,
+                             MISSING_VALUE]], index=list('abcde'),
+                           columns=['height_cm', 'height_units', 'weight_kg',
+                                    'weight_units'])
+        obs = NormalizeUnits.apply(df)
+        pdt.assert_frame_equal(obs, exp)
+
+    def test_NormalizeUnits_partial(self):
+        # only the measurements present are normalized
         df = pd.DataFrame([[180, 'inches'],
-                           [180, 'centimeters'],
-                           [-1, 'inches'],
-                           [None, 'inches'],
-                           [180, None]], index=list('abcde'),
+                           [180, 'centimeters']], index=list('ab'),
                           columns=['height_cm', 'height_units'])
-        exp = pd.Series([180 * 2.54, 180, MISSING_VALUE, MISSING_VALUE,
-                        MISSING_VALUE],
-                        index=list('abcde'), name='height_cm')
-        self._test_transformer(NormalizeHeight, df, exp)
+        self.assertTrue(NormalizeUnits.satisfies_requirements(df))
+        self.assertFalse(NormalizeUnits.satisfies_requirements(
+            df[['height_cm']]))
+        self.assertEqual(NormalizeUnits.produces(df.columns),
+                         frozenset(['height_cm', 'height_units']))
+
+        exp = pd.DataFrame([[180 * 2.54, 'centimeters'],
+                            [180, 'centimeters']], index=list('ab'),
+                           columns=['height_cm', 'height_units'])
+        obs = NormalizeUnits.apply(df)
+        pdt.assert_frame_equal(obs, exp, check_dtype=False)
+
+    def test_normalize_units(self):
+        df = pd.DataFrame([[70, 'inches', 150, 'pounds'],
+                           [180, 'centimeters', -1, 'pounds'],
+                           ['foo', 'inches', 60, None],
+                           [None, 'inches', 60, 'kilograms']],
+                          index=list('abcd'),
+                          columns=['height_cm', 'height_units', 'weight_kg',
+                                   'weight_units'])
+        exp = pd.DataFrame([[70 * 2.54, 150 / 2.20462],
+                            [180, None],
+                            [None, None],
+                            [None, 60]],
+                           index=list('abcd'),
+                           columns=['height_cm', 'weight_kg'], dtype=float)
+        obs = normalize_units(df, [('height_cm', 'height_units', 'inches',
+                                    2.54),
+                                   ('weight_kg', 'weight_units', 'pounds',
+                                    1 / 2.20462)])
+        pdt.assert_frame_equal(obs, exp)
 
     def test_AlcoholConsumption(self):
         df = pd.DataFrame([['Rarely (a few times/month)'],
@@ -1,19 +1,37 @@
+import io
+import os
 import unittest
 import json
+import tempfile
+from unittest.mock import patch
 import pandas as pd
 import pandas.testing as pdt
 from microsetta_admin.tests.base import TestBase
 from microsetta_admin.metadata_constants import (HUMAN_SITE_INVARIANTS,
                                                  MISSING_VALUE)
+from microsetta_admin.tests.test_routes import DummyResponse, HAS_PYARROW
+from microsetta_admin.profile_util import Profile, profiling
+from microsetta_admin.store_util import Checkpoint
 from microsetta_admin.metadata_util import (_build_col_name,
                                             _find_duplicates,
+                                            _map_concurrently,
                                             _fetch_barcode_metadata,
                                             _to_pandas_series,
+                                            _to_columns,
                                             _to_pandas_dataframe,
                                             _fetch_survey_template,
                                             _fetch_observed_survey_templates,
                                             _construct_multiselect_map,
-                                            drop_private_columns)
+                                            categorize,
+                                            check_output_format,
+                                            drop_private_columns,
+                                            is_private_column,
+                                            get_metadata_cache,
+                                            invalidate_survey_templates,
+                                            iter_output,
+                                            iter_tsv,
+                                            retrieve_metadata,
+                                            SURVEY_TEMPLATE_CACHE)
 
 
 class MetadataUtilTests(TestBase):
@@ -126,6 +144,171 @@ class MetadataUtilTests(TestBase):
         self.assertEqual(obs, exp)
         self.assertEqual(errors, None)
 
+    def test_map_concurrently(self):
+        items = list(range(50))
+        exp = [i * 2 for i in items]
+        obs = _map_concurrently(lambda i: i * 2, items, max_workers=4)
+        self.assertEqual(obs, exp)
+
+        obs = _map_concurrently(lambda i: i * 2, items, max_workers=1)
+        self.assertEqual(obs, exp)
+
+    def test_retrieve_metadata(self):
+        raw_samples = {'000004216': self.raw_sample_1,
+                       'XY0004216': self.raw_sample_2}
+        templates = {'1': self.fake_survey_template2,
+                     '10': self.fake_survey_template1}
+
+        def fake_get(url, **kwargs):
+            if '/survey_templates/' in url:
+                template_id = url.rsplit('/', 1)[1].split('?')[0]
+                return DummyResponse(200, templates[template_id])
+
+            barcode = url.rstrip('/').split('/')[-2]
+            if barcode in raw_samples:
+                return DummyResponse(200, raw_samples[barcode])
+            return DummyResponse(404, {})
+
+        self.mock_get.side_effect = fake_get
+
+        barcodes = ['XY0004216', 'missing2', '000004216', 'missing1',
+                    'XY0004216']
+        profile = Profile('test')
+        with profiling(profile):
+            obs_df, obs_errors = retrieve_metadata(barcodes, max_workers=3)
+
+        self.assertEqual(list(obs_df.index), ['XY0004216', '000004216'])
+        self.assertEqual(obs_errors,
+                         [{'barcode': ['XY0004216'],
+                           'error': "Duplicated barcodes in input"},
+                          {'barcode': 'missing2', 'error': "404 from api"},
+                          {'barcode': 'missing1', 'error': "404 from api"}])
+
+        # requests made from worker threads are attributed to their stage
+        stages = profile.to_dict()['stages']
+        self.assertEqual(list(stages), ['fetch_barcodes', 'fetch_templates',
+                                        'build_frame', 'transforms'])
+        self.assertEqual(stages['fetch_barcodes']['calls'], 4)
+        self.assertEqual(stages['fetch_barcodes']['errors'], 2)
+        self.assertEqual(stages['fetch_barcodes']['bytes'],
+                         2 * len(json.dumps({})) +
+                         len(json.dumps(self.raw_sample_1)) +
+                         len(json.dumps(self.raw_sample_2)))
+        self.assertEqual(stages['fetch_templates']['calls'], 2)
+        self.assertEqual(stages['transforms']['calls'], 0)
+
+    def test_retrieve_metadata_checkpoint(self):
+        raw_samples = {'000004216': self.raw_sample_1}
+        templates = {'1': self.fake_survey_template2,
+                     '10': self.fake_survey_template1}
+        requested = []
+
+        def fake_get(url, **kwargs):
+            if '/survey_templates/' in url:
+                template_id = url.rsplit('/', 1)[1].split('?')[0]
+                return DummyResponse(200, templates[template_id])
+
+            barcode = url.rstrip('/').split('/')[-2]
+            requested.append(barcode)
+            if barcode in raw_samples:
+                return DummyResponse(200, raw_samples[barcode])
+            return DummyResponse(503, {})
+
+        self.mock_get.side_effect = fake_get
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        barcodes = ['000004216', 'XY0004216']
+        checkpoint = Checkpoint.create(barcodes, root=tmp.name)
+        obs_df, obs_errors = retrieve_metadata(barcodes,
+                                               checkpoint=checkpoint)
+        self.assertEqual(sorted(requested), ['000004216', 'XY0004216'])
+        self.assertEqual(obs_errors,
+                         [{'barcode': 'XY0004216', 'error': "503 from api"}])
+        checkpoint.close()
+
+        # the retry only requests what failed, and notes as much on the
+        # checkpoint
+        requested.clear()
+        checkpoint = Checkpoint.load(checkpoint.checkpoint_id, root=tmp.name)
+        self.assertEqual(checkpoint.sample_barcodes, barcodes)
+        obs_df, obs_errors = retrieve_metadata(checkpoint.sample_barcodes,
+                                               checkpoint=checkpoint)
+        self.assertEqual(requested, ['XY0004216'])
+        self.assertEqual(obs_errors,
+                         [{'barcode': 'XY0004216', 'error': "503 from api"}])
+        self.assertEqual(checkpoint.restored, ['000004216'])
+        self.assertEqual(checkpoint.retried, ['XY0004216'])
+
+        # and once successful, all metadata is present
+        requested.clear()
+        raw_samples['XY0004216'] = self.raw_sample_2
+        obs_df, obs_errors = retrieve_metadata(checkpoint.sample_barcodes,
+                                               checkpoint=checkpoint)
+        self.assertEqual(requested, ['XY0004216'])
+        self.assertEqual(obs_errors, [])
+        self.assertEqual(list(obs_df.index), ['000004216', 'XY0004216'])
+        checkpoint.discard()
+
+    def test_retrieve_metadata_cached(self):
+        raw_samples = {'000004216': self.raw_sample_1,
+                       'XY0004216': self.raw_sample_2}
+        templates = {'1': self.fake_survey_template2,
+                     '10': self.fake_survey_template1}
+
+        def fake_get(url, **kwargs):
+            if '/survey_templates/' in url:
+                template_id = url.rsplit('/', 1)[1].split('?')[0]
+                return DummyResponse(200, templates[template_id])
+
+            barcode = url.rstrip('/').split('/')[-2]
+            if barcode in raw_samples:
+                return DummyResponse(200, raw_samples[barcode])
+            return DummyResponse(404, {})
+
+        self.mock_get.side_effect = fake_get
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, 'cache.sqlite')
+        for patcher in (patch('microsetta_admin.metadata_util.'
+                              'METADATA_CACHE_PATH', path),
+                        patch('microsetta_admin.metadata_util.'
+                              '_metadata_cache', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_metadata_cache().close())
+
+        barcodes = ['000004216', 'XY0004216']
+        exp_df, exp_errors = retrieve_metadata(barcodes)
+        self.assertEqual(exp_errors, [])
+        self.assertEqual(self.mock_get.call_count, 4)
+
+        # an unchanged cohort requires no requests
+        self.mock_get.reset_mock()
+        obs_df, obs_errors = retrieve_metadata(barcodes)
+        self.assertEqual(self.mock_get.call_count, 0)
+        self.assertEqual(obs_errors, [])
+        pdt.assert_frame_equal(obs_df, exp_df)
+
+        # unless a refresh is requested
+        obs_df, obs_errors = retrieve_metadata(barcodes, refresh=True)
+        self.assertEqual(self.mock_get.call_count, 2)
+        pdt.assert_frame_equal(obs_df, exp_df)
+
+        # or the cached metadata is too old
+        self.mock_get.reset_mock()
+        with patch('microsetta_admin.metadata_util.METADATA_CACHE_MAX_AGE',
+                   -1):
+            retrieve_metadata(barcodes)
+        self.assertEqual(self.mock_get.call_count, 2)
+
+        # and failures are not cached
+        self.mock_get.reset_mock()
+        retrieve_metadata(['missing'])
+        retrieve_metadata(['missing'])
+        self.assertEqual(self.mock_get.call_count, 2)
+
     def test_fetch_survey_template(self):
         res = {'a': 'dict', 'of': 'stuff'}
         self.mock_get.return_value.status_code = 200
@@ -141,6 +324,60 @@ class MetadataUtilTests(TestBase):
         self.assertEqual(survey, res)
         self.assertEqual(errors, None)
 
+    def test_fetch_survey_template_cached(self):
+        res = {'a': 'dict', 'of': 'stuff'}
+        self.mock_get.return_value.status_code = 200
+        self.mock_get.return_value.json = lambda: res
+        self.mock_get.return_value.text = json.dumps(res)
+
+        ids = {'account_id': 'foo', 'source_id': 'bar'}
+        first, _ = _fetch_survey_template(1, ids.copy())
+        second, errors = _fetch_survey_template(1, ids.copy())
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.assertIs(first, second)
+        self.assertEqual(errors, None)
+
+        # a different language is a different template
+        _fetch_survey_template(1, ids.copy(), language_tag='es-MX')
+        self.assertEqual(self.mock_get.call_count, 2)
+
+        invalidate_survey_templates(1)
+        _fetch_survey_template(1, ids.copy())
+        self.assertEqual(self.mock_get.call_count, 3)
+
+    def test_fetch_survey_template_error_not_cached(self):
+        self.mock_get.return_value.status_code = 404
+        self.mock_get.return_value.text = ''
+
+        ids = {'account_id': 'foo', 'source_id': 'bar'}
+        _, errors = _fetch_survey_template(1, ids.copy())
+        self.assertEqual(errors['error'], '404 from api')
+        self.assertEqual(len(SURVEY_TEMPLATE_CACHE), 0)
+
+    def test_fetch_survey_template_ids_unmodified(self):
+        self.mock_get.return_value.status_code = 404
+        self.mock_get.return_value.text = ''
+
+        ids = {'account_id': 'foo', 'source_id': 'bar'}
+        _, errors = _fetch_survey_template(1, ids, language_tag='es-MX')
+        self.assertEqual(ids, {'account_id': 'foo', 'source_id': 'bar'})
+        self.assertEqual(errors['ids'], {'account_id': 'foo',
+                                         'source_id': 'bar',
+                                         'template_id': 1})
+        self.assertIn('language_tag=es-MX', self.mock_get.call_args[0][0])
+
+    def test_construct_multiselect_map_memoized(self):
+        self.mock_get.return_value.status_code = 200
+        self.mock_get.return_value.json = lambda: self.fake_survey_template2
+        self.mock_get.return_value.text = 'not empty'
+
+        template, _ = _fetch_survey_template(2, {'account_id': 'foo',
+                                                 'source_id': 'bar'})
+        first = _construct_multiselect_map({2: template})
+        second = _construct_multiselect_map({2: template})
+        self.assertEqual(first, second)
+        self.assertIs(first[(2, '9')], second[(2, '9')])
+
     def test_drop_private_columns(self):
         df = pd.DataFrame([[1, 2, 3], [4, 5, 6]],
                           columns=['pM_foo', 'okay', 'ABOUT_yourSELF_TEXT'])
@@ -148,6 +385,81 @@ class MetadataUtilTests(TestBase):
         obs = drop_private_columns(df)
         pdt.assert_frame_equal(obs, exp)
 
+    def test_is_private_column(self):
+        self.assertTrue(is_private_column('pM_foo'))
+        self.assertTrue(is_private_column('birth_month'))
+        self.assertFalse(is_private_column('birth_year'))
+
+    def test_iter_tsv(self):
+        df = pd.DataFrame([['a', 'b'], ['c', 'd'], ['e', 'f']],
+                          columns=['foo', 'bar'],
+                          index=pd.Index(['x', 'y', 'z'], name='sample_name'))
+        exp = df.to_csv(sep='\t', index=True, header=True).encode('utf-8')
+
+        chunks = list(iter_tsv(df, chunksize=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0], b'sample_name\tfoo\tbar\n')
+        self.assertEqual(b''.join(chunks), exp)
+
+    def test_iter_tsv_empty(self):
+        df = pd.DataFrame([], columns=['foo'],
+                          index=pd.Index([], name='sample_name'))
+        self.assertEqual(list(iter_tsv(df)), [b'sample_name\tfoo\n'])
+
+    def test_iter_output_tsv(self):
+        df = pd.DataFrame([['a'], ['b']], columns=['foo'],
+                          index=pd.Index(['x', 'y'], name='sample_name'))
+        self.assertEqual(b''.join(iter_output(df, 'tsv')),
+                         b'sample_name\tfoo\nx\ta\ny\tb\n')
+
+    def _output_frame(self):
+        return pd.DataFrame({'host_subject_id': ['a', 'b', 'c', 'd'],
+                             'sample_type': ['Stool', 'Stool', 'Saliva',
+                                             'Stool']},
+                            index=pd.Index(['w', 'x', 'y', 'z'],
+                                           name='sample_name'))
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed")
+    def test_iter_output_parquet(self):
+        df = self._output_frame()
+        obs = pd.read_parquet(io.BytesIO(b''.join(iter_output(df,
+                                                              'parquet'))))
+        self.assertEqual(obs['sample_type'].dtype.name, 'category')
+        self.assertEqual(obs['host_subject_id'].dtype, object)
+        pdt.assert_frame_equal(obs.astype(str), df)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed")
+    def test_iter_output_arrow(self):
+        df = self._output_frame()
+        obs = pd.read_feather(io.BytesIO(b''.join(iter_output(df,
+                                                              'arrow'))))
+        self.assertEqual(obs['sample_type'].dtype.name, 'category')
+        pdt.assert_frame_equal(obs.astype(str), df)
+
+    def test_check_output_format(self):
+        check_output_format('tsv')
+        with self.assertRaisesRegex(ValueError, 'Unknown output format'):
+            check_output_format('xlsx')
+        with self.assertRaisesRegex(ValueError, 'Unknown output format'):
+            iter_output(pd.DataFrame(), 'xlsx')
+
+    @unittest.skipIf(HAS_PYARROW, "pyarrow is installed")
+    def test_check_output_format_without_pyarrow(self):
+        with self.assertRaisesRegex(ValueError, 'requires pyarrow'):
+            check_output_format('parquet')
+
+    def test_categorize(self):
+        df = self._output_frame()
+        df['count'] = [1, 1, 1, 1]
+        obs = categorize(df)
+        self.assertEqual(obs['sample_type'].dtype.name, 'category')
+        self.assertEqual(obs['host_subject_id'].dtype, object)
+        self.assertEqual(obs['count'].dtype, df['count'].dtype)
+        pdt.assert_frame_equal(obs.astype({'sample_type': object}), df)
+
+        obs = categorize(df, max_fraction=1)
+        self.assertEqual(obs['host_subject_id'].dtype.name, 'category')
+
     def test_build_col_name(self):
         tests_and_expected = [('foo', 'bar', 'foo_bar'),
                               ('foo', 'bar baz', 'foo_bar_baz')]
@@ -225,9 +537,91 @@ class MetadataUtilTests(TestBase):
         for k, v in HUMAN_SITE_INVARIANTS['Stool'].items():
             exp[k] = v
 
+        # multiselect columns are categorical, as are those with a single
+        # distinct value over the two samples
+        multiselect = ['allergic_to_blahblah', 'allergic_to_stuff',
+                       'allergic_to_baz', 'allergic_to_x']
+        for column in exp.columns:
+            if column in multiselect:
+                exp[column] = pd.Categorical(exp[column],
+                                             categories=['false', 'true'])
+            elif exp[column].nunique() == 1:
+                exp[column] = exp[column].astype('category')
+
         obs = _to_pandas_dataframe(data, templates)
         pdt.assert_frame_equal(obs, exp, check_like=True)
 
+    def test_to_columns(self):
+        no_collection_info = {'sample_barcode': 'X00000001',
+                              'host_subject_id': 'baz',
+                              'account': {'id': 'foo'},
+                              'source': {'id': 'bar',
+                                         'source_type': 'environmental'},
+                              'sample': {'datetime_collected': None},
+                              'survey_answers': []}
+        data = [self.raw_sample_1, no_collection_info, self.raw_sample_2]
+        ms_map = _construct_multiselect_map({1: self.fake_survey_template2})
+
+        names, columns, ms_columns, ms_block = _to_columns(data, ms_map)
+        self.assertEqual(names, ['000004216', 'X00000001', 'XY0004216'])
+
+        # columns are ordered by first observation
+        self.assertEqual(list(columns)[:3], ['HOST_SUBJECT_ID',
+                                             'COLLECTION_TIMESTAMP',
+                                             'DIET_TYPE'])
+        self.assertEqual(list(columns['HOST_SUBJECT_ID']),
+                         ['foo', None, 'bar'])
+        self.assertEqual(list(columns['SAMPLE2SPECIFIC']),
+                         [None, None, 'foobar'])
+        self.assertEqual(list(columns['abc']), ['okay', None, None])
+
+        # multiselect responses are tracked in their own block, which
+        # includes choices no sample selected
+        self.assertNotIn('ALLERGIC_TO_baz', columns)
+        self.assertEqual(ms_columns, ['ALLERGIC_TO_x', 'ALLERGIC_TO_baz',
+                                      'ALLERGIC_TO_stuff',
+                                      'ALLERGIC_TO_blahblah'])
+        self.assertEqual(ms_block.tolist(),
+                         [[False, False, True, True],
+                          [False, False, False, False],
+                          [False, True, True, False]])
+
+    def test_to_columns_allowlist(self):
+        data = [self.raw_sample_1, self.raw_sample_2]
+        ms_map = _construct_multiselect_map({1: self.fake_survey_template2})
+
+        names, columns, ms_columns, ms_block = _to_columns(
+            data, ms_map, ['host_subject_id', 'ABC', 'allergic_to_stuff',
+                           'missing'])
+        self.assertEqual(names, ['000004216', 'XY0004216'])
+        self.assertEqual(list(columns), ['HOST_SUBJECT_ID', 'abc'])
+        self.assertEqual(ms_columns, ['ALLERGIC_TO_stuff'])
+        self.assertEqual(ms_block.tolist(), [[True], [True]])
+
+    def test_to_pandas_dataframe_columns(self):
+        data = [self.raw_sample_1, self.raw_sample_2]
+        templates = {1: self.fake_survey_template2}
+
+        obs = _to_pandas_dataframe(data, templates,
+                                   ['diet_type', 'ALLERGIC_TO_baz',
+                                    'pm_email', 'missing'])
+        self.assertEqual(sorted(obs.columns),
+                         ['allergic_to_baz', 'diet_type'])
+        self.assertEqual(list(obs['diet_type']), [MISSING_VALUE, 'Vegan'])
+        self.assertEqual(list(obs['allergic_to_baz']), ['false', 'true'])
+
+    def test_to_pandas_dataframe_columns_private_inputs(self):
+        # birth_month is private, but is needed to derive age_years
+        sample = self.raw_sample_1
+        sample['survey_answers'][0]['response'].update(
+            {'10': ['BIRTH_MONTH', 'July'], '11': ['BIRTH_YEAR', '1990']})
+        templates = {1: self.fake_survey_template2}
+
+        obs = _to_pandas_dataframe([sample], templates,
+                                   ['age_years', 'birth_month'])
+        self.assertEqual(list(obs.columns), ['age_years'])
+        self.assertEqual(list(obs['age_years']), ['23.3'])
+
     def test_to_pandas_series(self):
         data = self.raw_sample_1
 
@@ -0,0 +1,89 @@
+import json
+import threading
+import unittest
+
+from microsetta_admin.profile_util import (Profile, is_profiling, profiling,
+                                           record, stage)
+from microsetta_admin.tests.test_cache_util import FakeTimer
+
+
+class ProfileTests(unittest.TestCase):
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.profile = Profile('test', timer=self.timer)
+
+    def test_stage(self):
+        with self.profile.stage('fetch'):
+            self.timer.now += 1.5
+        with self.profile.stage('fetch'):
+            self.timer.now += 0.5
+        with self.profile.stage('build'):
+            self.timer.now += 2
+
+        obs = self.profile.to_dict()
+        self.assertEqual(obs['name'], 'test')
+        self.assertEqual(obs['seconds'], 4)
+        self.assertEqual(obs['stages'],
+                         {'fetch': {'seconds': 2, 'calls': 0, 'bytes': 0,
+                                    'errors': 0},
+                          'build': {'seconds': 2, 'calls': 0, 'bytes': 0,
+                                    'errors': 0}})
+
+    def test_stage_raises(self):
+        with self.assertRaises(ValueError):
+            with self.profile.stage('fetch'):
+                raise ValueError()
+        self.assertEqual(self.profile.to_dict()['stages']['fetch']['errors'],
+                         1)
+
+    def test_record(self):
+        # nothing is recorded outside of a profile, or outside of a stage
+        record(calls=1)
+        self.assertFalse(is_profiling())
+
+        with profiling(self.profile):
+            self.assertTrue(is_profiling())
+            record(calls=1)
+            with stage('fetch'):
+                record(calls=1, bytes=10)
+
+                # as with the metadata pulldown, a worker runs within a copy
+                # of the caller's context
+                import contextvars
+                thread = threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(record, ), kwargs={'calls': 1, 'errors': 1})
+                thread.start()
+                thread.join()
+
+        self.assertFalse(is_profiling())
+        self.assertEqual(self.profile.to_dict()['stages'],
+                         {'fetch': {'seconds': 0, 'calls': 2, 'bytes': 10,
+                                    'errors': 1}})
+
+    def test_stage_without_profile(self):
+        with stage('fetch'):
+            pass
+        self.assertEqual(self.profile.to_dict()['stages'], {})
+
+    def test_server_timing(self):
+        with self.profile.stage('fetch'):
+            self.profile.add('fetch', calls=3, bytes=100)
+            self.timer.now += 0.25
+
+        self.assertEqual(self.profile.server_timing(),
+                         'fetch;dur=250.0;desc="calls=3 bytes=100 errors=0", '
+                         'total;dur=250.0')
+
+    def test_log(self):
+        with self.assertLogs('microsetta_admin.profile_util') as logs:
+            self.profile.log(samples=5)
+
+        prefix, line = logs.records[0].getMessage().split(' ', 1)
+        self.assertEqual(prefix, 'profile')
+        self.assertEqual(json.loads(line), {'name': 'test', 'seconds': 0,
+                                            'stages': {}, 'samples': 5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,28 @@
+import io
 import json
+import logging
+import tempfile
+import threading
+import unittest
+import zipfile
 from copy import deepcopy
+from unittest.mock import patch
 
+import pandas as pd
+import pandas.testing as pdt
+from flask.logging import default_handler
+
+from microsetta_admin.job_util import JobRunner
+from microsetta_admin.server import PLATE_WELLS, SCAN_CONTEXT_CACHE
 from microsetta_admin.tests.base import TestBase
 
+try:
+    import pyarrow  # noqa
+except ImportError:
+    HAS_PYARROW = False
+else:
+    HAS_PYARROW = True
+
 DUMMY_DAK_ORDER = {'contact_phone_number': '(858) 555-1212',
                    'projects': ['1', '32'],
                    'dak_article_code': '3510001E',
@@ -51,6 +71,7 @@ class DummyResponse(object):
     def __init__(self, status_code, output_dict):
         self.status_code = status_code
         self.text = json.dumps(output_dict)
+        self.content = self.text.encode('utf-8')
         self.json = lambda: output_dict
 
 
@@ -185,13 +206,24 @@ class RouteTests(TestBase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Query not found', response.data)
 
+    def _route_get(self, routes):
+        # upstream requests may be issued concurrently, so responses are
+        # matched on the URL requested rather than the order of requests
+        def get(url, **kwargs):
+            for fragment, response in routes.items():
+                if fragment in url:
+                    return response
+            raise AssertionError("Unexpected request: %s" % url)
+
+        self.mock_get.side_effect = get
+
     def test_scan_simple(self):
         response = self.app.get('/scan', follow_redirects=True)
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'<h3>Microsetta Scan</h3>', response.data)
 
     def test_scan_specific_no_warnings(self):
-        resp1 = {
+        resp = {
             "barcode_info": {"barcode": "000004216"},
             "projects_info": [],
             "scans_info": [],
@@ -203,22 +235,10 @@ class RouteTests(TestBase):
             "account": {'id': 'd8592c74-9694-2135-e040-8a80115d6401'}
         }
 
-        resp2 = {
-            "barcode_info": {"barcode": "000004216"},
-            "projects_info": [],
-            "scans_info": [],
-            "latest_scan": None,
-            "sample": {'site': 'baz'},
-            "source": {'name': 'a source a name',
-                       'source_type': 'human',
-                       'source_data': {'description': None}},
-            "account": {'id': 'd8592c74-9694-2135-e040-8a80115d6401'}
-        }
-
-        api_get_1 = DummyResponse(200, resp1)
-        api_get_2 = DummyResponse(200, resp2)
-        api_get_3 = DummyResponse(200, [])
-        self.mock_get.side_effect = [api_get_1, api_get_2, api_get_3]
+        self._route_get({
+            '/api/admin/scan/observations/': DummyResponse(200, []),
+            '/api/admin/search/samples/': DummyResponse(200, resp),
+            '/api/admin/events/accounts/': DummyResponse(200, [])})
 
         response = self.app.get('/scan?sample_barcode=000004216',
                                 follow_redirects=True)
@@ -228,24 +248,7 @@ class RouteTests(TestBase):
         self.assertNotIn(b'Status Warnings:', response.data)
 
     def test_scan_specific_no_collection_info_warning(self):
-        resp1 = {
-            "barcode_info": {"barcode": "000004216"},
-            "projects_info": [{
-                "project": "American Gut Project",
-                "is_microsetta": True,
-                "bank_samples": False,
-                "plating_start_date": None
-            }],
-            "scans_info": [],
-            "latest_scan": None,
-            "sample": {'datetime_collected': None},
-            "account": {'id': "ThizIzNotReal"},
-            "source": {'name': 'a source a name',
-                       'source_type': 'human',
-                       'source_data': {'description': None}},
-        }
-
-        resp2 = {
+        resp = {
             "barcode_info": {"barcode": "000004216"},
             "projects_info": [{
                 "project": "American Gut Project",
@@ -262,10 +265,10 @@ class RouteTests(TestBase):
                        'source_data': {'description': None}},
         }
 
-        api_get_1 = DummyResponse(200, resp1)
-        api_get_2 = DummyResponse(200, resp2)
-        api_get_3 = DummyResponse(200, [])
-        self.mock_get.side_effect = [api_get_1, api_get_2, api_get_3]
+        self._route_get({
+            '/api/admin/scan/observations/': DummyResponse(200, []),
+            '/api/admin/search/samples/': DummyResponse(200, resp),
+            '/api/admin/events/accounts/': DummyResponse(200, [])})
 
         response = self.app.get('/scan?sample_barcode=000004216',
                                 follow_redirects=True)
@@ -275,36 +278,23 @@ class RouteTests(TestBase):
         self.assertIn(b'Status Warning: no-collection-info', response.data)
 
     def test_scan_specific_no_associated_source_warning(self):
-        resp1 = {"barcode_info": {"barcode": "000004216"},
-                 "projects_info": [{
-                     "project": "American Gut Project",
-                     "is_microsetta": True,
-                     "bank_samples": False,
-                     "plating_start_date": None
-                 }],
-                 "scans_info": [],
-                 "latest_scan": None,
-                 "sample": None,
-                 "account": {"id": "foo"},
-                 "source": None}
-
-        resp2 = {"barcode_info": {"barcode": "000004216"},
-                 "projects_info": [{
-                     "project": "American Gut Project",
-                     "is_microsetta": True,
-                     "bank_samples": False,
-                     "plating_start_date": None
-                 }],
-                 "scans_info": [],
-                 "latest_scan": None,
-                 "sample": None,
-                 "account": {"id": "foo"},
-                 "source": None}
-
-        api_get_1 = DummyResponse(200, resp1)
-        api_get_2 = DummyResponse(200, resp2)
-        api_get_3 = DummyResponse(200, [])
-        self.mock_get.side_effect = [api_get_1, api_get_2, api_get_3]
+        resp = {"barcode_info": {"barcode": "000004216"},
+                "projects_info": [{
+                    "project": "American Gut Project",
+                    "is_microsetta": True,
+                    "bank_samples": False,
+                    "plating_start_date": None
+                }],
+                "scans_info": [],
+                "latest_scan": None,
+                "sample": None,
+                "account": {"id": "foo"},
+                "source": None}
+
+        self._route_get({
+            '/api/admin/scan/observations/': DummyResponse(200, []),
+            '/api/admin/search/samples/': DummyResponse(200, resp),
+            '/api/admin/events/accounts/': DummyResponse(200, [])})
 
         response = self.app.get('/scan?sample_barcode=000004216',
                                 follow_redirects=True)
@@ -313,6 +303,264 @@ class RouteTests(TestBase):
         self.assertIn(b'<td>000004216</td>', response.data)
         self.assertIn(b'Status Warning: no-associated-source', response.data)
 
+    def test_scan_fetches_concurrently(self):
+        resp = {"barcode_info": {"barcode": "000004216"},
+                "projects_info": [],
+                "scans_info": [],
+                "latest_scan": None,
+                "sample": {'site': 'baz'},
+                "source": None,
+                "account": {"id": "foo"}}
+        routes = {
+            '/api/admin/scan/observations/': DummyResponse(200, []),
+            '/api/admin/search/samples/': DummyResponse(200, resp),
+            '/api/admin/events/accounts/': DummyResponse(200, [])}
+
+        # the sample and observations are only returned once both have been
+        # requested, so the page cannot load if they are fetched in sequence
+        both_requested = threading.Barrier(2, timeout=5)
+        requested = []
+
+        def get(url, **kwargs):
+            fragment, = [f for f in routes if f in url]
+            requested.append(fragment)
+            if fragment != '/api/admin/events/accounts/':
+                both_requested.wait()
+            return routes[fragment]
+
+        self.mock_get.side_effect = get
+        response = self.app.get('/scan?sample_barcode=000004216')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(requested[-1], '/api/admin/events/accounts/')
+        self.assertEqual(len(requested), 3)
+
+    def _scan_routes(self, latest_scan=None):
+        resp = {"barcode_info": {"barcode": "000004216"},
+                "projects_info": [],
+                "scans_info": [],
+                "latest_scan": latest_scan,
+                "sample": {'site': 'baz'},
+                "source": None,
+                "account": {"id": "foo"}}
+        self._route_get({
+            '/api/admin/scan/observations/': DummyResponse(200, []),
+            '/api/admin/search/samples/': DummyResponse(200, resp),
+            '/api/admin/events/accounts/': DummyResponse(200, [])})
+
+    def _post_scan(self, **form):
+        data = {'sample_barcode': '000004216',
+                'technician_notes': 'notes',
+                'sample_status': 'sample-is-valid'}
+        data.update(form)
+        return self.app.post('/scan', data=data, follow_redirects=True)
+
+    def test_scan_post_reuses_sample_context(self):
+        self._scan_routes()
+        self.app.get('/scan?sample_barcode=000004216')
+        self.assertEqual(self.mock_get.call_count, 3)
+
+        self.mock_get.reset_mock()
+        self.mock_post.return_value = DummyResponse(201, 'scan-id')
+        response = self._post_scan()
+        self.assertEqual(response.status_code, 200)
+
+        # only the sample is requested again: by the POST, to check its
+        # status against the database, and by the redirected GET, as its
+        # scans changed
+        self.assertEqual(self.mock_post.call_count, 1)
+        requested = [call[0][0] for call in self.mock_get.call_args_list]
+        self.assertEqual(len(requested), 2)
+        for url in requested:
+            self.assertIn('/api/admin/search/samples/000004216', url)
+
+    def test_scan_post_email_refreshes_events(self):
+        self._scan_routes()
+        self.app.get('/scan?sample_barcode=000004216')
+
+        self.mock_get.reset_mock()
+        self.mock_post.side_effect = [DummyResponse(201, 'scan-id'),
+                                      DummyResponse(200, '')]
+        self._post_scan(action='send_email', template='sample_is_valid',
+                        issue_type='sample')
+
+        self.assertIn('/api/admin/email',
+                      self.mock_post.call_args_list[1][0][0])
+        requested = sorted(call[0][0].split('/')[5]
+                           for call in self.mock_get.call_args_list)
+        self.assertEqual(requested, ['events', 'search', 'search'])
+
+    def test_scan_post_email_checks_current_status(self):
+        # the page was loaded before the status was changed elsewhere, such
+        # as from another tab
+        self._scan_routes()
+        self.app.get('/scan?sample_barcode=000004216')
+        self._scan_routes(latest_scan={'sample_status': 'sample-is-valid'})
+
+        self.mock_post.return_value = DummyResponse(201, 'scan-id')
+        response = self._post_scan(action='send_email',
+                                   template='sample_is_valid',
+                                   issue_type='sample')
+
+        self.assertIn(b'Ignoring Send Email', response.data)
+        self.assertEqual(self.mock_post.call_count, 1)
+
+    def test_scan_post_error_displayed(self):
+        self._scan_routes()
+        self.mock_post.return_value = DummyResponse(400, 'Invalid status')
+
+        response = self._post_scan()
+        self.assertIn(b'Invalid status', response.data)
+
+        # the error is only shown once
+        response = self.app.get('/scan?sample_barcode=000004216')
+        self.assertNotIn(b'Invalid status', response.data)
+
+    def test_scan_post_session_expired(self):
+        self._scan_routes()
+        self.mock_post.return_value = DummyResponse(401, {})
+
+        response = self.app.post('/scan', data={
+            'sample_barcode': '000004216',
+            'technician_notes': 'notes',
+            'sample_status': 'sample-is-valid'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith('/logout'))
+        with self.app.session_transaction() as sess:
+            self.assertNotIn('scan_update_error', sess)
+
+    def test_scan_post_error_truncated(self):
+        self._scan_routes()
+        self.mock_post.return_value = DummyResponse(500, 'x' * 10000)
+
+        self.app.post('/scan', data={'sample_barcode': '000004216',
+                                     'technician_notes': 'notes',
+                                     'sample_status': 'sample-is-valid'})
+
+        # the error is kept as text, and short enough for the cookie
+        with self.app.session_transaction() as sess:
+            error = sess['scan_update_error']
+        self.assertEqual(len(error), 500)
+        self.assertTrue(error.startswith('"xxx'))
+
+    def _post_plate(self, manifest):
+        data = {'file': (io.BytesIO(manifest), 'plate.csv')}
+        return self.app.post('/scan/plate', data=data,
+                             content_type='multipart/form-data')
+
+    def test_scan_plate_simple(self):
+        response = self.app.get('/scan/plate')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<h3>Microsetta Plate Scan</h3>', response.data)
+        self.assertNotIn(b'id="plate"', response.data)
+
+    def test_scan_plate_manifest(self):
+        resp = {"barcode_info": {"barcode": "000004216"},
+                "projects_info": [{"project": "American Gut Project",
+                                   "is_microsetta": True,
+                                   "bank_samples": False,
+                                   "plating_start_date": None}],
+                "scans_info": [],
+                "latest_scan": {"sample_status": "sample-is-valid"},
+                "sample": {'site': 'Stool'},
+                "source": {'source_type': 'human'},
+                "account": {"id": "foo"}}
+        self._route_get({
+            '/api/admin/search/samples/missing': DummyResponse(404, {}),
+            '/api/admin/scan/observations/': DummyResponse(200, []),
+            '/api/admin/search/samples/': DummyResponse(200, resp),
+            '/api/admin/events/accounts/': DummyResponse(200, [])})
+
+        response = self._post_plate(b'sample_name,well\n'
+                                    b'000004216,B01\n'
+                                    b'missing1,A2\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'id="well_B1"', response.data)
+        self.assertIn(b'id="well_A2"', response.data)
+
+        # the wells are in plate order, with the detail of each sample
+        wells = json.loads(response.get_data(as_text=True).split(
+            'const wells = ')[1].split(';\n')[0])
+        self.assertEqual([w['well'] for w in wells], ['A2', 'B1'])
+        self.assertEqual(wells[0]['error'], 'Barcode missing1 Not Found')
+        self.assertEqual(wells[1]['latest_status'], 'sample-is-valid')
+        self.assertEqual(wells[1]['projects'], ['American Gut Project'])
+        self.assertEqual(wells[1]['site'], 'Stool')
+
+    def test_scan_plate_scanned_barcodes(self):
+        self._scan_routes()
+        response = self.app.post('/scan/plate', data={
+            'barcodes': '000004216\n000004217\n'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'id="well_A1"', response.data)
+        self.assertIn(b'id="well_A2"', response.data)
+
+    def test_scan_plate_fits_context_cache(self):
+        # a plate caches the sample, events and observations of each well,
+        # which must not evict one another
+        self.assertGreater(SCAN_CONTEXT_CACHE.maxsize, 3 * len(PLATE_WELLS))
+
+    def test_scan_plate_manifest_errors(self):
+        response = self._post_plate(b'sample_name,well\n000004216,I1\n')
+        self.assertIn(b'Unknown well: I1', response.data)
+
+        response = self._post_plate(b'sample_name,well\n'
+                                    b'000004216,A1\n000004217,A01\n')
+        self.assertIn(b'Well A1 holds more than one sample', response.data)
+
+        response = self.app.post('/scan/plate', data={'barcodes': ''})
+        self.assertIn(b'Must specify a valid file', response.data)
+        self.assertEqual(self.mock_get.call_count, 0)
+
+    def test_scan_plate_update(self):
+        self._scan_routes()
+        self.app.get('/scan?sample_barcode=000004216')
+        self.mock_get.reset_mock()
+
+        self.mock_post.return_value = DummyResponse(201, 'scan-id')
+        response = self.app.post('/scan/plate/update', json={
+            'sample_barcode': '000004216',
+            'sample_status': 'sample-is-valid',
+            'technician_notes': 'notes',
+            'observations': ['1']})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json(),
+                         {'sample_barcode': '000004216',
+                          'sample_status': 'sample-is-valid',
+                          'error': None})
+        self.assertEqual(self.mock_post.call_args[1]['json'],
+                         {'sample_status': 'sample-is-valid',
+                          'technician_notes': 'notes',
+                          'observations': ['1']})
+
+        # the sample's scans are requested again when it is next shown
+        self.app.get('/scan?sample_barcode=000004216')
+        requested = [call[0][0] for call in self.mock_get.call_args_list]
+        self.assertEqual(len(requested), 1)
+        self.assertIn('/api/admin/search/samples/000004216', requested[0])
+
+    def test_scan_plate_update_failure(self):
+        self.mock_post.return_value = DummyResponse(400, 'Invalid status')
+        response = self.app.post('/scan/plate/update', json={
+            'sample_barcode': '000004216',
+            'sample_status': 'sample-is-valid'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid status', response.get_json()['error'])
+
+        self.mock_post.return_value = DummyResponse(503, 'Unavailable')
+        response = self.app.post('/scan/plate/update', json={
+            'sample_barcode': '000004216',
+            'sample_status': 'sample-is-valid'})
+        self.assertEqual(response.status_code, 502)
+
+    def test_scan_plate_update_invalid_status(self):
+        response = self.app.post('/scan/plate/update', json={
+            'sample_barcode': '000004216',
+            'sample_status': 'not-a-status'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['sample_barcode'], '000004216')
+        self.assertEqual(self.mock_post.call_count, 0)
+
     def test_scan_specific_no_registered_account_warning(self):
         resp = {"barcode_info": {"barcode": "000004216"},
                 "projects_info": [{
@@ -353,6 +601,390 @@ class RouteTests(TestBase):
         self.assertIn(b'Status Warning: received-unknown-validity',
                       response.data)
 
+    def test_metadata_pulldown_simple(self):
+        response = self.app.get('/metadata_pulldown', follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<h3>Microsetta Metadata Pulldown</h3>',
+                      response.data)
+
+    def test_metadata_pulldown_streams_tsv(self):
+        df = pd.DataFrame([['foo', 'Stool'], ['bar', 'Saliva']],
+                          columns=['host_subject_id', 'sample_type'],
+                          index=pd.Index(['000004216', '000004217'],
+                                         name='sample_name'))
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            mock_retrieve.return_value = (df, [])
+            response = self.app.get('/metadata_pulldown?'
+                                    'sample_barcode=000004216')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'text/tab-separated-values')
+        self.assertIn('filename=metadata_pulldown.tsv',
+                      response.headers['Content-Disposition'])
+        self.assertEqual(response.get_data(),
+                         b'sample_name\thost_subject_id\tsample_type\n'
+                         b'000004216\tfoo\tStool\n'
+                         b'000004217\tbar\tSaliva\n')
+        self.assertIn('drop_private;dur=', response.headers['Server-Timing'])
+
+    def test_metadata_pulldown_profile(self):
+        df = pd.DataFrame([['foo', 'Stool']],
+                          columns=['host_subject_id', 'sample_type'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            mock_retrieve.return_value = (df, [])
+            response = self.app.get('/metadata_pulldown?'
+                                    'sample_barcode=000004216&profile=on')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertIn('filename=metadata_pulldown.zip',
+                      response.headers['Content-Disposition'])
+        self.assertIn('serialize;dur=', response.headers['Server-Timing'])
+
+        with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+            self.assertEqual(archive.namelist(),
+                             ['metadata_pulldown.tsv', 'profile.json'])
+            self.assertEqual(archive.read('metadata_pulldown.tsv'),
+                             b'sample_name\thost_subject_id\tsample_type\n'
+                             b'000004216\tfoo\tStool\n')
+            profile = json.loads(archive.read('profile.json'))
+        self.assertEqual(profile['name'], 'metadata_pulldown')
+        self.assertEqual(set(profile['stages']),
+                         {'drop_private', 'serialize'})
+
+    def test_profile_logged(self):
+        # the profile must reach a handler without configuring logging
+        logger = logging.getLogger('microsetta_admin.profile_util')
+        self.assertTrue(logger.isEnabledFor(logging.INFO))
+        self.assertIn(default_handler,
+                      logging.getLogger('microsetta_admin').handlers)
+
+    def test_metadata_pulldown_errors(self):
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            mock_retrieve.return_value = (pd.DataFrame(),
+                                          [{'barcode': 'missing',
+                                            'error': '404 from api'}])
+            response = self.app.get('/metadata_pulldown?'
+                                    'sample_barcode=missing')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'404 from api', response.data)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed")
+    def test_metadata_pulldown_parquet(self):
+        df = pd.DataFrame([['foo', 'Stool'], ['bar', 'Stool']],
+                          columns=['host_subject_id', 'sample_type'],
+                          index=pd.Index(['000004216', '000004217'],
+                                         name='sample_name'))
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            mock_retrieve.return_value = (df, [])
+            response = self.app.get('/metadata_pulldown?'
+                                    'sample_barcode=000004216&'
+                                    'output_format=parquet')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/vnd.apache.parquet')
+        self.assertIn('filename=metadata_pulldown.parquet',
+                      response.headers['Content-Disposition'])
+        obs = pd.read_parquet(io.BytesIO(response.get_data()))
+        pdt.assert_frame_equal(obs.astype(str), df)
+
+    def test_metadata_pulldown_columns(self):
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            mock_retrieve.return_value = (df, [])
+            response = self.app.get('/metadata_pulldown?'
+                                    'sample_barcode=000004216&'
+                                    'columns=host_subject_id,+age_years&'
+                                    'columns=bmi')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_retrieve.call_args[1]['columns'],
+                         ['host_subject_id', 'age_years', 'bmi'])
+
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            mock_retrieve.return_value = (df, [])
+            self.app.get('/metadata_pulldown?sample_barcode=000004216&'
+                         'columns=')
+        self.assertIsNone(mock_retrieve.call_args[1]['columns'])
+
+    def test_metadata_pulldown_unknown_format(self):
+        with patch('microsetta_admin.server.metadata_util.'
+                   'retrieve_metadata') as mock_retrieve:
+            response = self.app.get('/metadata_pulldown?'
+                                    'sample_barcode=000004216&'
+                                    'output_format=xlsx')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Unknown output format: xlsx', response.data)
+        mock_retrieve.assert_not_called()
+
+    def _submit_pulldown_job(self, df, errors, allow_missing=False,
+                             output_format=None, save_profile=False):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        jobs = JobRunner(root=tmp.name, max_workers=1)
+
+        def retrieve(barcodes, progress, **kwargs):
+            for barcode in barcodes:
+                progress(barcode, None)
+            return df, errors
+
+        for patcher in (patch('microsetta_admin.server.PULLDOWN_JOBS', jobs),
+                        patch('microsetta_admin.store_util.CHECKPOINT_DIR',
+                              tmp.name),
+                        patch('microsetta_admin.server.parse_jwt',
+                              return_value={'email': 'jd@example.com'}),
+                        patch('microsetta_admin.server.metadata_util.'
+                              'retrieve_metadata', side_effect=retrieve)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        with self.app.session_transaction() as sess:
+            sess['token'] = 'foo'
+
+        data = {'file': (io.BytesIO(b'sample_name\n000004216\n'),
+                         'barcodes.csv'),
+                'run_in_background': 'on'}
+        if allow_missing:
+            data['allow_missing_samples'] = 'on'
+        if output_format is not None:
+            data['output_format'] = output_format
+        if save_profile:
+            data['profile'] = 'on'
+
+        response = self.app.post('/metadata_pulldown', data=data,
+                                 content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 303)
+
+        job_id = response.location.rsplit('/', 1)[-1]
+        jobs.wait(job_id, timeout=5)
+        return job_id
+
+    def test_metadata_pulldown_job(self):
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        job_id = self._submit_pulldown_job(df, [])
+
+        response = self.app.get('/metadata_pulldown/jobs/%s' % job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Download metadata', response.data)
+
+        response = self.app.get('/metadata_pulldown/jobs/%s/status' % job_id)
+        status = response.get_json()
+        self.assertEqual(status['state'], 'complete')
+        self.assertEqual(status['fetched'], 1)
+        self.assertEqual(status['total'], 1)
+
+        response = self.app.get(status['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(),
+                         b'sample_name\thost_subject_id\n'
+                         b'000004216\tfoo\n')
+
+        response = self.app.get('/metadata_pulldown/jobs/missing/status')
+        self.assertEqual(response.status_code, 404)
+
+    def test_metadata_pulldown_job_owner_only(self):
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        job_id = self._submit_pulldown_job(df, [])
+
+        # how the job is managed is not reported
+        response = self.app.get('/metadata_pulldown/jobs/%s/status' % job_id)
+        status = response.get_json()
+        for field in ('host', 'pid', 'owner'):
+            self.assertNotIn(field, status)
+
+        with patch('microsetta_admin.server.parse_jwt',
+                   return_value={'email': 'other@example.com'}):
+            for suffix in ('', '/status', '/download'):
+                response = self.app.get('/metadata_pulldown/jobs/%s%s' %
+                                        (job_id, suffix))
+                self.assertEqual(response.status_code, 404)
+
+    @unittest.skipIf(not HAS_PYARROW, "pyarrow is not installed")
+    def test_metadata_pulldown_job_arrow(self):
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        job_id = self._submit_pulldown_job(df, [], output_format='arrow')
+
+        response = self.app.get('/metadata_pulldown/jobs/%s/download' %
+                                job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype,
+                         'application/vnd.apache.arrow.file')
+        self.assertIn('filename=metadata_pulldown.arrow',
+                      response.headers['Content-Disposition'])
+        obs = pd.read_feather(io.BytesIO(response.get_data()))
+        pdt.assert_frame_equal(obs.astype(str), df)
+
+    def test_metadata_pulldown_job_profile(self):
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        with self.assertLogs('microsetta_admin.profile_util') as logs:
+            job_id = self._submit_pulldown_job(df, [], save_profile=True)
+
+        line = json.loads(logs.records[-1].getMessage().split(' ', 1)[1])
+        self.assertEqual(line['job_id'], job_id)
+        download = self.app.get('/metadata_pulldown/jobs/%s/download' %
+                                job_id)
+        self.assertEqual(line['stages']['serialize']['bytes'],
+                         len(download.get_data()))
+
+        status = self.app.get('/metadata_pulldown/jobs/%s/status' %
+                              job_id).get_json()
+        response = self.app.get(status['profile_url'])
+        self.assertEqual(response.status_code, 200)
+        profile = json.loads(response.get_data())
+        self.assertEqual(set(profile['stages']),
+                         {'drop_private', 'serialize'})
+
+    def test_metadata_pulldown_job_without_profile(self):
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        job_id = self._submit_pulldown_job(df, [])
+
+        status = self.app.get('/metadata_pulldown/jobs/%s/status' %
+                              job_id).get_json()
+        self.assertNotIn('profile_url', status)
+        response = self.app.get('/metadata_pulldown/jobs/%s/profile' %
+                                job_id)
+        self.assertEqual(response.status_code, 404)
+
+    def test_metadata_pulldown_job_errors(self):
+        errors = [{'barcode': '000004216', 'error': '404 from api'}]
+        job_id = self._submit_pulldown_job(pd.DataFrame(), errors)
+
+        response = self.app.get('/metadata_pulldown/jobs/%s/status' % job_id)
+        status = response.get_json()
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['errors'], errors)
+        self.assertNotIn('download_url', status)
+
+        response = self.app.get('/metadata_pulldown/jobs/%s/download' %
+                                job_id)
+        self.assertEqual(response.status_code, 404)
+
+    def test_metadata_pulldown_job_allow_missing(self):
+        errors = [{'barcode': '000004217', 'error': '404 from api'}]
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        job_id = self._submit_pulldown_job(df, errors, allow_missing=True)
+
+        response = self.app.get('/metadata_pulldown/jobs/%s/status' % job_id)
+        status = response.get_json()
+        self.assertEqual(status['state'], 'complete')
+        self.assertEqual(status['errors'], errors)
+
+    def test_metadata_pulldown_retry(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        df = pd.DataFrame([['foo']], columns=['host_subject_id'],
+                          index=pd.Index(['000004216'], name='sample_name'))
+        outcomes = [(pd.DataFrame(),
+                     [{'barcode': '000004216', 'error': '503 from api'}]),
+                    (df, [])]
+
+        with patch('microsetta_admin.store_util.CHECKPOINT_DIR', tmp.name), \
+                patch('microsetta_admin.server.metadata_util.'
+                      'retrieve_metadata',
+                      side_effect=outcomes) as mock_retrieve:
+            data = {'file': (io.BytesIO(b'sample_name\n000004216\n'),
+                             'barcodes.csv')}
+            response = self.app.post('/metadata_pulldown', data=data,
+                                     content_type='multipart/form-data')
+            self.assertIn(b'503 from api', response.data)
+            self.assertIn(b'Retry failed barcodes', response.data)
+            checkpoint = mock_retrieve.call_args[1]['checkpoint']
+
+            response = self.app.post(
+                '/metadata_pulldown',
+                data={'checkpoint': checkpoint.checkpoint_id})
+            self.assertEqual(response.get_data(),
+                             b'sample_name\thost_subject_id\n'
+                             b'000004216\tfoo\n')
+            args, kwargs = mock_retrieve.call_args
+            self.assertEqual(args, (['000004216'], ))
+            self.assertEqual(kwargs['checkpoint'].checkpoint_id,
+                             checkpoint.checkpoint_id)
+
+            # the checkpoint is discarded once the pulldown succeeds
+            response = self.app.post(
+                '/metadata_pulldown',
+                data={'checkpoint': checkpoint.checkpoint_id})
+            self.assertIn(b'longer available', response.data)
+
+    def test_metadata_pulldown_retry_other_user(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        outcome = (pd.DataFrame(),
+                   [{'barcode': '000004216', 'error': '503 from api'}])
+
+        with self.app.session_transaction() as sess:
+            sess['token'] = 'foo'
+
+        with patch('microsetta_admin.store_util.CHECKPOINT_DIR', tmp.name), \
+                patch('microsetta_admin.server.parse_jwt') as mock_jwt, \
+                patch('microsetta_admin.server.metadata_util.'
+                      'retrieve_metadata',
+                      return_value=outcome) as mock_retrieve:
+            mock_jwt.return_value = {'email': 'jd@example.com'}
+            data = {'file': (io.BytesIO(b'sample_name\n000004216\n'),
+                             'barcodes.csv')}
+            response = self.app.post('/metadata_pulldown', data=data,
+                                     content_type='multipart/form-data')
+            self.assertIn(b'Retry failed barcodes', response.data)
+            checkpoint = mock_retrieve.call_args[1]['checkpoint']
+
+            # the checkpoint is not available to another user
+            mock_jwt.return_value = {'email': 'other@example.com'}
+            for data in ({'checkpoint': checkpoint.checkpoint_id},
+                         {'checkpoint': checkpoint.checkpoint_id,
+                          'run_in_background': 'on'}):
+                response = self.app.post('/metadata_pulldown', data=data)
+                self.assertIn(b'longer available', response.data)
+            self.assertEqual(mock_retrieve.call_count, 1)
+
+            # while its owner may still resume it
+            mock_jwt.return_value = {'email': 'jd@example.com'}
+            response = self.app.post(
+                '/metadata_pulldown',
+                data={'checkpoint': checkpoint.checkpoint_id})
+            self.assertIn(b'503 from api', response.data)
+            self.assertEqual(mock_retrieve.call_args[1]['checkpoint']
+                             .checkpoint_id, checkpoint.checkpoint_id)
+
+    def test_metadata_pulldown_checkpoints_disabled(self):
+        outcome = (pd.DataFrame(),
+                   [{'barcode': '000004216', 'error': '503 from api'}])
+
+        with patch('microsetta_admin.store_util.CHECKPOINT_DIR', None), \
+                patch('microsetta_admin.server.metadata_util.'
+                      'retrieve_metadata',
+                      return_value=outcome) as mock_retrieve:
+            data = {'file': (io.BytesIO(b'sample_name\n000004216\n'),
+                             'barcodes.csv')}
+            response = self.app.post('/metadata_pulldown', data=data,
+                                     content_type='multipart/form-data')
+
+        self.assertIn(b'503 from api', response.data)
+        self.assertNotIn(b'Retry failed barcodes', response.data)
+        self.assertIsNone(mock_retrieve.call_args[1]['checkpoint'])
+
+    def test_metadata_pulldown_job_requires_login(self):
+        response = self.app.get('/metadata_pulldown/jobs/foo/status')
+        self.assertEqual(response.status_code, 401)
+
     def test_create_kits_get_success(self):
         proj_list = deepcopy(self.PROJ_LIST)
         self.mock_get.return_value = DummyResponse(200, proj_list)
@@ -444,6 +1076,46 @@ class RouteTests(TestBase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Unable to load project list', response.data)
 
+    def test_projects_cached(self):
+        self.mock_get.return_value = DummyResponse(200, self.PROJ_LIST)
+
+        self.app.get('/create_kits')
+        response = self.app.get('/create_kits')
+        self.assertIn(b'<option value=\'12\'>New proj</option>',
+                      response.data)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+        # a list of differing detail is requested separately
+        self.app.get('/manage_projects?is_active=true')
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_projects_failure_not_cached(self):
+        self.mock_get.return_value = DummyResponse(400, "")
+        self.app.get('/create_kits')
+
+        self.mock_get.return_value = DummyResponse(200, self.PROJ_LIST)
+        response = self.app.get('/create_kits')
+        self.assertIn(b'<option value=\'12\'>New proj</option>',
+                      response.data)
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_projects_cache_invalidated_by_update(self):
+        self.mock_get.return_value = DummyResponse(200, self.PROJ_LIST)
+        self.app.get('/create_kits')
+
+        renamed = deepcopy(self.PROJ_LIST)
+        renamed[1]['project_name'] = 'Renamed proj'
+        self.mock_get.return_value = DummyResponse(200, renamed)
+        self.mock_put.return_value = DummyResponse(204, {})
+
+        update_input = deepcopy(renamed[1])
+        update_input.pop('computed_stats')
+        self.app.post('/manage_projects', data=update_input)
+
+        response = self.app.get('/create_kits')
+        self.assertIn(b'<option value=\'12\'>Renamed proj</option>',
+                      response.data)
+
     def test_get_submit_daklapack_order_success(self):
         # server side issues three GETs to the API
         api_get_1 = DummyResponse(200, DAK_SHIPPING)
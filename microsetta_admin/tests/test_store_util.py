@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from microsetta_admin.store_util import Checkpoint, PayloadStore
+
+
+class PayloadStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = PayloadStore(os.path.join(self.tmp.name, 'foo.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_put_get_many(self):
+        self.store.put('a', {'foo': [1, 2]})
+        self.store.put('b', 'bar')
+        self.store.put_error('c', {'error': 'baz'})
+
+        obs = self.store.get_many(['a', 'b', 'c', 'd'])
+        self.assertEqual(obs, {'a': {'foo': [1, 2]}, 'b': 'bar'})
+        self.assertEqual(self.store.errors(), {'c': {'error': 'baz'}})
+
+        # a successful outcome replaces an error, and vice versa
+        self.store.put('c', 'fixed')
+        self.store.put_error('a', 'broken')
+        self.assertEqual(self.store.get_many(['a', 'c']), {'c': 'fixed'})
+        self.assertEqual(self.store.errors(), {'a': 'broken'})
+
+    def test_get_many_many_keys(self):
+        keys = ['%d' % i for i in range(1234)]
+        for key in keys:
+            self.store.put(key, key)
+        self.assertEqual(self.store.get_many(keys),
+                         {key: key for key in keys})
+
+    def test_get_many_max_age(self):
+        with patch('microsetta_admin.store_util.time.time',
+                   return_value=1000):
+            self.store.put('a', 'old')
+        with patch('microsetta_admin.store_util.time.time',
+                   return_value=2000):
+            self.store.put('b', 'new')
+            obs = self.store.get_many(['a', 'b'], max_age=500)
+        self.assertEqual(obs, {'b': 'new'})
+
+    def test_delete(self):
+        for key in 'abc':
+            self.store.put(key, key)
+        self.store.delete(['a', 'b'])
+        self.assertEqual(self.store.get_many('abc'), {'c': 'c'})
+        self.store.delete()
+        self.assertEqual(self.store.get_many('abc'), {})
+
+    def test_attributes(self):
+        self.assertEqual(self.store.get_attribute('foo', 'bar'), 'bar')
+        self.store.set_attribute('foo', [1, 2])
+        self.assertEqual(self.store.get_attribute('foo'), [1, 2])
+
+    def test_owner_only(self):
+        self.assertEqual(os.stat(self.store.path).st_mode & 0o777, 0o600)
+
+    def test_shared_file(self):
+        self.store.put('a', 'b')
+        other = PayloadStore(self.store.path)
+        self.assertEqual(other.get_many(['a']), {'a': 'b'})
+        other.close()
+
+
+class CheckpointTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_create_load(self):
+        checkpoint = Checkpoint.create(['a', 'b', 'c'], root=self.tmp.name)
+        checkpoint.record('a', {'foo': 'bar'}, None)
+        checkpoint.record('b', None, {'barcode': 'b', 'error': 'broken'})
+        checkpoint.close()
+
+        checkpoint = Checkpoint.load(checkpoint.checkpoint_id,
+                                     root=self.tmp.name)
+        self.assertEqual(checkpoint.sample_barcodes, ['a', 'b', 'c'])
+        self.assertEqual(checkpoint.restore(['a', 'b', 'c']),
+                         {'a': {'foo': 'bar'}})
+        self.assertEqual(checkpoint.restored, ['a'])
+        self.assertEqual(checkpoint.retried, ['b'])
+
+        checkpoint.discard()
+        self.assertEqual(os.listdir(self.tmp.name), [])
+        self.assertIsNone(Checkpoint.load(checkpoint.checkpoint_id,
+                                          root=self.tmp.name))
+
+    def test_load_other_owner(self):
+        checkpoint = Checkpoint.create(['a'], owner='jd@example.com',
+                                       root=self.tmp.name)
+        checkpoint.close()
+
+        self.assertIsNone(Checkpoint.load(checkpoint.checkpoint_id,
+                                          owner='other@example.com',
+                                          root=self.tmp.name))
+        self.assertIsNone(Checkpoint.load(checkpoint.checkpoint_id,
+                                          root=self.tmp.name))
+
+        checkpoint = Checkpoint.load(checkpoint.checkpoint_id,
+                                     owner='jd@example.com',
+                                     root=self.tmp.name)
+        self.assertEqual(checkpoint.sample_barcodes, ['a'])
+        checkpoint.close()
+
+    def test_create_owner_only(self):
+        root = os.path.join(self.tmp.name, 'checkpoints')
+        checkpoint = Checkpoint.create(['a'], root=root)
+        checkpoint.close()
+        self.assertEqual(os.stat(root).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(checkpoint.store.path).st_mode & 0o777,
+                         0o600)
+
+    def test_disabled(self):
+        with patch('microsetta_admin.store_util.CHECKPOINT_DIR', None):
+            self.assertIsNone(Checkpoint.create(['a']))
+            self.assertIsNone(Checkpoint.load('foo'))
+
+    def test_load_invalid(self):
+        self.assertIsNone(Checkpoint.load('missing', root=self.tmp.name))
+        self.assertIsNone(Checkpoint.load('../foo', root=self.tmp.name))
+        self.assertIsNone(Checkpoint.load(None, root=self.tmp.name))
+
+    def test_create_purges(self):
+        old = Checkpoint.create(['a'], root=self.tmp.name)
+        old.close()
+        os.utime(old.store.path, (0, 0))
+
+        new = Checkpoint.create(['b'], root=self.tmp.name)
+        new.close()
+        self.assertEqual(os.listdir(self.tmp.name),
+                         [os.path.basename(new.store.path)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,3 +19,28 @@ def parse_request_csv_col(request, file_name, col_name):
         return None, 'Could not parse csv file'
 
     return col, None
+
+
+def parse_request_csv_cols(request, file_name, col_names, optional=()):
+    """
+    :param request: Flask request object
+    :param file_name: Name of csv file in flask request
+    :param col_names: Names of columns which must be present in the csv file
+    :param optional: Names of columns to retrieve if present
+    :return: The tuple: (columns: Optional[dict of column name to list],
+                         error: Optional[string])
+    """
+    if file_name not in request.files or \
+            request.files[file_name].filename == '':
+        return None, 'Must specify a valid file'
+
+    request_file = request.files[file_name]
+    try:
+        df = pd.read_csv(request_file, dtype=str, keep_default_na=False)
+        cols = {name: df[name].tolist() for name in col_names}
+    except Exception as e:  # noqa
+        return None, 'Could not parse csv file'
+
+    cols.update({name: df[name].tolist() for name in optional
+                 if name in df.columns})
+    return cols, None
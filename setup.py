@@ -30,6 +30,7 @@ setup(
         'static/*',
         'static/css/*',
         'static/img/*',
+        'static/js/*',
         'static/vendor/*',
         'static/vendor/bootstrap-4.4.1-dist/css/*',
         'static/vendor/bootstrap-4.4.1-dist/js/*',